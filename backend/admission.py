@@ -0,0 +1,175 @@
+"""
+Admission control: per-route-class concurrency budgets
+
+A request that cannot get a pooled DB connection waits in the pool for up to
+pool_timeout (30 s), long after the client has given up and retried. Each
+worker instead admits a bounded number of requests per route class at a time:
+
+- catalog: dining halls, categories, meals, suggestions (cheap, mostly cached)
+- user: per-user reads and writes (the default)
+- heavy: history, range and export, which read many rows per request
+
+A request over its class's concurrency waits in a short queue for up to the
+class's timeout. When the queue is full, or the wait times out, it gets 503
+with Retry-After straight away, so a saturated worker keeps serving the
+requests it admitted at normal latency instead of slowing every request
+down. Keep the concurrencies of all classes at or under the pool size plus
+overflow. Limits apply per worker process, which matters with THREADS > 1
+or under asgi.py, where Flask views run on a thread pool.
+
+Views pick their class with @route_class('heavy'); route_class(None)
+exempts one (event streams, health checks).
+"""
+
+import math
+import threading
+import time
+
+from flask import current_app, g, jsonify, request
+
+import batch
+import metrics
+
+DEFAULT_CLASS = 'user'
+
+# Longest Retry-After we suggest, in seconds
+MAX_RETRY_AFTER = 30
+
+# Weight of the newest request in the running average of time held
+EWMA_WEIGHT = 0.1
+
+
+def route_class(name):
+    """Put a view in an admission class; None means it is never limited. Place right under @api.route"""
+    def decorator(view):
+        view.admission_class = name
+        return view
+    return decorator
+
+
+class Budget:
+    """Concurrency limit with a bounded wait queue for one route class"""
+
+    def __init__(self, name, concurrency, queue, timeout):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue = queue
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        # Running average of how long an admitted request holds its slot
+        self.hold_seconds = 0.05
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Returns None when admitted, else the reason ('queue_full' or 'timeout')"""
+        with self._condition:
+            if self.active < self.concurrency:
+                self.active += 1
+                return None
+            if self.waiting >= self.queue:
+                return 'queue_full'
+            self.waiting += 1
+            deadline = time.monotonic() + self.timeout
+            try:
+                while self.active >= self.concurrency:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return 'timeout'
+                    self._condition.wait(remaining)
+                self.active += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self, held):
+        with self._condition:
+            self.active -= 1
+            self.hold_seconds += (held - self.hold_seconds) * EWMA_WEIGHT
+            self._condition.notify()
+
+    def retry_after(self):
+        """Seconds until the queue ahead of a new request has likely drained"""
+        with self._condition:
+            backlog = self.waiting + self.active
+            hold = self.hold_seconds
+        return min(MAX_RETRY_AFTER, max(1, int(math.ceil(hold * backlog / self.concurrency))))
+
+
+class AdmissionController:
+    """The budgets of one worker, by route class"""
+
+    def __init__(self, limits):
+        self.budgets = {name: Budget(name, **limit) for name, limit in limits.items()}
+
+    def gauges(self):
+        """[(metric name, labels, value)] for /metrics"""
+        values = []
+        for name, budget in sorted(self.budgets.items()):
+            labels = (('class', name),)
+            values.append(('templecals_admission_active', labels, budget.active))
+            values.append(('templecals_admission_waiting', labels, budget.waiting))
+            values.append(('templecals_admission_concurrency', labels, budget.concurrency))
+        return values
+
+
+def _view_class():
+    view = current_app.view_functions.get(request.endpoint)
+    return getattr(view, 'admission_class', DEFAULT_CLASS) if view is not None else None
+
+
+def _admit():
+    if not current_app.config['ADMISSION_ENABLED'] or request.method == 'OPTIONS':
+        return None
+    budget = current_app.extensions['admission'].budgets.get(_view_class())
+    if budget is None:
+        return None
+
+    start = time.perf_counter()
+    reason = budget.acquire()
+    labels = (('class', budget.name),)
+    if reason is None:
+        g.admission = (budget, time.perf_counter())
+        metrics.observe('templecals_admission_wait_seconds', labels, g.admission[1] - start)
+        return None
+
+    metrics.inc('templecals_admission_rejected_total', labels + (('reason', reason),))
+    retry_after = budget.retry_after()
+    response = jsonify({'error': 'Server busy, please retry', 'retry_after': retry_after})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def _release_admitted(admitted):
+    budget, admitted_at = admitted
+    budget.release(time.perf_counter() - admitted_at)
+
+
+def _hold_for_stream(response):
+    # The view of a streamed response (export, event stream) returns before
+    # the body is generated, so the slot is given back when the body closes
+    if response.is_streamed and 'admission' in g:
+        admitted = g.pop('admission')
+        response.call_on_close(lambda: _release_admitted(admitted))
+    return response
+
+
+def _release(exc):
+    # Requests inside /api/batch run under the batch's slot
+    if batch.is_subrequest():
+        return
+    admitted = g.pop('admission', None)
+    if admitted is not None:
+        _release_admitted(admitted)
+
+
+def init_admission(app):
+    controller = app.extensions['admission'] = AdmissionController(app.config['ADMISSION_LIMITS'])
+    metrics.register_gauges(app, controller.gauges)
+    # Scrapes must get through however busy the worker is
+    if 'metrics' in app.view_functions:
+        app.view_functions['metrics'].admission_class = None
+    app.before_request(_admit)
+    app.after_request(_hold_for_stream)
+    app.teardown_request(_release)
@@ -1,45 +1,293 @@
-from flask import Flask, jsonify, request
-from flask_migrate import Migrate
+from flask import Blueprint, Flask, Response, current_app, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from dotenv import load_dotenv
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+import click
+import csv
+import io
+import json
 import os
+import queue
 import re
+import tempfile
+import time
 from datetime import datetime, timedelta
 
-# Load environment variables (like database password)
-load_dotenv()
+from admission import init_admission, route_class
+import batch
+from catalog import init_catalog
+import events
+from database import db
+from embedded import init_embedded
+from metrics import init_metrics
+import partitions
+import popularity
+from profiler import init_profiler
+from ratelimit import init_rate_limits, rate_limited
+from slowlog import init_slowlog
+import reads
+import shards
+import suggest
+import timeseries
+from models import (DiningHall, MealCategory, Meal, User, UserMeal, WeightEntry, GOAL_FIELDS, NUTRITION_FIELDS,
+                    nutrition_totals, user_meal_dict, weight_entry_dict)
 
-app = Flask(__name__)
+# Longest span /api/user-meals/range and /breakdown cover in one response
+MAX_RANGE_DAYS = 366
 
-# Enable CORS so React frontend can connect to this backend
-CORS(app)
+# Groups /api/user-meals/breakdown returns by default and at most
+DEFAULT_BREAKDOWN_LIMIT = 10
+MAX_BREAKDOWN_LIMIT = 50
 
-# Database configuration - tells Flask where to find our database
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'postgresql://localhost/templecals_db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Rows fetched per round trip (server-side cursor batch) when exporting history
+EXPORT_BATCH_SIZE = 1000
 
-# JWT configuration
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'templecals-dev-secret-key-change-in-production')
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+EXPORT_CSV_COLUMNS = [
+    'id', 'date_consumed', 'consumed_at', 'meal_id', 'meal_name', 'dining_hall', 'category',
+    'serving_multiplier', 'total_calories', 'total_protein', 'total_carbs', 'total_fat', 'notes'
+]
 
-# Initialize JWT
-jwt = JWTManager(app)
+# What nutrition_totals() needs from each of a day's entries
+DAY_TOTALS_COLUMNS = (UserMeal.calories, UserMeal.protein, UserMeal.carbs, UserMeal.fat, UserMeal.serving_multiplier)
 
-# Initialize database connection
-from database import db
-db.init_app(app)
-migrate = Migrate(app, db)
+# Most entries /api/user-meals/changes returns per response
+CHANGES_PAGE_SIZE = 500
+
+# How far behind the clock the next change token stays, so a write that was
+# stamped but not yet committed during this call is picked up by the next one
+CHANGES_SETTLE_SECONDS = 2
+
+# Points /api/weight returns by default; longer series are downsampled (LTTB) to this
+DEFAULT_WEIGHT_POINTS = 200
+MAX_WEIGHT_POINTS = 5000
+# LTTB keeps the first and last points, so fewer than 3 would not downsample
+MIN_WEIGHT_POINTS = 3
+
+# All API routes live on this blueprint; create_app() registers it
+api = Blueprint('api', __name__, cli_group=None)
+
+def default_config():
+    """Base configuration, read from the environment (and .env) when the app is created"""
+    return {
+        # Database configuration - tells Flask where to find our database
+        'SQLALCHEMY_DATABASE_URI': os.getenv('DATABASE_URL', 'postgresql://localhost/templecals_db'),
+        'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+        # JWT configuration
+        'JWT_SECRET_KEY': os.getenv('JWT_SECRET_KEY', 'templecals-dev-secret-key-change-in-production'),
+        'JWT_ACCESS_TOKEN_EXPIRES': timedelta(hours=24),
+        # EventSource cannot send headers, so the event stream also accepts ?token=
+        'JWT_QUERY_STRING_NAME': 'token',
+        # Flask-Migrate pulls in Alembic; only the `flask db` CLI needs it
+        'ENABLE_MIGRATIONS': True,
+        # Prime the connection pool and catalog routes before serving (see warm_up)
+        'WARMUP': os.getenv('WARMUP', '').lower() in ('1', 'true', 'yes'),
+        'WARMUP_PATHS': ['/api/dining-halls', '/api/categories', '/api/meals', '/api/meals/popular', '/api/health'],
+        # Token buckets for the bcrypt-heavy auth endpoints (see ratelimit.py)
+        'RATELIMIT_ENABLED': os.getenv('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+        'RATELIMIT_STORAGE_URL': os.getenv('RATELIMIT_STORAGE_URL', 'memory://'),
+        'RATELIMIT_BACKEND': None,
+        # Reverse proxies in front of wsgi.py whose X-Forwarded-For names the client (0: none)
+        'RATELIMIT_TRUSTED_PROXIES': int(os.getenv('RATELIMIT_TRUSTED_PROXIES', '0')),
+        # How long a worker trusts its in-memory popularity counts before reloading
+        'POPULARITY_CACHE_SECONDS': int(os.getenv('POPULARITY_CACHE_SECONDS', '60')),
+        # Deleted entries are kept this long for /api/user-meals/changes; older
+        # change tokens get a full resync
+        'SYNC_TOMBSTONE_DAYS': int(os.getenv('SYNC_TOMBSTONE_DAYS', '30')),
+        # memory:// delivers live events within one process; redis://... across workers
+        'EVENTS_BROKER_URL': os.getenv('EVENTS_BROKER_URL', 'memory://'),
+        # How long a worker serves meal details from memory (see catalog.py)
+        'MEAL_CACHE_SECONDS': int(os.getenv('MEAL_CACHE_SECONDS', '300')),
+        # Monthly user_meals partitions kept ahead of the current month, and how
+        # many months stay live before `flask archive-meals` archives them (see partitions.py)
+        'PARTITION_MONTHS_AHEAD': int(os.getenv('PARTITION_MONTHS_AHEAD', '3')),
+        'ARCHIVE_AFTER_MONTHS': int(os.getenv('ARCHIVE_AFTER_MONTHS', '12')),
+        # Comma-separated database URLs to shard user data across (see shards.py);
+        # empty keeps everything in SQLALCHEMY_DATABASE_URI
+        'SHARD_DATABASE_URLS': [url.strip() for url in os.getenv('SHARD_DATABASE_URLS', '').split(',') if url.strip()],
+        # With a sqlite:/// DATABASE_URL: read-only connections pooled next to the
+        # single writer, and how long (seconds) to wait for SQLite's write lock (see embedded.py)
+        'SQLITE_READERS': int(os.getenv('SQLITE_READERS', '8')),
+        'SQLITE_BUSY_TIMEOUT': float(os.getenv('SQLITE_BUSY_TIMEOUT', '5')),
+        # Requests each worker serves at once per route class, how many more may
+        # queue and for how long (seconds) before getting 503 (see admission.py).
+        # Keep the concurrencies summed at or under the DB pool size plus overflow.
+        'ADMISSION_ENABLED': os.getenv('ADMISSION_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+        'ADMISSION_LIMITS': {
+            'catalog': {'concurrency': 6, 'queue': 12, 'timeout': 0.1},
+            'user': {'concurrency': 6, 'queue': 12, 'timeout': 0.25},
+            'heavy': {'concurrency': 2, 'queue': 4, 'timeout': 0.5},
+        },
+        # Requests run under cProfile when they carry X-Profile-Token: <PROFILE_TOKEN>,
+        # plus this fraction of all requests; the newest PROFILE_KEEP profiles are
+        # kept in PROFILE_DIR (see profiler.py). Unset/0 registers nothing. The
+        # /api/admin routes that list profiles also need PROFILE_TOKEN.
+        'PROFILE_TOKEN': os.getenv('PROFILE_TOKEN') or None,
+        'PROFILE_SAMPLE_RATE': float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+        'PROFILE_DIR': os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'templecals-profiles')),
+        'PROFILE_KEEP': int(os.getenv('PROFILE_KEEP', '50')),
+        # Statements taking at least this many milliseconds are logged and reported
+        # by fingerprint at /api/admin/slow-queries, with their plan captured once
+        # unless SLOW_QUERY_EXPLAIN is off (see slowlog.py). 0 turns it off.
+        'SLOW_QUERY_MS': float(os.getenv('SLOW_QUERY_MS', '250')),
+        'SLOW_QUERY_EXPLAIN': os.getenv('SLOW_QUERY_EXPLAIN', 'true').lower() in ('1', 'true', 'yes'),
+        'RATELIMIT_LIMITS': {
+            'login': {'ip': '20/minute', 'email': '5/minute'},
+            'register': {'ip': '5/minute'},
+        },
+    }
+
+def create_app(config=None):
+    """
+    Application factory
+    config may be a dict or an object with uppercase attributes overriding the defaults
+    """
+    # Load environment variables (like database password)
+    from dotenv import load_dotenv
+    load_dotenv()
+    
+    app = Flask(__name__)
+    app.config.update(default_config())
+    if isinstance(config, dict):
+        app.config.update(config)
+    elif config is not None:
+        app.config.from_object(config)
+    
+    # Enable CORS so React frontend can connect to this backend
+    CORS(app)
+    
+    # Initialize JWT
+    JWTManager(app)
+    
+    # Initialize database connection (and one per shard when user data is sharded,
+    # or a writer and read-only readers for an embedded SQLite database)
+    shards.init_shards(app)
+    init_embedded(app, db)
+    db.init_app(app)
+    if app.config['ENABLE_MIGRATIONS']:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    
+    # Request metrics (latency, SQL counts, pool stats) exposed at /metrics
+    init_metrics(app, db)
+    
+    init_admission(app)
+    init_rate_limits(app)
+    init_profiler(app)
+    init_slowlog(app)
+    
+    popularity.init_popularity(app)
+    init_catalog(app)
+    suggest.init_suggest(app)
+    events.init_events(app)
+    
+    app.register_blueprint(api)
+    return app
+
+def warm_up(app):
+    """
+    Get a worker ready before it accepts traffic: open the pooled DB
+    connections and request the catalog routes once so queries are compiled
+    and cached. Returns the time taken in seconds.
+    """
+    start = time.perf_counter()
+    with app.app_context():
+        for engine in db.engines.values():
+            pool_size = engine.pool.size() if hasattr(engine.pool, 'size') else 1
+            connections = [engine.connect() for _ in range(pool_size)]
+            for connection in connections:
+                connection.exec_driver_sql('SELECT 1')
+                connection.close()
+        # Write endpoints answer from the meal catalog; load it now rather than on the first write
+        app.extensions['meal_catalog'].get(None)
+        # Keep the coming months' user_meals partitions in place (no-op unless partitioned)
+        for shard in shards.each_shard(db.session):
+            created = partitions.ensure_partitions(db.session, app.config['PARTITION_MONTHS_AHEAD'])
+            db.session.commit()
+            if created:
+                app.logger.info('%sCreated user_meals partitions %s', shards.label(shard), ', '.join(created))
+    
+    client = app.test_client()
+    for path in app.config['WARMUP_PATHS']:
+        response = client.get(path)
+        if response.status_code >= 400:
+            app.logger.warning('Warm-up request to %s returned %s', path, response.status_code)
+    return time.perf_counter() - start
+
+def __getattr__(name):
+    # `from app import app` and FLASK_APP=app.py still work: a default app is
+    # built on first access instead of at import time
+    if name == 'app':
+        globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def current_popularity():
+    return current_app.extensions['popularity']
+
+def current_catalog():
+    return current_app.extensions['meal_catalog']
+
+def current_suggest():
+    return current_app.extensions['meal_suggest']
+
+def current_user():
+    """The JWT user (None if unknown), loaded once per app context, so the requests in a batch share it"""
+    email = get_jwt_identity()
+    cached = g.get('current_user')
+    if cached is None or cached[0] != email:
+        cached = g.current_user = (email, User.query.filter_by(email=email).first())
+    return cached[1]
+
+def current_user_id():
+    """The JWT user's id as a subquery, so writes resolve it in the same statement"""
+    return select(User.id).where(User.email == get_jwt_identity()).scalar_subquery()
+
+def user_meal_error(user_meal_id):
+    """Why an ownership-scoped write matched no row: unknown user, no such entry, or someone else's"""
+    if not User.query.filter_by(email=get_jwt_identity()).first():
+        return jsonify({'error': 'User not found'}), 404
+    user_meal = db.session.get(UserMeal, user_meal_id)
+    if user_meal is None or user_meal.deleted_at is not None:
+        return jsonify({'error': 'Meal entry not found'}), 404
+    return jsonify({'error': 'Unauthorized'}), 403
+
+def publish_event(user_id, event):
+    """Send a committed change to the user's open event streams; never fails the write"""
+    try:
+        current_app.extensions['events'].publish(user_id, event)
+    except Exception:
+        current_app.logger.exception('Could not publish %s event', event.get('type'))
+
+def calculate_totals(user_meals):
+    """Sum calories and macros for a list of logged meals"""
+    return nutrition_totals((um.calories, um.protein, um.carbs, um.fat, um.serving_multiplier) for um in user_meals)
 
-# Import models after db initialization to avoid circular imports
-from models import DiningHall, MealCategory, Meal, User, UserMeal
+def set_recommended_goals(user, recommended_macros):
+    """Adopt calculate_recommended_macros() output as the user's goals (no-op without a complete profile)"""
+    if recommended_macros:
+        user.daily_calorie_goal = recommended_macros['calories']
+        user.daily_protein_goal = recommended_macros['protein']
+        user.daily_carb_goal = recommended_macros['carbs']
+        user.daily_fat_goal = recommended_macros['fat']
+        user.goals_auto_calculated = True
 
-@app.route('/')
+def user_goals(user):
+    """Daily nutrition goals in the shape used by API responses"""
+    return {
+        'calories': user.daily_calorie_goal,
+        'protein': user.daily_protein_goal,
+        'carbs': user.daily_carb_goal,
+        'fat': user.daily_fat_goal
+    }
+
+@api.route('/')
 def index():
     return jsonify({"message": "Welcome to the TempleCals Backend!"})
 
 # Authentication Routes
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
+@rate_limited('register')
 def register():
     """Register a new user"""
     try:
@@ -62,13 +310,18 @@ def register():
         if not re.search(r'[0-9]', password):
             return jsonify({'error': 'Password must contain at least one number'}), 400
         
-        # Check if user already exists
-        if User.query.filter_by(email=data['email']).first():
+        # Check if user already exists (emails are stored lowercased, as login looks them up)
+        email = data['email'].lower()
+        shards.route_email(db.session, email)
+        if User.query.filter_by(email=email).first():
             return jsonify({'error': 'Email already registered'}), 400
         
-        # Create new user
+        # Create new user; with sharded user data the id comes from the user
+        # directory, which also routes this session to the new user's shard
+        user_id = shards.register_user(db.session, email)
         user = User(
-            email=data['email'].lower(),
+            id=user_id,
+            email=email,
             first_name=data['first_name'],
             last_name=data['last_name']
         )
@@ -85,10 +338,14 @@ def register():
             user.daily_fat_goal = data['daily_fat_goal']
         
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except Exception:
+            shards.release_user(user_id)
+            raise
         
-        # Create access token
-        access_token = create_access_token(identity=user.email)
+        # Create access token; uid lets requests find the user's shard without a lookup
+        access_token = create_access_token(identity=user.email, additional_claims={'uid': user.id})
         
         return jsonify({
             'message': 'User registered successfully',
@@ -100,7 +357,8 @@ def register():
         db.session.rollback()
         return jsonify({'error': 'Registration failed', 'details': str(e)}), 500
 
-@app.route('/api/auth/login', methods=['POST'])
+@api.route('/api/auth/login', methods=['POST'])
+@rate_limited('login')
 def login():
     """Login user"""
     try:
@@ -109,7 +367,8 @@ def login():
         if not data.get('email') or not data.get('password'):
             return jsonify({'error': 'Email and password are required'}), 400
         
-        # Find user
+        # Find user (on their shard when user data is sharded)
+        shards.route_email(db.session, data['email'].lower())
         user = User.query.filter_by(email=data['email'].lower()).first()
         
         if not user or not user.check_password(data['password']):
@@ -120,7 +379,7 @@ def login():
         db.session.commit()
         
         # Create access token
-        access_token = create_access_token(identity=user.email)
+        access_token = create_access_token(identity=user.email, additional_claims={'uid': user.id})
         
         return jsonify({
             'message': 'Login successful',
@@ -131,13 +390,12 @@ def login():
     except Exception as e:
         return jsonify({'error': 'Login failed', 'details': str(e)}), 500
 
-@app.route('/api/auth/me', methods=['GET'])
+@api.route('/api/auth/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
     """Get current user profile"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -147,13 +405,12 @@ def get_current_user():
     except Exception as e:
         return jsonify({'error': 'Failed to get user', 'details': str(e)}), 500
 
-@app.route('/api/auth/profile', methods=['PUT'])
+@api.route('/api/auth/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
     """Update user profile and nutrition goals"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -164,6 +421,9 @@ def update_profile():
         if 'age' in data:
             user.age = data['age']
         if 'weight' in data:
+            # A new weight also goes into the weight history
+            if data['weight'] and data['weight'] != user.weight:
+                db.session.add(WeightEntry(user_id=user.id, weight=data['weight']))
             user.weight = data['weight']
         if 'height' in data:
             user.height = data['height']
@@ -174,14 +434,13 @@ def update_profile():
         if 'goal' in data:
             user.goal = data['goal']
         
+        # Goals don't feed into the calculation, so one call serves both the
+        # auto_calculate update and the response
+        recommended_macros = user.calculate_recommended_macros()
+        
         # If auto_calculate is true, calculate recommended macros
         if data.get('auto_calculate', False):
-            recommended = user.calculate_recommended_macros()
-            if recommended:
-                user.daily_calorie_goal = recommended['calories']
-                user.daily_protein_goal = recommended['protein']
-                user.daily_carb_goal = recommended['carbs']
-                user.daily_fat_goal = recommended['fat']
+            set_recommended_goals(user, recommended_macros)
         else:
             # Allow manual override of nutrition goals
             if 'daily_calorie_goal' in data:
@@ -192,12 +451,12 @@ def update_profile():
                 user.daily_carb_goal = data['daily_carb_goal']
             if 'daily_fat_goal' in data:
                 user.daily_fat_goal = data['daily_fat_goal']
+            # Hand-set goals must survive `flask recalculate-goals`
+            if any(field in data for field in GOAL_FIELDS):
+                user.goals_auto_calculated = False
         
         db.session.commit()
         
-        # Calculate recommended macros to include in response
-        recommended_macros = user.calculate_recommended_macros()
-        
         return jsonify({
             'message': 'Profile updated successfully',
             'user': user.to_dict(),
@@ -208,8 +467,135 @@ def update_profile():
         db.session.rollback()
         return jsonify({'error': 'Failed to update profile', 'details': str(e)}), 500
 
+# Weight Tracking Endpoints
+@api.route('/api/weight', methods=['POST'])
+@jwt_required()
+def log_weight():
+    """Log a weigh-in; with recalculate_goals, goals are recalculated from the new weight"""
+    try:
+        user = current_user()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        data = request.get_json() or {}
+        try:
+            weight = float(data.get('weight'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'weight (lbs) is required'}), 400
+        if not 0 < weight < 1500:
+            return jsonify({'error': 'weight must be between 0 and 1500 lbs'}), 400
+        
+        try:
+            measured_at = datetime.fromisoformat(data['measured_at']) if data.get('measured_at') else datetime.utcnow()
+        except ValueError:
+            return jsonify({'error': 'Invalid measured_at. Use ISO 8601'}), 400
+        
+        # The profile weight follows the latest weigh-in; a backdated one leaves it alone
+        latest = db.session.execute(
+            select(db.func.max(WeightEntry.measured_at)).where(WeightEntry.user_id == user.id)
+        ).scalar()
+        entry = WeightEntry(user_id=user.id, weight=weight, measured_at=measured_at, notes=data.get('notes'))
+        db.session.add(entry)
+        
+        recommended_macros = None
+        if latest is None or measured_at >= latest:
+            user.weight = weight
+            if data.get('recalculate_goals', False):
+                recommended_macros = user.calculate_recommended_macros()
+                set_recommended_goals(user, recommended_macros)
+        
+        db.session.commit()
+        
+        return jsonify({
+            'message': 'Weight logged successfully',
+            'entry': entry.to_dict(),
+            'user': user.to_dict(),
+            'recommended_macros': recommended_macros
+        }), 201
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to log weight', 'details': str(e)}), 500
+
+@api.route('/api/weight', methods=['GET'])
+@jwt_required()
+def get_weight_history():
+    """Get the current user's weigh-ins in a date range, downsampled to at most `points`"""
+    try:
+        user = current_user()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        try:
+            start_date = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if request.args.get('start') else None
+            end_date = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if request.args.get('end') else None
+        except ValueError:
+            return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+        points = max(MIN_WEIGHT_POINTS, min(request.args.get('points', type=int, default=DEFAULT_WEIGHT_POINTS),
+                                            MAX_WEIGHT_POINTS))
+        
+        # Plain columns: only the points that survive downsampling become dicts
+        query = select(WeightEntry.id, WeightEntry.weight, WeightEntry.measured_at, WeightEntry.notes) \
+            .where(WeightEntry.user_id == user.id)
+        if start_date:
+            query = query.where(WeightEntry.measured_at >= datetime.combine(start_date, datetime.min.time()))
+        if end_date:
+            query = query.where(WeightEntry.measured_at < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+        rows = db.session.execute(query.order_by(WeightEntry.measured_at, WeightEntry.id)).all()
+        
+        keep = timeseries.lttb([((row.measured_at - EPOCH).total_seconds(), row.weight) for row in rows], points)
+        
+        return jsonify({
+            'start': start_date.isoformat() if start_date else None,
+            'end': end_date.isoformat() if end_date else None,
+            'entries': [weight_entry_dict(rows[i]) for i in keep],
+            'count': len(rows),
+            'downsampled': len(keep) < len(rows)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': 'Failed to get weight history', 'details': str(e)}), 500
+
+@api.route('/api/weight/<int:entry_id>', methods=['DELETE'])
+@jwt_required()
+def delete_weight_entry(entry_id):
+    """Delete a weigh-in"""
+    try:
+        user = current_user()
+        
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
+        
+        entry = db.session.get(WeightEntry, entry_id)
+        if entry is None:
+            return jsonify({'error': 'Weight entry not found'}), 404
+        if entry.user_id != user.id:
+            return jsonify({'error': 'Unauthorized'}), 403
+        
+        db.session.delete(entry)
+        db.session.flush()
+        
+        # The profile weight falls back to the latest weigh-in left
+        latest = db.session.execute(
+            select(WeightEntry.weight).where(WeightEntry.user_id == user.id)
+            .order_by(WeightEntry.measured_at.desc(), WeightEntry.id.desc()).limit(1)
+        ).scalar()
+        if latest is not None:
+            user.weight = latest
+        
+        db.session.commit()
+        
+        return jsonify({'message': 'Weight entry deleted successfully', 'user': user.to_dict()}), 200
+        
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to delete weight entry', 'details': str(e)}), 500
+
 # API Endpoints for Dining Halls
-@app.route('/api/dining-halls', methods=['GET'])
+@api.route('/api/dining-halls', methods=['GET'])
+@route_class('catalog')
 def get_dining_halls():
     """Get all dining halls"""
     dining_halls = DiningHall.query.all()
@@ -221,7 +607,8 @@ def get_dining_halls():
         'hours': hall.hours
     } for hall in dining_halls])
 
-@app.route('/api/dining-halls/<int:hall_id>', methods=['GET'])
+@api.route('/api/dining-halls/<int:hall_id>', methods=['GET'])
+@route_class('catalog')
 def get_dining_hall(hall_id):
     """Get a specific dining hall"""
     hall = DiningHall.query.get_or_404(hall_id)
@@ -234,7 +621,8 @@ def get_dining_hall(hall_id):
     })
 
 # API Endpoints for Meal Categories
-@app.route('/api/categories', methods=['GET'])
+@api.route('/api/categories', methods=['GET'])
+@route_class('catalog')
 def get_categories():
     """Get all meal categories"""
     categories = MealCategory.query.all()
@@ -245,7 +633,8 @@ def get_categories():
     } for cat in categories])
 
 # API Endpoints for Meals
-@app.route('/api/meals', methods=['GET'])
+@api.route('/api/meals', methods=['GET'])
+@route_class('catalog')
 def get_meals():
     """Get all meals with optional filtering"""
     # Get query parameters for filtering
@@ -253,86 +642,152 @@ def get_meals():
     category_id = request.args.get('category_id', type=int)
     search = request.args.get('search', '')
     
-    # Start with base query
-    query = Meal.query
+    # Start with base query (plain columns, serialized without building Meal objects)
+    query = reads.meals_query()
     
     # Apply filters if provided
     if dining_hall_id:
-        query = query.filter(Meal.dining_hall_id == dining_hall_id)
+        query = query.where(Meal.dining_hall_id == dining_hall_id)
     
     if category_id:
-        query = query.filter(Meal.category_id == category_id)
+        query = query.where(Meal.category_id == category_id)
     
     if search:
-        query = query.filter(Meal.name.ilike(f'%{search}%'))
+        query = query.where(Meal.name.ilike(f'%{search}%'))
     
     # Only show available meals
-    query = query.filter(Meal.is_available == True)
+    query = query.where(Meal.is_available == True)
+    
+    meals = [reads.serialize_meal(row) for row in db.session.execute(query)]
+    
+    # Most logged over the last month first
+    if request.args.get('sort') == 'popular':
+        scores = current_popularity().scores()
+        meals.sort(key=lambda meal: scores.get(meal['id'], 0), reverse=True)
+        return jsonify([dict(meal, popularity=scores.get(meal['id'], 0)) for meal in meals])
+    
+    return jsonify(meals)
+
+@api.route('/api/meals/popular', methods=['GET'])
+@route_class('catalog')
+def get_popular_meals():
+    """Get the most logged meals, optionally for one dining hall"""
+    hall_id = request.args.get('hall', type=int)
+    window = request.args.get('window', popularity.DEFAULT_WINDOW)
+    limit = min(request.args.get('limit', type=int, default=10), 50)
+    
+    if window not in popularity.WINDOWS:
+        return jsonify({'error': f"window must be one of: {', '.join(popularity.WINDOWS)}"}), 400
     
-    meals = query.all()
-    return jsonify([meal.to_dict() for meal in meals])
+    # Ranking comes from memory; only the winning meals are read from the database
+    top = current_popularity().top(hall_id, window, limit)
+    meals = {meal.id: meal for meal in Meal.query.filter(Meal.id.in_([meal_id for meal_id, _ in top])).all()}
+    
+    return jsonify({
+        'hall_id': hall_id,
+        'window': window,
+        'meals': [dict(meals[meal_id].to_dict(), log_count=count) for meal_id, count in top if meal_id in meals]
+    })
 
-@app.route('/api/meals/<int:meal_id>', methods=['GET'])
+@api.route('/api/meals/suggest', methods=['GET'])
+@route_class('catalog')
+def suggest_meals():
+    """Typeahead suggestions: available meals whose name (or a word in it) starts with q"""
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', type=int, default=suggest.DEFAULT_LIMIT), suggest.MAX_LIMIT)
+    
+    # Answered from the per-worker index and popularity counts; no query unless either is stale
+    suggestions = current_suggest().suggest(query, limit, current_popularity().scores())
+    
+    return jsonify({'query': query, 'suggestions': suggestions})
+
+@api.route('/api/meals/<int:meal_id>', methods=['GET'])
+@route_class('catalog')
 def get_meal(meal_id):
     """Get a specific meal"""
     meal = Meal.query.get_or_404(meal_id)
     return jsonify(meal.to_dict())
 
 # User Meal Logging Endpoints
-@app.route('/api/user-meals/log', methods=['POST'])
+@api.route('/api/user-meals/log', methods=['POST'])
 @jwt_required()
 def log_meal():
     """Log a meal for the current user"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
-        
-        if not user:
-            return jsonify({'error': 'User not found'}), 404
-        
         data = request.get_json()
         
         # Validate required fields
         if not data.get('meal_id'):
             return jsonify({'error': 'meal_id is required'}), 400
+        # The catalog is keyed by int; "12" is still accepted as before
+        try:
+            meal_id = int(data['meal_id'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'meal_id must be an integer'}), 400
         
-        # Check if meal exists
-        meal = Meal.query.get(data['meal_id'])
-        if not meal:
+        # Check if meal exists (from memory; the response reuses its details)
+        meal_data = current_catalog().get(meal_id)
+        if not meal_data:
             return jsonify({'error': 'Meal not found'}), 404
-        
-        # Create user meal entry
-        user_meal = UserMeal(
-            user_id=user.id,
-            meal_id=data['meal_id'],
-            serving_multiplier=data.get('serving_multiplier', 1.0),
-            notes=data.get('notes', None)
-        )
+        hall_id = current_catalog().hall_id(meal_id)
         
         # If consumed_at is provided, use it; otherwise use current time
         if 'consumed_at' in data:
-            user_meal.consumed_at = datetime.fromisoformat(data['consumed_at'])
-            user_meal.date_consumed = user_meal.consumed_at.date()
+            consumed_at = datetime.fromisoformat(data['consumed_at'])
+        else:
+            consumed_at = datetime.utcnow()
+        now = datetime.utcnow()
+        
+        # One statement: look up the user's id and the meal's current nutrition
+        # (snapshotted onto the entry), insert, and return the new row
+        table = UserMeal.__table__
+        source = select(User.id, *[Meal.__table__.c[field] for field in NUTRITION_FIELDS]) \
+            .select_from(User.__table__.join(Meal.__table__, db.true())) \
+            .where(User.email == get_jwt_identity(), Meal.id == meal_id)
+        values = {
+            'meal_id': meal_id,
+            'serving_multiplier': data.get('serving_multiplier', 1.0),
+            'consumed_at': consumed_at,
+            'date_consumed': consumed_at.date(),
+            'notes': data.get('notes', None),
+            'created_at': now,
+            'updated_at': now,
+        }
+        row = db.session.execute(
+            table.insert().from_select(
+                ['user_id', *NUTRITION_FIELDS] + list(values),
+                source.add_columns(*[db.literal(value, table.c[name].type) for name, value in values.items()])
+            ).returning(*table.c)
+        ).first()
+        
+        if row is None:
+            db.session.rollback()
+            return jsonify({'error': 'User not found'}), 404
         
-        db.session.add(user_meal)
+        change = (row.meal_id, hall_id, consumed_at, 1)
+        popularity.record_many(db.session, [change])
         db.session.commit()
+        current_popularity().apply_many([change])
+        
+        user_meal = user_meal_dict(row, meal_data)
+        publish_event(row.user_id, {'type': 'logged', 'user_meal': user_meal, 'dates': [user_meal['date_consumed']]})
         
         return jsonify({
             'message': 'Meal logged successfully',
-            'user_meal': user_meal.to_dict()
+            'user_meal': user_meal
         }), 201
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to log meal', 'details': str(e)}), 500
 
-@app.route('/api/user-meals/history', methods=['GET'])
+@api.route('/api/user-meals/history', methods=['GET'])
+@route_class('heavy')
 @jwt_required()
 def get_meal_history():
     """Get meal history for the current user with optional date filtering"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -341,14 +796,14 @@ def get_meal_history():
         date_str = request.args.get('date')
         limit = request.args.get('limit', type=int, default=100)
         
-        # Start with base query
-        query = UserMeal.query.filter_by(user_id=user.id)
+        # Start with base query (entries and their meals in one select of plain columns)
+        query = reads.user_meals_query().where(UserMeal.user_id == user.id, UserMeal.deleted_at.is_(None))
         
         # Filter by date if provided
         if date_str:
             try:
                 target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
-                query = query.filter(UserMeal.date_consumed == target_date)
+                query = query.where(UserMeal.date_consumed == target_date)
             except ValueError:
                 return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
@@ -356,23 +811,26 @@ def get_meal_history():
         query = query.order_by(UserMeal.consumed_at.desc())
         
         # Apply limit
-        user_meals = query.limit(limit).all()
+        user_meals = [reads.serialize_user_meal(row) for row in db.session.execute(query.limit(limit))]
+        
+        # Entries from archived months come from user_meal_archive
+        user_meals = partitions.read_history(db.session, user.id, user_meals, limit, current_catalog().get,
+                                             target_date if date_str else None)
         
         return jsonify({
-            'meals': [um.to_dict() for um in user_meals],
+            'meals': user_meals,
             'count': len(user_meals)
         }), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get meal history', 'details': str(e)}), 500
 
-@app.route('/api/user-meals/daily/<date>', methods=['GET'])
+@api.route('/api/user-meals/daily/<date>', methods=['GET'])
 @jwt_required()
 def get_daily_meals(date):
     """Get all meals for a specific date with daily totals"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -383,114 +841,598 @@ def get_daily_meals(date):
         except ValueError:
             return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
         
-        # Get all meals for that date
-        user_meals = UserMeal.query.filter_by(
-            user_id=user.id,
-            date_consumed=target_date
-        ).order_by(UserMeal.consumed_at.asc()).all()
+        change_token = current_change_token()
         
-        # Calculate daily totals
-        total_calories = sum(um.meal.calories * um.serving_multiplier if um.meal and um.meal.calories else 0 for um in user_meals)
-        total_protein = sum(um.meal.protein * um.serving_multiplier if um.meal and um.meal.protein else 0 for um in user_meals)
-        total_carbs = sum(um.meal.carbs * um.serving_multiplier if um.meal and um.meal.carbs else 0 for um in user_meals)
-        total_fat = sum(um.meal.fat * um.serving_multiplier if um.meal and um.meal.fat else 0 for um in user_meals)
+        # Get all meals for that date
+        query = reads.user_meals_query().where(
+            UserMeal.user_id == user.id,
+            UserMeal.date_consumed == target_date,
+            UserMeal.deleted_at.is_(None)
+        ).order_by(UserMeal.consumed_at.asc())
+        user_meals = [reads.serialize_user_meal(row) for row in db.session.execute(query)]
         
         return jsonify({
             'date': date,
-            'meals': [um.to_dict() for um in user_meals],
+            'meals': user_meals,
             'count': len(user_meals),
-            'totals': {
-                'calories': int(total_calories),
-                'protein': round(total_protein, 1),
-                'carbs': round(total_carbs, 1),
-                'fat': round(total_fat, 1)
-            },
-            'goals': {
-                'calories': user.daily_calorie_goal,
-                'protein': user.daily_protein_goal,
-                'carbs': user.daily_carb_goal,
-                'fat': user.daily_fat_goal
-            }
+            'totals': reads.entry_totals(user_meals),
+            'goals': user_goals(user),
+            'change_token': change_token
         }), 200
         
     except Exception as e:
         return jsonify({'error': 'Failed to get daily meals', 'details': str(e)}), 500
 
-@app.route('/api/user-meals/<int:user_meal_id>', methods=['DELETE'])
+@api.route('/api/user-meals/range', methods=['GET'])
+@route_class('heavy')
 @jwt_required()
-def delete_user_meal(user_meal_id):
-    """Delete a logged meal"""
+def get_meal_range():
+    """Get meals grouped by day, with daily totals, for a date range (inclusive)"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Find the user meal
-        user_meal = UserMeal.query.get(user_meal_id)
+        # Parse and validate the range
+        try:
+            start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'start and end are required. Use YYYY-MM-DD'}), 400
+        
+        if end_date < start_date:
+            return jsonify({'error': 'end must not be before start'}), 400
+        if (end_date - start_date).days >= MAX_RANGE_DAYS:
+            return jsonify({'error': f'Range cannot exceed {MAX_RANGE_DAYS} days'}), 400
+        
+        # One query for the whole range, with the meal data loaded alongside
+        user_meals = UserMeal.query.options(
+            joinedload(UserMeal.meal).joinedload(Meal.dining_hall),
+            joinedload(UserMeal.meal).joinedload(Meal.category)
+        ).filter(
+            UserMeal.user_id == user.id,
+            UserMeal.date_consumed >= start_date,
+            UserMeal.date_consumed <= end_date,
+            UserMeal.deleted_at.is_(None)
+        ).order_by(UserMeal.date_consumed.asc(), UserMeal.consumed_at.asc()).all()
+        
+        # Rows arrive in date order, so each day's group is contiguous
+        grouped = {}
+        for um in user_meals:
+            grouped.setdefault(um.date_consumed, []).append(um)
+        
+        goals = user_goals(user)
+        days = []
+        day = start_date
+        while day <= end_date:
+            entries = grouped.get(day, [])
+            days.append({
+                'date': day.isoformat(),
+                'meals': [um.to_dict() for um in entries],
+                'count': len(entries),
+                'totals': calculate_totals(entries),
+                'goals': goals
+            })
+            day += timedelta(days=1)
         
-        if not user_meal:
-            return jsonify({'error': 'Meal entry not found'}), 404
+        return jsonify({
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'days': days,
+            'count': len(user_meals)
+        }), 200
         
-        # Verify it belongs to the current user
-        if user_meal.user_id != user.id:
-            return jsonify({'error': 'Unauthorized'}), 403
+    except Exception as e:
+        return jsonify({'error': 'Failed to get meal range', 'details': str(e)}), 500
+
+@api.route('/api/user-meals/breakdown', methods=['GET'])
+@route_class('heavy')
+@jwt_required()
+def get_meal_breakdown():
+    """Calories and macros over a date range (inclusive) by dining hall, category or meal"""
+    try:
+        user = current_user()
         
-        db.session.delete(user_meal)
-        db.session.commit()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
         
-        return jsonify({'message': 'Meal deleted successfully'}), 200
+        try:
+            start_date = datetime.strptime(request.args.get('start', ''), '%Y-%m-%d').date()
+            end_date = datetime.strptime(request.args.get('end', ''), '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({'error': 'start and end are required. Use YYYY-MM-DD'}), 400
+        
+        if end_date < start_date:
+            return jsonify({'error': 'end must not be before start'}), 400
+        if (end_date - start_date).days >= MAX_RANGE_DAYS:
+            return jsonify({'error': f'Range cannot exceed {MAX_RANGE_DAYS} days'}), 400
+        
+        by = request.args.get('by', 'hall')
+        if by not in reads.BREAKDOWN_GROUPS:
+            return jsonify({'error': 'by must be one of: ' + ', '.join(reads.BREAKDOWN_GROUPS)}), 400
+        limit = min(max(request.args.get('limit', type=int, default=DEFAULT_BREAKDOWN_LIMIT), 1), MAX_BREAKDOWN_LIMIT)
+        
+        # One grouped aggregate; only the top groups come back, with the totals over all of them
+        result = reads.breakdown(db.session.execute(reads.breakdown_query(user.id, start_date, end_date, by, limit)))
+        
+        return jsonify({
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'by': by,
+            **result
+        }), 200
         
     except Exception as e:
-        db.session.rollback()
-        return jsonify({'error': 'Failed to delete meal', 'details': str(e)}), 500
+        return jsonify({'error': 'Failed to get meal breakdown', 'details': str(e)}), 500
 
-@app.route('/api/user-meals/<int:user_meal_id>', methods=['PUT'])
+def export_csv_rows(user_meals):
+    """Yield CSV text in chunks: the header right away, then one chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_CSV_COLUMNS)
+    yield buffer.getvalue()
+    
+    buffer.seek(0)
+    buffer.truncate()
+    for i, data in enumerate(user_meals, 1):
+        meal = data['meal']
+        writer.writerow([
+            data['id'], data['date_consumed'], data['consumed_at'], data['meal_id'],
+            meal.get('name'), meal.get('dining_hall'), meal.get('category'),
+            data['serving_multiplier'], data['total_calories'], data['total_protein'],
+            data['total_carbs'], data['total_fat'], data['notes']
+        ])
+        if i % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def export_ndjson_rows(user_meals):
+    """Yield one JSON object per line (same fields as the history endpoint), in batches"""
+    lines = []
+    for data in user_meals:
+        lines.append(json.dumps(data, sort_keys=True, separators=(',', ':')))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_entries(user_id):
+    """A user's entries oldest first, archived months included; runs as the response streams"""
+    # yield_per streams rows through a server-side cursor instead of loading
+    # the whole history; the meal data is joined into the same rows
+    query = reads.user_meals_query().where(
+        UserMeal.user_id == user_id,
+        UserMeal.deleted_at.is_(None)
+    ).order_by(
+        UserMeal.date_consumed.asc(), UserMeal.consumed_at.asc(), UserMeal.id.asc()
+    ).execution_options(yield_per=EXPORT_BATCH_SIZE)
+    live = (reads.serialize_user_meal(row) for row in db.session.execute(query))
+    # Archived months are read one at a time and merged in date order
+    archived = partitions.iter_archive(db.session, user_id, current_catalog().get)
+    yield from partitions.merge_export(archived, live)
+
+@api.route('/api/user-meals/export', methods=['GET'])
+@route_class('heavy')
 @jwt_required()
-def update_user_meal(user_meal_id):
-    """Update a logged meal"""
+def export_meal_history():
+    """Stream the current user's full meal history as CSV or NDJSON"""
+    user = current_user()
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format == 'csv':
+        generate, mimetype = export_csv_rows, 'text/csv'
+    elif export_format == 'ndjson':
+        generate, mimetype = export_ndjson_rows, 'application/x-ndjson'
+    else:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+    
+    filename = f'templecals-history-{datetime.utcnow().date().isoformat()}.{export_format}'
+    return Response(
+        stream_with_context(generate(export_entries(user.id))),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+EPOCH = datetime(1970, 1, 1)
+
+def encode_change_token(updated_at, user_meal_id, issued_at=None):
+    """
+    Position in a user's (updated_at, id) change order plus when the token
+    was handed out, as an opaque string
+    """
+    issued_at = issued_at or datetime.utcnow()
+    micros = lambda value: (value - EPOCH) // timedelta(microseconds=1)
+    return f'{micros(updated_at)}.{user_meal_id}.{micros(issued_at)}'
+
+def current_change_token():
+    """Token for "now", taken before a read so /changes picks up from that read"""
+    return encode_change_token(datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS), 0)
+
+def decode_change_token(token):
+    """(updated_at, id) position and issue time; ValueError if malformed"""
+    micros, user_meal_id, issued = token.split('.')
+    to_datetime = lambda value: EPOCH + timedelta(microseconds=int(value))
+    return (to_datetime(micros), int(user_meal_id)), to_datetime(issued)
+
+@api.route('/api/user-meals/changes', methods=['GET'])
+@jwt_required()
+def get_meal_changes():
+    """Get the current user's entries created, updated or deleted since a change token"""
     try:
-        current_user_email = get_jwt_identity()
-        user = User.query.filter_by(email=current_user_email).first()
+        user = current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
         
-        # Find the user meal
-        user_meal = UserMeal.query.get(user_meal_id)
+        now = datetime.utcnow()
+        since = request.args.get('since')
+        position = None
+        reset = False
+        if since:
+            try:
+                position, issued_at = decode_change_token(since)
+            except ValueError:
+                return jsonify({'error': 'Invalid change token'}), 400
+            # Tombstones older than the retention period are purged, so a
+            # client that has not synced for that long cannot be told about
+            # every delete: start it over
+            if issued_at < now - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS']):
+                position, reset = None, True
+        
+        table = UserMeal.__table__
+        query = select(table).where(table.c.user_id == user.id)
+        if position is None:
+            # Full sync: current entries only, a new client has nothing to delete
+            query = query.where(table.c.deleted_at.is_(None))
+        else:
+            updated_at, last_id = position
+            query = query.where(db.or_(
+                table.c.updated_at > updated_at,
+                db.and_(table.c.updated_at == updated_at, table.c.id > last_id)
+            ))
+        rows = db.session.execute(
+            query.order_by(table.c.updated_at.asc(), table.c.id.asc()).limit(CHANGES_PAGE_SIZE + 1)
+        ).all()
+        
+        has_more = len(rows) > CHANGES_PAGE_SIZE
+        rows = rows[:CHANGES_PAGE_SIZE]
+        
+        # Meal details come from the per-worker catalog rather than a join
+        catalog = current_catalog()
+        changed, deleted = [], []
+        for row in rows:
+            if row.deleted_at is not None:
+                deleted.append({
+                    'id': row.id,
+                    'date_consumed': row.date_consumed.isoformat(),
+                    'deleted_at': row.deleted_at.isoformat()
+                })
+            else:
+                changed.append(user_meal_dict(row, catalog.get(row.meal_id) or {}))
+        
+        # The next token starts after the last row returned, but never closer
+        # than CHANGES_SETTLE_SECONDS to now; entries in that window may be
+        # sent twice, which clients handle by applying changes by id
+        if rows:
+            position = (rows[-1].updated_at, rows[-1].id)
+        if not has_more:
+            settled = now - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+            if position is None or position[0] > settled:
+                position = (settled, 0)
         
-        if not user_meal:
-            return jsonify({'error': 'Meal entry not found'}), 404
+        return jsonify({
+            'changed': changed,
+            'deleted': deleted,
+            'next': encode_change_token(*position, issued_at=now),
+            'has_more': has_more,
+            'reset': reset or not since
+        }), 200
         
-        # Verify it belongs to the current user
-        if user_meal.user_id != user.id:
-            return jsonify({'error': 'Unauthorized'}), 403
+    except Exception as e:
+        return jsonify({'error': 'Failed to get meal changes', 'details': str(e)}), 500
+
+def daily_totals_event(user_id, day):
+    """Data for a 'totals' stream event: one day's count and totals, as in /daily"""
+    # The snapshot columns are all the totals need, so user_meals is read alone
+    rows = db.session.execute(select(*DAY_TOTALS_COLUMNS).where(
+        UserMeal.user_id == user_id,
+        UserMeal.date_consumed == day,
+        UserMeal.deleted_at.is_(None)
+    )).all()
+    return {'date': day.isoformat(), 'count': len(rows), 'totals': nutrition_totals(rows)}
+
+@api.route('/api/user-meals/stream', methods=['GET'])
+@route_class(None)
+@jwt_required(locations=['headers', 'query_string'])
+def stream_meal_events():
+    """
+    Push the current user's meal changes as Server-Sent Events, each followed
+    by refreshed totals for the days it touched. This holds a thread per open
+    stream; asgi.py serves the same stream without one.
+    """
+    user = current_user()
+    
+    if not user:
+        return jsonify({'error': 'User not found'}), 404
+    
+    user_id = user.id
+    broker = current_app.extensions['events']
+    
+    def generate():
+        # Hand the connection back to the pool while the stream sits idle
+        db.session.close()
+        pending = queue.Queue()
+        unsubscribe = broker.subscribe(user_id, pending.put)
+        try:
+            yield events.stream_preamble()
+            while True:
+                try:
+                    batch = [pending.get(timeout=events.HEARTBEAT_SECONDS)]
+                except queue.Empty:
+                    yield events.format_comment('keepalive')
+                    continue
+                # Send everything that queued up, then each day's totals once
+                while not pending.empty():
+                    batch.append(pending.get_nowait())
+                dates = set()
+                for event in batch:
+                    yield events.format_event(event['type'], event)
+                    dates.update(event['dates'])
+                for day in sorted(dates):
+                    totals = daily_totals_event(user_id, datetime.strptime(day, '%Y-%m-%d').date())
+                    yield events.format_event('totals', totals)
+                db.session.close()
+        finally:
+            unsubscribe()
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@api.cli.command('purge-tombstones')
+def purge_tombstones_command():
+    """Remove deleted meal entries older than SYNC_TOMBSTONE_DAYS"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['SYNC_TOMBSTONE_DAYS'])
+    for shard in shards.each_shard(db.session):
+        result = db.session.execute(UserMeal.__table__.delete().where(UserMeal.deleted_at < cutoff))
+        db.session.commit()
+        print(f'{shards.label(shard)}Purged {result.rowcount} deleted meal entries')
+
+@api.cli.command('ensure-partitions')
+@click.option('--months-ahead', type=int, default=None, help='Months to create beyond the current one')
+def ensure_partitions_command(months_ahead):
+    """Create the coming months' user_meals partitions (run daily from cron)"""
+    if months_ahead is None:
+        months_ahead = current_app.config['PARTITION_MONTHS_AHEAD']
+    for shard in shards.each_shard(db.session):
+        if not partitions.is_partitioned(db.session):
+            print(f'{shards.label(shard)}user_meals is not partitioned (PostgreSQL only); nothing to do')
+            continue
+        created = partitions.ensure_partitions(db.session, months_ahead)
+        db.session.commit()
+        print(f'{shards.label(shard)}Created ' + (', '.join(created) if created else 'no partitions; all present'))
+
+@api.cli.command('archive-meals')
+@click.option('--after-months', type=int, default=None,
+              help='Months kept live before the current one (default ARCHIVE_AFTER_MONTHS)')
+@click.option('--dry-run', is_flag=True, help='Only list the months that would be archived')
+def archive_meals_command(after_months, dry_run):
+    """Move old months of user_meals into the compressed archive and drop their partitions"""
+    if after_months is None:
+        after_months = current_app.config['ARCHIVE_AFTER_MONTHS']
+    for shard in shards.each_shard(db.session):
+        prefix = shards.label(shard)
+        results = partitions.archive(db.session, after_months, dry_run=dry_run)
+        if results is None:
+            print(f'{prefix}user_meals is not partitioned (PostgreSQL only); nothing to archive')
+            continue
+        for month, count, users in results:
+            if dry_run:
+                print(f'{prefix}{month:%Y-%m}: {count} entries would be archived')
+            else:
+                print(f'{prefix}{month:%Y-%m}: archived {count} entries for {users} users')
+        if not results:
+            print(f'{prefix}No months to archive')
+
+def backfill_nutrition(session):
+    """
+    Copy each meal's current nutrition onto user_meals rows that have no
+    snapshot yet (rows loaded in bulk, or written by workers still running
+    code from before the snapshot columns). Returns the number of rows filled.
+    updated_at moves too, so /api/user-meals/changes sends the filled rows again.
+    """
+    user_meals, meals = UserMeal.__table__, Meal.__table__
+    result = session.execute(
+        user_meals.update()
+        .where(meals.c.id == user_meals.c.meal_id,
+               *[user_meals.c[field].is_(None) for field in NUTRITION_FIELDS])
+        .values({field: meals.c[field] for field in NUTRITION_FIELDS})
+    )
+    return result.rowcount
+
+@api.cli.command('backfill-nutrition')
+def backfill_nutrition_command():
+    """Snapshot meal nutrition onto user_meals rows that are missing it"""
+    for shard in shards.each_shard(db.session):
+        count = backfill_nutrition(db.session)
+        db.session.commit()
+        print(f'{shards.label(shard)}Filled nutrition for {count} meal entries')
+
+@api.cli.command('recalculate-goals')
+@click.option('--dry-run', is_flag=True, help='Only report the goals that would change')
+@click.option('--all', 'include_all', is_flag=True,
+              help='Every user with a complete profile, not just auto-calculated ones (marks them auto-calculated)')
+@click.option('--chunk-size', type=int, default=None, help='Users per batch')
+@click.option('--show', type=int, default=20, help='Changed users to list')
+def recalculate_goals_command(dry_run, include_all, chunk_size, show):
+    """Recompute nutrition goals from the current formula in bulk"""
+    # NumPy is only needed here, so the web workers never import it
+    import goals
+    
+    shown = []
+    
+    def on_change(user_id, old, new):
+        if len(shown) < show:
+            shown.append(user_id)
+            print(f'user {user_id}: ' + ', '.join(
+                f'{field} {old[field]} -> {new[field]}' for field in GOAL_FIELDS if old[field] != new[field]))
+    
+    for shard in shards.each_shard(db.session):
+        summary = goals.recalculate(db.session, dry_run=dry_run, include_all=include_all,
+                                    chunk_size=chunk_size or goals.CHUNK_SIZE, on_change=on_change)
+        print(f"{shards.label(shard)}{summary['users']} users read, {summary['calculable']} with complete profiles, "
+              f"{summary['changed']} with changed goals, "
+              + ('nothing written (dry run)' if dry_run else f"{summary['updated']} updated")
+              + f" in {summary['seconds']}s")
+
+@api.cli.command('replicate-catalog')
+def replicate_catalog_command():
+    """Copy dining halls, categories and meals from the main database to every shard"""
+    router = shards.current_router()
+    if router is None:
+        print('SHARD_DATABASE_URLS is not set; nothing to replicate')
+        return
+    counts = shards.replicate_catalog(router)
+    print(f'Replicated to {router.count} shards: ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+    # Run before a shard takes writes, so its user_meals and weight_entries ids never clash with another's
+    if shards.stride_sequences(router):
+        print(f'Id sequences step by {shards.MAX_SHARDS}')
+
+@api.cli.command('reshard')
+@click.option('--source', 'sources', multiple=True,
+              help='URL of a database no longer in SHARD_DATABASE_URLS to move users off (repeatable)')
+@click.option('--batch-size', type=int, default=shards.MOVE_BATCH_SIZE, help='Users moved per transaction')
+@click.option('--dry-run', is_flag=True, help='Only report how many users would move where')
+def reshard_command(sources, batch_size, dry_run):
+    """Move users to the shard their id hashes to under SHARD_DATABASE_URLS (stop the web workers first)"""
+    router = shards.current_router()
+    if router is None:
+        print('SHARD_DATABASE_URLS is not set; nothing to reshard')
+        return
+    changed = shards.reshard(router, sources, dry_run=dry_run, batch_size=batch_size)
+    # Each shard's meal_popularity counts only its own users' meals
+    for shard in changed:
+        with shards.routed(db.session, shard):
+            popularity.rebuild(db.session)
+            db.session.commit()
+        print(f'{shards.label(shard)}meal_popularity rebuilt')
+
+@api.route('/api/user-meals/<int:user_meal_id>', methods=['DELETE'])
+@jwt_required()
+def delete_user_meal(user_meal_id):
+    """Delete a logged meal"""
+    try:
+        # Ownership is part of the WHERE clause, so this is the only read.
+        # The row stays behind as a tombstone for /api/user-meals/changes.
+        table = UserMeal.__table__
+        now = datetime.utcnow()
+        row = db.session.execute(
+            table.update()
+            .where(table.c.id == user_meal_id, table.c.user_id == current_user_id(),
+                   table.c.deleted_at.is_(None))
+            .values(deleted_at=now, updated_at=now)
+            .returning(table.c.user_id, table.c.meal_id, table.c.consumed_at, table.c.date_consumed)
+        ).first()
+        
+        if row is None:
+            db.session.rollback()
+            return user_meal_error(user_meal_id)
+        
+        change = (row.meal_id, current_catalog().hall_id(row.meal_id), row.consumed_at, -1)
+        popularity.record_many(db.session, [change])
+        db.session.commit()
+        current_popularity().apply_many([change])
+        
+        publish_event(row.user_id, {'type': 'deleted', 'id': user_meal_id, 'dates': [row.date_consumed.isoformat()]})
+        
+        return jsonify({'message': 'Meal deleted successfully'}), 200
         
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to delete meal', 'details': str(e)}), 500
+
+@api.route('/api/user-meals/<int:user_meal_id>', methods=['PUT'])
+@jwt_required()
+def update_user_meal(user_meal_id):
+    """Update a logged meal"""
+    try:
         data = request.get_json()
         
         # Update fields if provided
+        values = {}
         if 'serving_multiplier' in data:
-            user_meal.serving_multiplier = data['serving_multiplier']
+            values['serving_multiplier'] = data['serving_multiplier']
         if 'notes' in data:
-            user_meal.notes = data['notes']
+            values['notes'] = data['notes']
         if 'consumed_at' in data:
-            user_meal.consumed_at = datetime.fromisoformat(data['consumed_at'])
-            user_meal.date_consumed = user_meal.consumed_at.date()
+            values['consumed_at'] = datetime.fromisoformat(data['consumed_at'])
+            values['date_consumed'] = values['consumed_at'].date()
+        
+        table = UserMeal.__table__
+        entry_filter = [table.c.id == user_meal_id, table.c.user_id == current_user_id(),
+                        table.c.deleted_at.is_(None)]
+        
+        # Moving an entry to another day/hour moves its popularity count too;
+        # this reads the entry's current time itself, so it runs first
+        changes = []
+        if 'consumed_at' in data:
+            changes = popularity.record_move(db.session, entry_filter, values['consumed_at'])
+        
+        # Ownership is part of the WHERE clause, so the UPDATE is the only read
+        row = db.session.execute(
+            table.update().where(*entry_filter).values(**values).returning(*table.c)
+        ).first()
+        
+        if row is None:
+            db.session.rollback()
+            return user_meal_error(user_meal_id)
         
         db.session.commit()
+        current_popularity().apply_many(changes)
+        
+        # A move to another day changes the totals of both days
+        user_meal = user_meal_dict(row, current_catalog().get(row.meal_id) or {})
+        dates = {user_meal['date_consumed']} | {consumed_at.date().isoformat() for _, _, consumed_at, delta in changes if delta < 0}
+        publish_event(row.user_id, {'type': 'updated', 'user_meal': user_meal, 'dates': sorted(dates)})
         
         return jsonify({
             'message': 'Meal updated successfully',
-            'user_meal': user_meal.to_dict()
+            'user_meal': user_meal
         }), 200
         
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Failed to update meal', 'details': str(e)}), 500
 
+# Batched GET requests
+@api.route('/api/batch', methods=['POST'])
+@jwt_required(optional=True)
+def run_batch():
+    """Run several GET requests in one round trip, sharing the user and DB session (see batch.py)"""
+    data = request.get_json(silent=True) or {}
+    error = batch.validate(data.get('requests'))
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        return jsonify({'responses': batch.run(data['requests'])}), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Failed to run batch', 'details': str(e)}), 500
+
 # Health check endpoint
-@app.route('/api/health', methods=['GET'])
+@api.route('/api/health', methods=['GET'])
+@route_class(None)
 def health_check():
     """Check if the API is running and database is connected"""
     try:
@@ -509,4 +1451,4 @@ def health_check():
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001) # Changed from port 5000 to 5001 to avoid AirPlay conflict
+    create_app().run(debug=True, port=5001) # Changed from port 5000 to 5001 to avoid AirPlay conflict
@@ -0,0 +1,371 @@
+"""
+ASGI entrypoint (async serving mode)
+
+The read-heavy endpoints - GET /api/meals, /api/user-meals/daily/<date> and
+/api/user-meals/history - are served by async handlers on an async database
+driver (asyncpg for Postgres, aiosqlite for SQLite), so a worker is not tied
+up while it waits on the database. /api/user-meals/stream holds its
+Server-Sent Events connections on the event loop, so thousands of idle
+dashboards cost a queue each rather than a thread each. Every other route is
+passed through to the regular Flask app, which keeps working unchanged under
+any WSGI server. With sharded user data (SHARD_DATABASE_URLS) each shard
+gets its own async engine and user endpoints read from the user's shard.
+
+Run with:
+    uvicorn asgi:app --port 5001 --workers 4
+"""
+
+import asyncio
+import contextlib
+import json
+from datetime import datetime
+
+import jwt
+from a2wsgi import WSGIMiddleware
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import configure_mappers
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import events
+import partitions
+import reads
+import shards
+from app import DAY_TOTALS_COLUMNS, create_app, current_change_token, user_goals
+from models import Meal, User, UserDirectory, UserMeal, nutrition_totals
+
+flask_app = create_app({'ENABLE_MIGRATIONS': False})
+
+# Backrefs such as Meal.dining_hall only exist once the mappers are configured
+configure_mappers()
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(url):
+    """Swap the sync driver in a database URL for its async counterpart"""
+    scheme, rest = url.split('://', 1)
+    dialect = scheme.split('+', 1)[0]
+    return '%s://%s' % (ASYNC_DRIVERS.get(dialect, scheme), rest)
+
+
+engine = create_async_engine(async_database_url(flask_app.config['SQLALCHEMY_DATABASE_URI']))
+Session = async_sessionmaker(engine, expire_on_commit=False)
+
+# One per shard when user data is sharded; empty otherwise
+shard_engines = [create_async_engine(async_database_url(url)) for url in flask_app.config['SHARD_DATABASE_URLS']]
+shard_sessions = [async_sessionmaker(shard_engine, expire_on_commit=False) for shard_engine in shard_engines]
+
+
+def shard_session(user_id):
+    """Session factory for the database holding user_id's data"""
+    if not shard_sessions:
+        return Session
+    return shard_sessions[shards.shard_of(user_id, len(shard_sessions))]
+
+
+async def user_session(claims):
+    """Session factory for the JWT user's data, routed like shards.ShardRouter"""
+    if not shard_sessions:
+        return Session
+    user_id = claims.get('uid')
+    if user_id is None:
+        async with Session() as session:
+            user_id = await session.scalar(select(UserDirectory.id).where(UserDirectory.email == claims['sub']))
+    return shard_session(user_id)
+
+def json_response(request, data, status_code=200):
+    """Serialize like Flask's jsonify (sorted keys, compact) and add CORS headers"""
+    body = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    headers = {}
+    if 'origin' in request.headers:
+        headers['Access-Control-Allow-Origin'] = '*'
+    return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+
+def int_arg(request, name, default=None):
+    """Integer query parameter; invalid values fall back to the default like Flask's type=int"""
+    try:
+        return int(request.query_params[name])
+    except (KeyError, ValueError):
+        return default
+
+
+def jwt_identity(request, query_string=False):
+    """
+    Decode the bearer token the same way @jwt_required does
+    With query_string=True a ?token= parameter is accepted when there is no header
+    Returns (claims, None) or (None, error response); the identity is claims['sub']
+    """
+    header = request.headers.get('authorization', '')
+    query_name = flask_app.config['JWT_QUERY_STRING_NAME']
+    if not header and query_string and query_name in request.query_params:
+        header = 'Bearer ' + request.query_params[query_name]
+    if not header:
+        return None, json_response(request, {'msg': 'Missing Authorization Header'}, 401)
+    parts = header.split()
+    if len(parts) != 2 or parts[0] != 'Bearer':
+        return None, json_response(request, {'msg': "Bad Authorization header. Expected 'Authorization: Bearer <JWT>'"}, 422)
+    try:
+        claims = jwt.decode(parts[1], flask_app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, json_response(request, {'msg': 'Token has expired'}, 401)
+    except jwt.InvalidTokenError as e:
+        return None, json_response(request, {'msg': str(e)}, 422)
+    if claims.get('type') != 'access':
+        return None, json_response(request, {'msg': 'Only non-refresh tokens are allowed'}, 422)
+    return claims, None
+
+
+def popularity_scores():
+    # The cache reloads through Flask-SQLAlchemy, so it needs an app context
+    with flask_app.app_context():
+        return flask_app.extensions['popularity'].scores()
+
+
+async def get_user(session, email):
+    result = await session.execute(select(User).where(User.email == email))
+    return result.scalars().first()
+
+
+async def get_meals(request):
+    """Get all meals with optional filtering"""
+    dining_hall_id = int_arg(request, 'dining_hall_id')
+    category_id = int_arg(request, 'category_id')
+    search = request.query_params.get('search', '')
+
+    query = reads.meals_query()
+
+    if dining_hall_id:
+        query = query.where(Meal.dining_hall_id == dining_hall_id)
+
+    if category_id:
+        query = query.where(Meal.category_id == category_id)
+
+    if search:
+        query = query.where(Meal.name.ilike(f'%{search}%'))
+
+    query = query.where(Meal.is_available == True)
+
+    async with Session() as session:
+        meals = [reads.serialize_meal(row) for row in await session.execute(query)]
+
+    # Most logged over the last month first, from the same per-worker cache as Flask
+    if request.query_params.get('sort') == 'popular':
+        scores = await run_in_threadpool(popularity_scores)
+        meals.sort(key=lambda meal: scores.get(meal['id'], 0), reverse=True)
+        return json_response(request, [dict(meal, popularity=scores.get(meal['id'], 0)) for meal in meals])
+
+    return json_response(request, meals)
+
+
+async def get_meal_history(request):
+    """Get meal history for the current user with optional date filtering"""
+    claims, error = jwt_identity(request)
+    if error:
+        return error
+    try:
+        async with (await user_session(claims))() as session:
+            user = await get_user(session, claims['sub'])
+            if not user:
+                return json_response(request, {'error': 'User not found'}, 404)
+
+            date_str = request.query_params.get('date')
+            limit = int_arg(request, 'limit', 100)
+            target_date = None
+
+            query = reads.user_meals_query().where(
+                UserMeal.user_id == user.id,
+                UserMeal.deleted_at.is_(None)
+            )
+
+            if date_str:
+                try:
+                    target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+                    query = query.where(UserMeal.date_consumed == target_date)
+                except ValueError:
+                    return json_response(request, {'error': 'Invalid date format. Use YYYY-MM-DD'}, 400)
+
+            query = query.order_by(UserMeal.consumed_at.desc()).limit(limit)
+            user_meals = [reads.serialize_user_meal(row) for row in await session.execute(query)]
+
+            # Entries from archived months come from user_meal_archive (see partitions.read_history)
+            until = await session.run_sync(partitions.archived_until)
+            if partitions.needs_archive(user_meals, limit, until, target_date):
+                archived = partitions.history_entries(
+                    await session.execute(partitions.history_query(user.id, target_date, limit)), target_date, limit)
+                if archived:
+                    meal_rows = await session.execute(
+                        reads.meals_query().where(Meal.id.in_(partitions.meal_ids(archived))))
+                    meals = {meal['id']: meal for meal in map(reads.serialize_meal, meal_rows)}
+                    user_meals = partitions.merge_history(
+                        user_meals, partitions.with_meals(archived, meals.get), limit)
+
+        return json_response(request, {
+            'meals': user_meals,
+            'count': len(user_meals)
+        })
+
+    except Exception as e:
+        return json_response(request, {'error': 'Failed to get meal history', 'details': str(e)}, 500)
+
+
+async def get_daily_meals(request):
+    """Get all meals for a specific date with daily totals"""
+    claims, error = jwt_identity(request)
+    if error:
+        return error
+    date = request.path_params['date']
+    try:
+        async with (await user_session(claims))() as session:
+            user = await get_user(session, claims['sub'])
+            if not user:
+                return json_response(request, {'error': 'User not found'}, 404)
+
+            try:
+                target_date = datetime.strptime(date, '%Y-%m-%d').date()
+            except ValueError:
+                return json_response(request, {'error': 'Invalid date format. Use YYYY-MM-DD'}, 400)
+
+            change_token = current_change_token()
+            query = reads.user_meals_query().where(
+                UserMeal.user_id == user.id,
+                UserMeal.date_consumed == target_date,
+                UserMeal.deleted_at.is_(None)
+            ).order_by(UserMeal.consumed_at.asc())
+            user_meals = [reads.serialize_user_meal(row) for row in await session.execute(query)]
+
+        return json_response(request, {
+            'date': date,
+            'meals': user_meals,
+            'count': len(user_meals),
+            'totals': reads.entry_totals(user_meals),
+            'goals': user_goals(user),
+            'change_token': change_token
+        })
+
+    except Exception as e:
+        return json_response(request, {'error': 'Failed to get daily meals', 'details': str(e)}, 500)
+
+
+async def daily_totals_event(user_id, day):
+    """Data for a 'totals' stream event, as app.daily_totals_event"""
+    query = select(*DAY_TOTALS_COLUMNS).where(
+        UserMeal.user_id == user_id,
+        UserMeal.date_consumed == day,
+        UserMeal.deleted_at.is_(None)
+    )
+    async with shard_session(user_id)() as session:
+        rows = (await session.execute(query)).all()
+    return {'date': day.isoformat(), 'count': len(rows), 'totals': nutrition_totals(rows)}
+
+
+class StreamHub:
+    """
+    Open event streams in this worker, by user. Each user with an open stream
+    has one broker subscription here; an event is formatted and its totals
+    looked up once, then the same text is queued for each of the user's streams.
+    """
+
+    def __init__(self, broker, loop):
+        self.broker = broker
+        self.loop = loop
+        self._streams = {}        # user_id -> set of asyncio.Queue
+        self._unsubscribe = {}    # user_id -> broker unsubscribe function
+        self._locks = {}          # user_id -> asyncio.Lock keeping a user's events in order
+
+    def open(self, user_id):
+        stream = asyncio.Queue()
+        if user_id not in self._streams:
+            self._streams[user_id] = set()
+            self._locks[user_id] = asyncio.Lock()
+            # Writes publish from Flask's worker threads; hop onto the event loop
+            self._unsubscribe[user_id] = self.broker.subscribe(
+                user_id, lambda event: self.loop.call_soon_threadsafe(self._received, user_id, event))
+        self._streams[user_id].add(stream)
+        return stream
+
+    def close(self, user_id, stream):
+        streams = self._streams.get(user_id)
+        if streams is None:
+            return
+        streams.discard(stream)
+        if not streams:
+            del self._streams[user_id]
+            del self._locks[user_id]
+            self._unsubscribe.pop(user_id)()
+
+    def _received(self, user_id, event):
+        if user_id in self._streams:
+            self.loop.create_task(self._fan_out(user_id, event, self._locks[user_id]))
+
+    async def _fan_out(self, user_id, event, lock):
+        async with lock:
+            messages = [events.format_event(event['type'], event)]
+            for day in sorted(set(event['dates'])):
+                totals = await daily_totals_event(user_id, datetime.strptime(day, '%Y-%m-%d').date())
+                messages.append(events.format_event('totals', totals))
+            text = ''.join(messages)
+            for stream in self._streams.get(user_id, ()):
+                stream.put_nowait(text)
+
+
+async def stream_meal_events(request):
+    """Push the current user's meal changes as Server-Sent Events, each followed by refreshed daily totals"""
+    claims, error = jwt_identity(request, query_string=True)
+    if error:
+        return error
+    async with (await user_session(claims))() as session:
+        user = await get_user(session, claims['sub'])
+    if not user:
+        return json_response(request, {'error': 'User not found'}, 404)
+
+    user_id = user.id
+    hub = request.app.state.hub
+
+    async def generate():
+        stream = hub.open(user_id)
+        try:
+            yield events.stream_preamble()
+            while True:
+                try:
+                    yield await asyncio.wait_for(stream.get(), events.HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield events.format_comment('keepalive')
+        finally:
+            hub.close(user_id, stream)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if 'origin' in request.headers:
+        headers['Access-Control-Allow-Origin'] = '*'
+    return StreamingResponse(generate(), media_type='text/event-stream', headers=headers)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.hub = StreamHub(flask_app.extensions['events'], asyncio.get_running_loop())
+    yield
+    await engine.dispose()
+    for shard_engine in shard_engines:
+        await shard_engine.dispose()
+
+
+# Async routes are matched first; anything else (including CORS preflight
+# requests for these paths) falls through to the Flask app.
+app = Starlette(
+    routes=[
+        Route('/api/meals', get_meals, methods=['GET']),
+        Route('/api/user-meals/history', get_meal_history, methods=['GET']),
+        Route('/api/user-meals/daily/{date}', get_daily_meals, methods=['GET']),
+        Route('/api/user-meals/stream', stream_meal_events, methods=['GET']),
+        Mount('/', WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
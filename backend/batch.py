@@ -0,0 +1,106 @@
+"""
+Batched GET requests for /api/batch
+
+Opening the dashboard takes several independent GETs (the user, today's
+meals, weight history, halls, categories), and each one pays its own round
+trip, TLS, JWT check, user lookup and admission slot. /api/batch takes a
+list of GET paths and runs them one after another inside its own app
+context, so they share a DB session (and shard route) and the user loaded
+by the first of them (current_user() in app.py caches it on g). The results
+come back in one response, in order, each with its own status:
+
+    POST /api/batch  {"requests": [{"method": "GET", "path": "/api/auth/me"}, ...]}
+    -> {"responses": [{"path": "/api/auth/me", "status": 200, "body": {...}}, ...]}
+
+Each sub-request gets its own request context carrying the batch's
+Authorization header, and is dispatched straight to its view: the
+per-request hooks (metrics, admission) run once, for the batch. Their
+teardown functions skip sub-requests (is_subrequest()). Streamed responses
+(export, event stream) cannot be batched.
+"""
+
+from flask import current_app, has_request_context, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
+
+from database import db
+
+# Most sub-requests one batch may carry
+MAX_REQUESTS = 20
+
+# Set in a sub-request's WSGI environ
+SUBREQUEST_KEY = 'templecals.batch'
+
+
+def is_subrequest():
+    return has_request_context() and request.environ.get(SUBREQUEST_KEY, False)
+
+
+def validate(requests):
+    """Error message for a malformed list of sub-requests, or None"""
+    if not isinstance(requests, list) or not requests:
+        return 'requests must be a non-empty list'
+    if len(requests) > MAX_REQUESTS:
+        return f'A batch cannot hold more than {MAX_REQUESTS} requests'
+    for item in requests:
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            return 'Each request needs a path'
+    return None
+
+
+def _environ(path):
+    headers = {}
+    if 'Authorization' in request.headers:
+        headers['Authorization'] = request.headers['Authorization']
+    builder = EnvironBuilder(path=path, method='GET', base_url=request.host_url, headers=headers,
+                             environ_base={'REMOTE_ADDR': request.remote_addr, SUBREQUEST_KEY: True})
+    try:
+        return builder.get_environ()
+    finally:
+        builder.close()
+
+
+def _result(path, status, body):
+    return {'path': path, 'status': status, 'body': body}
+
+
+def _dispatch(path):
+    app = current_app._get_current_object()
+    with app.request_context(_environ(path)):
+        try:
+            rv = app.dispatch_request()
+        except HTTPException as e:
+            # No route (404) or not a GET route (405)
+            return _result(path, e.code, {'error': e.description})
+        except Exception as e:
+            # The JWT errors, through the app's error handlers
+            rv = app.handle_user_exception(e)
+        response = app.make_response(rv)
+        if response.is_streamed:
+            response.close()
+            return _result(path, 400, {'error': 'Streamed responses cannot be batched'})
+        body = response.get_json(silent=True)
+        if body is None:
+            body = response.get_data(as_text=True)
+        return _result(path, response.status_code, body)
+
+
+def run(requests):
+    """Results of validated sub-requests, in order"""
+    results = []
+    for item in requests:
+        path = item['path']
+        if item.get('method', 'GET').upper() != 'GET':
+            results.append(_result(path, 405, {'error': 'Only GET requests can be batched'}))
+        elif not path.startswith('/api/') or path.split('?', 1)[0].rstrip('/') == '/api/batch':
+            results.append(_result(path, 400, {'error': 'Only /api/ paths other than /api/batch can be batched'}))
+        else:
+            try:
+                result = _dispatch(path)
+            except Exception as e:
+                result = _result(path, 500, {'error': 'Request failed', 'details': str(e)})
+            # The session is shared, so a failed transaction must not carry over to the next one
+            if result['status'] >= 500:
+                db.session.rollback()
+            results.append(result)
+    return results
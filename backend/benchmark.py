@@ -0,0 +1,425 @@
+"""
+Endpoint benchmark suite for the TempleCals API
+
+Builds a large synthetic dataset (users, meals across every dining hall and
+user_meals spread over the past year), then times every main route through
+the Flask test client and writes a JSON report with p50/p95/p99 latency and
+SQL statements per request, plus the CPU time per row of serializing through
+ORM entities versus reads.py's column-only path. Reports from two commits can
+be compared to catch regressions.
+
+Usage:
+    python3 benchmark.py --database-url sqlite:////tmp/templecals_bench.db
+    python3 benchmark.py --reuse --output after.json --compare before.json
+
+The target database is dropped and rebuilt unless --reuse is given, so never
+point this at a real database.
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import generate_data
+
+DEFAULT_DATABASE_URL = 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'templecals_bench.db')
+
+# Every benchmark user shares this password so login can be timed
+BENCH_PASSWORD = generate_data.DEFAULT_PASSWORD
+
+# Most SQL statements a single request may run; the run fails if a route goes over
+QUERY_BUDGETS = {'log': 2, 'update': 2, 'delete': 2}
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def build_dataset(db, users, meals, user_meals):
+    """Drop and recreate all tables, then bulk load the synthetic dataset"""
+    import popularity
+    db.drop_all()
+    db.create_all()
+    generate_data.generate(db.engine, meals=meals, users=users, user_meals=user_meals,
+                           password=BENCH_PASSWORD)
+    popularity.rebuild(db.session)
+    db.session.commit()
+
+
+def dataset_size(app, db, models):
+    """Row counts of the benchmarked tables"""
+    with app.app_context():
+        return {
+            name: db.session.execute(db.select(db.func.count()).select_from(model)).scalar()
+            for name, model in (('users', models.User), ('meals', models.Meal),
+                                ('user_meals', models.UserMeal))
+        }
+
+
+class QueryCounter:
+    """
+    Counts SQL statements executed on any of the given engines; pass every
+    engine of the app (db.engines.values()), as embedded SQLite mode sends
+    reads to a reader bind and sharding to the shard binds
+    """
+
+    def __init__(self, engines):
+        from sqlalchemy import event
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+
+    def _after_cursor_execute(self, *args):
+        self.count += 1
+
+
+def run_benchmarks(app, db, models, iterations, seed=7):
+    """Time each route; returns {route name: stats dict}"""
+    from flask_jwt_extended import create_access_token
+    from app import encode_change_token
+
+    rng = random.Random(seed)
+    with app.app_context():
+        emails = [row[0] for row in db.session.execute(db.select(models.User.email).limit(1000))]
+        hall_ids = [row[0] for row in db.session.execute(db.select(models.DiningHall.id))]
+        category_ids = [row[0] for row in db.session.execute(db.select(models.MealCategory.id))]
+        meal_ids = [row[0] for row in db.session.execute(db.select(models.Meal.id).limit(1000))]
+        tokens = {email: create_access_token(identity=email) for email in emails}
+        # Existing entries to edit and delete, with the email that owns each
+        owned = [tuple(row) for row in db.session.execute(
+            db.select(models.User.email, models.UserMeal.id)
+            .join(models.UserMeal, models.UserMeal.user_id == models.User.id)
+            .where(models.User.email.in_(emails[:100]), models.UserMeal.deleted_at.is_(None))
+            .limit(2 * iterations + 20)
+        )]
+        counter = QueryCounter(db.engines.values())
+
+    today = datetime.utcnow().date()
+
+    def auth():
+        return {'Authorization': 'Bearer ' + tokens[rng.choice(emails)]}
+
+    def random_date():
+        return (today - timedelta(days=rng.randrange(30))).isoformat()
+
+    # Polling clients ask for what changed in roughly the last minute
+    change_token = encode_change_token(datetime.utcnow() - timedelta(minutes=1), 0)
+
+    def owned_entry(method, body=None):
+        # Deletes use each entry once; updates reuse the other half
+        email, user_meal_id = owned.pop() if method == 'DELETE' else rng.choice(owned[:len(owned) // 2])
+        kwargs = {'headers': {'Authorization': 'Bearer ' + tokens[email]}}
+        if body is not None:
+            kwargs['json'] = body
+        return (method, '/api/user-meals/%d' % user_meal_id, kwargs)
+
+    # Each route is a function returning (method, url, kwargs) for one request
+    routes = {
+        'meals_all': lambda: ('GET', '/api/meals', {}),
+        'meals_by_hall': lambda: ('GET', '/api/meals?dining_hall_id=%d' % rng.choice(hall_ids), {}),
+        'meals_by_category': lambda: ('GET', '/api/meals?category_id=%d' % rng.choice(category_ids), {}),
+        'meals_search': lambda: ('GET', '/api/meals?search=%s' % rng.choice(generate_data.MEAL_WORDS[1]).lower(), {}),
+        'meals_popular': lambda: ('GET', '/api/meals/popular?hall=%d&window=week' % rng.choice(hall_ids), {}),
+        'meals_sorted_popular': lambda: ('GET', '/api/meals?sort=popular&dining_hall_id=%d' % rng.choice(hall_ids), {}),
+        'daily': lambda: ('GET', '/api/user-meals/daily/%s' % random_date(), {'headers': auth()}),
+        'range_month': lambda: ('GET', '/api/user-meals/range?start=%s&end=%s' % (
+            (today - timedelta(days=29)).isoformat(), today.isoformat()), {'headers': auth()}),
+        'breakdown_year': lambda: ('GET', '/api/user-meals/breakdown?start=%s&end=%s&by=%s' % (
+            (today - timedelta(days=365)).isoformat(), today.isoformat(), rng.choice(['hall', 'category', 'meal'])),
+            {'headers': auth()}),
+        'changes': lambda: ('GET', '/api/user-meals/changes?since=%s' % change_token, {'headers': auth()}),
+        'history': lambda: ('GET', '/api/user-meals/history', {'headers': auth()}),
+        'history_by_date': lambda: ('GET', '/api/user-meals/history?date=%s' % random_date(), {'headers': auth()}),
+        'log': lambda: ('POST', '/api/user-meals/log',
+                        {'headers': auth(), 'json': {'meal_id': rng.choice(meal_ids)}}),
+        'update': lambda: owned_entry('PUT', {'serving_multiplier': rng.choice([0.5, 1.0, 1.5]),
+                                              'consumed_at': '%sT%02d:30:00' % (random_date(), rng.randrange(24))}),
+        'delete': lambda: owned_entry('DELETE'),
+        'login': lambda: ('POST', '/api/auth/login',
+                          {'json': {'email': rng.choice(emails), 'password': BENCH_PASSWORD}}),
+    }
+
+    client = app.test_client()
+    results = {}
+    for name, make_request in routes.items():
+        # Warm up caches and connections before measuring
+        for _ in range(min(3, iterations)):
+            method, url, kwargs = make_request()
+            client.open(url, method=method, **kwargs)
+
+        timings = []
+        queries = 0
+        max_queries = 0
+        errors = 0
+        for _ in range(iterations):
+            method, url, kwargs = make_request()
+            counter.count = 0
+            start = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            timings.append((time.perf_counter() - start) * 1000)
+            queries += counter.count
+            max_queries = max(max_queries, counter.count)
+            if response.status_code >= 400:
+                errors += 1
+
+        timings.sort()
+        results[name] = {
+            'requests': iterations,
+            'errors': errors,
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries_per_request': round(queries / float(iterations), 2),
+            'max_queries': max_queries,
+        }
+        print('%-18s p50=%8.2fms p95=%8.2fms p99=%8.2fms queries=%5.1f errors=%d' % (
+            name, results[name]['p50_ms'], results[name]['p95_ms'],
+            results[name]['p99_ms'], results[name]['queries_per_request'], errors))
+    return results
+
+
+def run_read_path_benchmark(app, db, models, rows, repeats=5):
+    """
+    CPU time per row to load and serialize meals and logged meals, through
+    ORM entities + to_dict() and through reads.py's column-only path.
+    Each pass starts from an empty session, like a request does.
+    """
+    from sqlalchemy.orm import joinedload
+    import reads
+
+    Meal, UserMeal = models.Meal, models.UserMeal
+    paths = {
+        'meals': (
+            lambda: [meal.to_dict() for meal in db.session.execute(
+                db.select(Meal).options(joinedload(Meal.dining_hall), joinedload(Meal.category))
+                .order_by(Meal.id).limit(rows)).scalars()],
+            lambda: [reads.serialize_meal(row) for row in db.session.execute(
+                reads.meals_query().order_by(Meal.id).limit(rows))],
+        ),
+        'user_meals': (
+            lambda: [um.to_dict() for um in db.session.execute(
+                db.select(UserMeal).options(joinedload(UserMeal.meal).joinedload(Meal.dining_hall),
+                                            joinedload(UserMeal.meal).joinedload(Meal.category))
+                .order_by(UserMeal.id).limit(rows)).scalars()],
+            lambda: [reads.serialize_user_meal(row) for row in db.session.execute(
+                reads.user_meals_query().order_by(UserMeal.id).limit(rows))],
+        ),
+    }
+
+    results = {}
+    with app.app_context():
+        for name, (orm_path, core_path) in paths.items():
+            stats = {}
+            for path_name, load in (('orm', orm_path), ('core', core_path)):
+                best = None
+                for _ in range(repeats):
+                    db.session.remove()
+                    start = time.process_time()
+                    count = len(load())
+                    elapsed = time.process_time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                stats[path_name + '_us_per_row'] = round(best / max(count, 1) * 1e6, 2)
+            stats['rows'] = count
+            stats['speedup'] = round(stats['orm_us_per_row'] / stats['core_us_per_row'], 2) \
+                if stats['core_us_per_row'] else None
+            results[name] = stats
+            print('%-18s orm=%7.2fus/row core=%7.2fus/row (%.1fx, %d rows)' % (
+                name, stats['orm_us_per_row'], stats['core_us_per_row'], stats['speedup'] or 0, count))
+        db.session.remove()
+    return results
+
+
+def run_attack_benchmark(app, db, models, duration, ramp=20.0, attackers=8, attacker_ips=2,
+                         attack_rate=10.0, seed=11):
+    """
+    Time legitimate logins while attacker threads hammer /api/auth/login with
+    bad passwords from a few addresses, first with rate limiting off and then on.
+    Legitimate logins are timed after a ramp period, once the attackers have
+    spent their initial burst of tokens. Each attacker offers at most
+    attack_rate requests per second so the simulated clients, which share
+    our CPU, do not drown out the server-side cost being measured.
+    """
+    import threading
+
+    rng = random.Random(seed)
+    with app.app_context():
+        emails = [row[0] for row in db.session.execute(db.select(models.User.email).limit(2000))]
+
+    results = {}
+    for scenario, limited, attacking in (('baseline', True, False),
+                                         ('attack_unlimited', False, True),
+                                         ('attack_limited', True, True)):
+        app.config['RATELIMIT_ENABLED'] = limited
+        app.extensions['ratelimit'].backend.reset()
+        stop = threading.Event()
+        attack_statuses = {}
+
+        def attack(n):
+            client = app.test_client()
+            attacker_rng = random.Random(n)
+            while not stop.is_set():
+                sent = time.perf_counter()
+                response = client.post('/api/auth/login',
+                                       json={'email': attacker_rng.choice(emails), 'password': 'wrong'},
+                                       environ_base={'REMOTE_ADDR': '203.0.113.%d' % (n % attacker_ips)})
+                attack_statuses[response.status_code] = attack_statuses.get(response.status_code, 0) + 1
+                stop.wait(max(0.0, 1.0 / attack_rate - (time.perf_counter() - sent)))
+
+        threads = [threading.Thread(target=attack, args=(n,)) for n in range(attackers if attacking else 0)]
+        for thread in threads:
+            thread.start()
+        if attacking:
+            time.sleep(ramp)
+
+        # Legitimate users: a different account and address for every login
+        client = app.test_client()
+        timings = []
+        errors = 0
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            n = len(timings)
+            start = time.perf_counter()
+            response = client.post('/api/auth/login',
+                                   json={'email': emails[n % len(emails)], 'password': BENCH_PASSWORD},
+                                   environ_base={'REMOTE_ADDR': '10.%d.%d.%d' % (n >> 16 & 255, n >> 8 & 255, n & 255)})
+            timings.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors += 1
+            time.sleep(rng.uniform(0, 0.05))
+
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        timings.sort()
+        results[scenario] = {
+            'legit_requests': len(timings),
+            'legit_errors': errors,
+            'legit_p50_ms': round(percentile(timings, 50), 3),
+            'legit_p95_ms': round(percentile(timings, 95), 3),
+            'legit_p99_ms': round(percentile(timings, 99), 3),
+            'attack_statuses': {str(k): v for k, v in sorted(attack_statuses.items())},
+        }
+        print('%-18s legit p50=%8.2fms p95=%8.2fms p99=%8.2fms errors=%d attack=%s' % (
+            scenario, results[scenario]['legit_p50_ms'], results[scenario]['legit_p95_ms'],
+            results[scenario]['legit_p99_ms'], errors, results[scenario]['attack_statuses']))
+
+    app.config['RATELIMIT_ENABLED'] = False
+    return results
+
+
+def compare_reports(baseline, current, max_regression):
+    """Print per-route p95 changes; returns names of routes that regressed"""
+    regressed = []
+    for name, stats in current['routes'].items():
+        before = baseline.get('routes', {}).get(name)
+        if not before or not before['p95_ms']:
+            continue
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms']
+        flag = ''
+        if change > max_regression:
+            regressed.append(name)
+            flag = '  REGRESSION'
+        print('%-18s p95 %8.2fms -> %8.2fms (%+.1f%%) queries %5.1f -> %5.1f%s' % (
+            name, before['p95_ms'], stats['p95_ms'], change * 100,
+            before['queries_per_request'], stats['queries_per_request'], flag))
+    return regressed
+
+
+def check_query_budgets(routes):
+    """Names of routes that ran more SQL statements in one request than QUERY_BUDGETS allows"""
+    over = []
+    for name, budget in QUERY_BUDGETS.items():
+        stats = routes.get(name)
+        if stats and stats['max_queries'] > budget:
+            print('%-18s ran %d statements in one request (budget %d)' % (name, stats['max_queries'], budget))
+            over.append(name)
+    return over
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the TempleCals API endpoints')
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL', DEFAULT_DATABASE_URL),
+                        help='database to build and benchmark (it will be wiped)')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--meals', type=int, default=5000)
+    parser.add_argument('--user-meals', type=int, default=2000000)
+    parser.add_argument('--iterations', type=int, default=200, help='timed requests per route')
+    parser.add_argument('--reuse', action='store_true', help='reuse an existing dataset instead of rebuilding')
+    parser.add_argument('--output', default='benchmark_report.json')
+    parser.add_argument('--compare', help='earlier report to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed p95 slowdown as a fraction before failing (default 0.2)')
+    parser.add_argument('--read-rows', type=int, default=5000,
+                        help='rows per pass when comparing ORM and column-only serialization CPU time')
+    parser.add_argument('--attack', type=float, metavar='SECONDS',
+                        help='also time legitimate logins during a credential-stuffing attack')
+    parser.add_argument('--attack-ramp', type=float, default=20.0, metavar='SECONDS',
+                        help='how long the attack runs before legitimate logins are timed')
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from database import db
+    import models
+
+    # Rate limits would turn repeated logins from one address into 429s
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'ENABLE_MIGRATIONS': False,
+                      'RATELIMIT_ENABLED': False})
+
+    if not args.reuse:
+        print('Building dataset: %d users, %d meals, %d user_meals...' % (
+            args.users, args.meals, args.user_meals))
+        start = time.perf_counter()
+        with app.app_context():
+            build_dataset(db, args.users, args.meals, args.user_meals)
+        print('Dataset built in %.1fs' % (time.perf_counter() - start))
+
+    routes = run_benchmarks(app, db, models, args.iterations)
+    report = {
+        'commit': _git_commit(),
+        'created_at': datetime.utcnow().isoformat(),
+        'database': args.database_url.split('://', 1)[0],
+        'dataset': dataset_size(app, db, models),
+        'iterations': args.iterations,
+        'routes': routes,
+        'read_paths': run_read_path_benchmark(app, db, models, args.read_rows),
+    }
+    if args.attack:
+        report['attack'] = run_attack_benchmark(app, db, models, args.attack, ramp=args.attack_ramp)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print('Report written to %s' % args.output)
+
+    if check_query_budgets(routes):
+        return 1
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = compare_reports(baseline, report, args.max_regression)
+        if regressed:
+            print('Regressions: %s' % ', '.join(regressed))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+Per-worker meal catalog
+
+Meals, halls and categories only change through seed/import scripts, so each
+worker keeps every meal's API dict (Meal.to_dict()) in memory. Write
+endpoints build their responses from it instead of reloading the meal, its
+dining hall and its category after the commit.
+
+The whole catalog is reloaded in one query after MEAL_CACHE_SECONDS, or
+when asked for a meal id it has not seen yet. Each reload bumps version, so
+structures derived from the catalog (the suggestion index in suggest.py)
+know when to rebuild.
+"""
+
+import threading
+import time
+
+from sqlalchemy import select
+from sqlalchemy.orm import configure_mappers, joinedload
+
+from database import db
+from models import Meal
+
+# Minimum time between reloads triggered by a meal id the catalog does not know
+MISS_RELOAD_SECONDS = 1.0
+
+
+class MealCatalog:
+    """{meal_id: meal dict} for every meal, refreshed after ttl seconds"""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._meals = None
+        self._loaded_at = 0.0
+        self.version = 0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # Backrefs such as Meal.dining_hall only exist once the mappers are
+        # configured, which nothing else may have done yet in this worker
+        configure_mappers()
+        query = select(Meal).options(joinedload(Meal.dining_hall), joinedload(Meal.category))
+        # to_dict() only has the hall's name, so keep the id alongside it
+        meals = {meal.id: (meal.dining_hall_id, meal.to_dict()) for meal in db.session.execute(query).scalars()}
+        with self._lock:
+            self._meals = meals
+            self._loaded_at = time.monotonic()
+            self.version += 1
+
+    def _entry(self, meal_id):
+        with self._lock:
+            meals, age = self._meals, time.monotonic() - self._loaded_at
+        # Unknown ids reload at most once a second, so bad ids cannot force a reload per request
+        if meals is None or age > self.ttl or (meal_id not in meals and age > MISS_RELOAD_SECONDS):
+            self._load()
+            with self._lock:
+                meals = self._meals
+        return meals.get(meal_id)
+
+    def snapshot(self):
+        """(version, {meal_id: (dining hall id, meal dict)}) for the whole catalog; treat it as read-only"""
+        with self._lock:
+            meals, age = self._meals, time.monotonic() - self._loaded_at
+        if meals is None or age > self.ttl:
+            self._load()
+        with self._lock:
+            return self.version, self._meals
+
+    def get(self, meal_id):
+        """Meal.to_dict() for meal_id, or None if there is no such meal"""
+        entry = self._entry(meal_id)
+        return entry[1] if entry else None
+
+    def hall_id(self, meal_id):
+        entry = self._entry(meal_id)
+        return entry[0] if entry else None
+
+    def clear(self):
+        with self._lock:
+            self._meals = None
+
+
+def init_catalog(app):
+    app.extensions['meal_catalog'] = MealCatalog(app.config['MEAL_CACHE_SECONDS'])
@@ -1,4 +1,23 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
+
+
+class RoutingSession(Session):
+    """
+    Flask-SQLAlchemy's session, except that when user data is sharded
+    (SHARD_DATABASE_URLS, see shards.py) the shard router picks the database,
+    and in embedded SQLite mode (embedded.py) reads go to a pool of readers
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        router = None
+        if bind is None:
+            router = current_app.extensions.get('shards') or current_app.extensions.get('embedded')
+        if router is not None:
+            return router.get_bind(self, mapper, clause)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
 
 # Create database instance
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
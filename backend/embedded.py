@@ -0,0 +1,106 @@
+"""
+Embedded SQLite mode
+
+With a sqlite:/// SQLALCHEMY_DATABASE_URI the app runs without a database
+server, for single-node kiosk deployments and fast benchmark and test runs.
+SQLite allows one writer at a time but, in WAL mode, any number of readers
+alongside it, so every connection is set up for that:
+
+- journal_mode=WAL, so reads never block on a write (or a write on reads)
+- synchronous=NORMAL: in WAL mode a commit is still atomic and durable
+  against application crashes, and skips an fsync per transaction
+- a busy timeout (SQLITE_BUSY_TIMEOUT seconds), so a second worker process
+  waits for the write lock instead of failing with "database is locked"
+
+The default engine becomes the writer, a pool of one connection, so this
+process's writers queue in the pool rather than contend for the file lock.
+The 'sqlite_readers' bind opens the same file read-only with
+SQLITE_READERS pooled connections. RoutingSession sends SELECTs to the
+readers until the session's first write; from then until the transaction
+ends it stays on the writer and reads its own changes.
+
+An in-memory database (sqlite://) is one connection shared by every thread
+(Flask-SQLAlchemy's StaticPool), with no separate readers. Sharding
+(SHARD_DATABASE_URLS) turns this off; Postgres URLs never use it.
+"""
+
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+from database import RoutingSession
+
+READER_BIND = 'sqlite_readers'
+
+# session.info flag set once a session has written in its current transaction
+WRITER_KEY = 'sqlite_writer'
+
+
+def _on_connect(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        # Stored in the file, so only the first writer really changes it;
+        # a read-only connection opened before that cannot, and need not
+        cursor.execute('PRAGMA journal_mode=WAL')
+    except sqlite3.OperationalError:
+        pass
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+def _end_transaction(session, transaction):
+    if transaction.parent is None:
+        session.info.pop(WRITER_KEY, None)
+
+
+def is_memory(url):
+    return url.database in (None, '', ':memory:') or url.query.get('mode') == 'memory'
+
+
+def reader_url(url):
+    """The same database as url, opened read-only"""
+    database = url.database[5:] if url.query.get('uri') else url.database
+    return url.set(database='file:' + database, query={'mode': 'ro', 'uri': 'true'})
+
+
+class EmbeddedRouter:
+    """Picks the reader pool or the writer for each statement of a RoutingSession"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get_bind(self, session, mapper, clause):
+        if not session.info.get(WRITER_KEY):
+            if clause is not None and getattr(clause, 'is_select', False):
+                return self.db.engines[READER_BIND]
+            # Flushes, DML and raw SQL take the writer, and so does everything after them
+            session.info[WRITER_KEY] = True
+        return self.db.engines[None]
+
+
+def init_embedded(app, db):
+    """Set up a SQLite main database as one writer plus read-only readers; call before db.init_app()"""
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() != 'sqlite' or app.config['SHARD_DATABASE_URLS']:
+        return
+    if not event.contains(Engine, 'connect', _on_connect):
+        event.listen(Engine, 'connect', _on_connect)
+
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    timeout = app.config['SQLITE_BUSY_TIMEOUT']
+    options['connect_args'] = dict(options.get('connect_args') or {}, timeout=timeout)
+    readers = app.config['SQLITE_READERS']
+    if is_memory(url) or readers <= 0:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+        return
+
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(options, pool_size=1, max_overflow=0, pool_timeout=timeout)
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds[READER_BIND] = dict(options, url=reader_url(url), pool_size=readers, max_overflow=0, pool_timeout=timeout)
+    app.config['SQLALCHEMY_BINDS'] = binds
+    if not event.contains(RoutingSession, 'after_transaction_end', _end_transaction):
+        event.listen(RoutingSession, 'after_transaction_end', _end_transaction)
+    app.extensions['embedded'] = EmbeddedRouter(db)
@@ -0,0 +1,120 @@
+"""
+Live meal events for /api/user-meals/stream (Server-Sent Events)
+
+Write endpoints publish an event per user after each commit; every open
+stream for that user receives it. Delivery goes through a broker:
+
+- memory:// (default) delivers to streams in this process only. That covers
+  the dev server and a single ASGI worker, where one event loop holds every
+  idle connection.
+- redis://... relays events through Redis pub/sub so a write on one worker
+  reaches streams held by any other worker or host (needs the redis package).
+
+Subscribers register a callback, so the same broker feeds blocking queues
+(Flask's threaded stream) and asyncio queues (asgi.py) alike. Publishing
+does no database work; streams look up refreshed totals themselves.
+"""
+
+import json
+import threading
+
+# Seconds between keep-alive comments on an idle stream, so proxies keep it open
+HEARTBEAT_SECONDS = 15
+
+# Browsers reconnect after this many milliseconds if the stream drops
+RETRY_MS = 3000
+
+
+def format_event(event, data):
+    """One SSE message"""
+    return 'event: %s\ndata: %s\n\n' % (event, json.dumps(data, sort_keys=True, separators=(',', ':')))
+
+
+def format_comment(text):
+    return ': %s\n\n' % text
+
+
+def stream_preamble():
+    return 'retry: %d\n%s' % (RETRY_MS, format_comment('connected'))
+
+
+class LocalBroker:
+    """Delivers events to subscribers in this process"""
+
+    def __init__(self):
+        # user_id -> set of callbacks
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id, callback):
+        """callback(event dict) runs on the publishing thread; returns an unsubscribe function"""
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(user_id)
+                if callbacks is not None:
+                    callbacks.discard(callback)
+                    if not callbacks:
+                        del self._subscribers[user_id]
+        return unsubscribe
+
+    def publish(self, user_id, event):
+        self._dispatch(user_id, event)
+
+    def _dispatch(self, user_id, event):
+        with self._lock:
+            callbacks = list(self._subscribers.get(user_id, ()))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception:
+                # A stream that is going away must not stop delivery to the others
+                pass
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+
+class RedisBroker(LocalBroker):
+    """Relays events between processes through a Redis pub/sub channel"""
+
+    def __init__(self, url, channel='templecals:user-meal-events'):
+        super().__init__()
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self.channel = channel
+        self._listener = None
+
+    def subscribe(self, user_id, callback):
+        # Only processes that actually hold streams listen on the channel
+        if self._listener is None:
+            with self._lock:
+                if self._listener is None:
+                    self._listener = threading.Thread(target=self._listen, daemon=True)
+                    self._listener.start()
+        return super().subscribe(user_id, callback)
+
+    def publish(self, user_id, event):
+        self._client.publish(self.channel, json.dumps({'user_id': user_id, 'event': event}))
+
+    def _listen(self):
+        pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(self.channel)
+        for message in pubsub.listen():
+            payload = json.loads(message['data'])
+            self._dispatch(payload['user_id'], payload['event'])
+
+
+def create_broker(url):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBroker(url)
+    if url.startswith('memory://'):
+        return LocalBroker()
+    raise ValueError('Unsupported EVENTS_BROKER_URL: %s' % url)
+
+
+def init_events(app):
+    app.extensions['events'] = create_broker(app.config['EVENTS_BROKER_URL'])
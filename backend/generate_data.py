@@ -0,0 +1,358 @@
+"""
+High-speed synthetic data generator for load tests
+
+Generates dining halls, categories, meals, users and user_meals in
+configurable volumes and bulk loads them without going through the ORM:
+Postgres gets a COPY streamed straight from a Python generator, SQLite (and
+anything else) falls back to executemany in large batches.
+
+Logged meals follow realistic patterns: most are eaten around breakfast,
+lunch and dinner, weekends are quieter than weekdays, and a few popular meals
+account for most of the logs.
+
+Usage:
+    python3 generate_data.py --database-url postgresql://localhost/templecals_load \\
+        --users 10000 --meals 5000 --user-meals 5000000
+
+All tables in the target database are dropped and recreated.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+# Every generated user shares this password (hashed once per run)
+DEFAULT_PASSWORD = 'BenchPassw0rd'
+
+HALLS = ["Johnson & Hardwick Hall", "Morgan's Hall", "The Market at Liacouras Walk",
+         "Temple Student Center", "Cafe 1810", "Tuttleman Food Court", "Beury Grab & Go",
+         "Paley Cafe"]
+CATEGORIES = [
+    ("Breakfast", "Morning meals served until 10:30 AM", "07:00", "10:30"),
+    ("Lunch", "Midday meals served 11:00 AM - 4:00 PM", "11:00", "16:00"),
+    ("Dinner", "Evening meals served after 5:00 PM", "17:00", "21:00"),
+    ("Snacks", "Light snacks and beverages", "08:00", "22:00"),
+    ("Desserts", "Sweet treats and desserts", "11:00", "22:00"),
+]
+MEAL_WORDS = (
+    ["Grilled", "Roasted", "Crispy", "Spicy", "Baked", "Steamed", "BBQ", "Teriyaki", "Garlic", "Honey"],
+    ["Chicken", "Turkey", "Tofu", "Salmon", "Beef", "Veggie", "Shrimp", "Egg", "Pork", "Chickpea"],
+    ["Wrap", "Bowl", "Sandwich", "Salad", "Pasta", "Burger", "Tacos", "Pizza", "Soup", "Stir Fry"],
+)
+ALLERGENS = ["dairy", "eggs", "gluten", "nuts", "soy", "fish", "shellfish"]
+DIETARY_TAGS = ["vegetarian", "vegan", "halal", "gluten-free"]
+
+# Relative share of meals logged in each hour of the day (0-23)
+HOUR_WEIGHTS = [1, 0, 0, 0, 0, 1, 3, 12, 18, 12, 6, 10,
+                22, 20, 8, 5, 5, 12, 20, 18, 10, 6, 4, 2]
+# Monday..Sunday; students log less on weekends
+WEEKDAY_WEIGHTS = [1.0, 1.0, 1.0, 1.0, 0.9, 0.65, 0.7]
+
+GENDERS = ['male', 'female', 'other']
+ACTIVITY_LEVELS = ['sedentary', 'light', 'moderate', 'active', 'very_active']
+GOALS = ['cutting', 'bulking', 'maintaining', 'tracking']
+
+BATCH_SIZE = 20000
+
+
+def _datetime_text(value):
+    # Same text layout SQLAlchemy uses for SQLite; Postgres parses it as well
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def hall_rows(count, now):
+    for i in range(count):
+        name = HALLS[i] if i < len(HALLS) else 'Dining Hall %d' % (i + 1)
+        yield (i + 1, name, 'Temple University, Philadelphia, PA 19122', name,
+               json.dumps({'monday': {'open': '8:00-22:00'}}), _datetime_text(now))
+
+
+def category_rows(count):
+    for i in range(count):
+        if i < len(CATEGORIES):
+            name, description = CATEGORIES[i][:2]
+        else:
+            name, description = 'Category %d' % (i + 1), None
+        yield (i + 1, name, description)
+
+
+def meal_rows(count, halls, categories, rng, now):
+    created = _datetime_text(now)
+    for i in range(count):
+        category = i % categories
+        start, end = CATEGORIES[category][2:] if category < len(CATEGORIES) else ('08:00', '22:00')
+        yield (
+            i + 1,
+            '%s %s %s' % tuple(rng.choice(words) for words in MEAL_WORDS),
+            'Generated meal %d' % (i + 1),
+            rng.randint(50, 1200),
+            round(rng.uniform(0, 60), 1),
+            round(rng.uniform(0, 120), 1),
+            round(rng.uniform(0, 50), 1),
+            round(rng.uniform(0, 2000), 1),
+            round(rng.uniform(0, 12), 2),
+            json.dumps(rng.sample(ALLERGENS, rng.randint(0, 2))),
+            json.dumps(rng.sample(DIETARY_TAGS, rng.randint(0, 1))),
+            start + ':00.000000',
+            end + ':00.000000',
+            rng.random() > 0.05,
+            rng.randrange(halls) + 1,
+            category + 1,
+            created,
+            created,
+        )
+
+
+def user_rows(count, password_hash, rng, now):
+    for i in range(count):
+        created = now - timedelta(days=rng.randrange(730))
+        yield (
+            i + 1,
+            'user%d@generated.templecals.edu' % (i + 1),
+            password_hash,
+            'Student',
+            'User%d' % (i + 1),
+            rng.randint(17, 30),
+            round(rng.uniform(100, 260), 1),
+            round(rng.uniform(58, 78), 1),
+            rng.choice(GENDERS),
+            rng.choice(ACTIVITY_LEVELS),
+            rng.choice(GOALS),
+            2000, 150.0, 250.0, 65.0,
+            # Half the users auto-calculate, so `flask recalculate-goals` has work to do
+            i % 2 == 0,
+            _datetime_text(created),
+            None,
+        )
+
+
+def _remember_nutrition(rows, nutrition):
+    """Pass meals rows through, keeping each meal's (calories, protein, carbs, fat, sodium)"""
+    for row in rows:
+        nutrition.append(row[3:8])
+        yield row
+
+
+def user_meal_rows(count, users, meals, days, rng, now, nutrition):
+    """
+    Yield user_meals rows with realistic time-of-day and weekday patterns
+    nutrition[meal_id - 1] is the meal's snapshot, filled in while meals load
+    """
+    today = now.date()
+    day_list = [today - timedelta(days=d) for d in range(days)]
+    day_weights = [WEEKDAY_WEIGHTS[day.weekday()] for day in day_list]
+    # Zipf-like popularity: meal n is logged roughly 1/n^0.8 as often as meal 1
+    meal_weights = [1.0 / (n ** 0.8) for n in range(1, meals + 1)]
+    meal_ids = list(range(1, meals + 1))
+    rng.shuffle(meal_ids)
+    servings = (0.5, 1.0, 1.0, 1.0, 1.0, 1.5, 2.0)
+    hours = range(24)
+
+    row_id = 0
+    while row_id < count:
+        chunk = min(BATCH_SIZE, count - row_id)
+        chosen_days = rng.choices(day_list, weights=day_weights, k=chunk)
+        chosen_hours = rng.choices(hours, weights=HOUR_WEIGHTS, k=chunk)
+        chosen_meals = rng.choices(meal_ids, weights=meal_weights, k=chunk)
+        for day, hour, meal_id in zip(chosen_days, chosen_hours, chosen_meals):
+            row_id += 1
+            consumed = datetime(day.year, day.month, day.day, hour,
+                                rng.randrange(60), rng.randrange(60))
+            consumed_text = _datetime_text(consumed)
+            # Entries for later today are "planned ahead": written now, not in the future
+            written_text = consumed_text if consumed <= now else _datetime_text(now)
+            yield (
+                row_id,
+                rng.randrange(users) + 1,
+                meal_id,
+                rng.choice(servings),
+                consumed_text,
+                day.isoformat(),
+                None,
+                written_text,
+                written_text,
+            ) + nutrition[meal_id - 1]
+
+
+# Loaders
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+class _CopyStream:
+    """File-like object that feeds COPY from a row generator without buffering it all"""
+
+    def __init__(self, rows):
+        self._lines = ('\t'.join(map(_copy_value, row)) + '\n' for row in rows)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        while size < 0 or length < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self._buffer = ''
+            return data
+        self._buffer = data[size:]
+        return data[:size]
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+def _batches(rows, size=BATCH_SIZE):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def load_rows(engine, table, columns, rows):
+    """Bulk load rows (tuples in column order) into a table; returns row count"""
+    counted = _Counter(rows)
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if engine.dialect.name == 'postgresql':
+            cursor.copy_expert('COPY %s (%s) FROM STDIN' % (table, ', '.join(columns)),
+                               _CopyStream(counted))
+        else:
+            sql = 'INSERT INTO %s (%s) VALUES (%s)' % (
+                table, ', '.join(columns), ', '.join([_placeholder(engine)] * len(columns)))
+            for batch in _batches(counted):
+                cursor.executemany(sql, batch)
+        raw.commit()
+    finally:
+        raw.close()
+    return counted.count
+
+
+def _placeholder(engine):
+    return '?' if engine.dialect.paramstyle == 'qmark' else '%s'
+
+
+class _Counter:
+    """Wraps an iterator and counts how many items were consumed"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.count = 0
+
+    def __iter__(self):
+        for row in self._rows:
+            self.count += 1
+            yield row
+
+
+def _reset_sequences(engine, tables):
+    """Move Postgres id sequences past the explicit ids we loaded"""
+    if engine.dialect.name != 'postgresql':
+        return
+    from sqlalchemy import text
+    with engine.begin() as conn:
+        for table in tables:
+            conn.execute(text(
+                "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+                "COALESCE((SELECT MAX(id) FROM %s), 0) + 1, false)" % (table, table)))
+
+
+def generate(engine, halls=5, categories=5, meals=5000, users=10000, user_meals=1000000,
+             days=365, seed=42, password=DEFAULT_PASSWORD, log=print):
+    """
+    Load a synthetic dataset into empty tables
+    Returns {table name: rows per second}
+    """
+    import bcrypt
+
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    # Hash once and reuse it for every user instead of paying bcrypt per row
+    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    # Meals' nutrition, collected as they load, for the user_meals snapshots
+    nutrition = []
+
+    plan = [
+        ('dining_halls', ('id', 'name', 'location', 'description', 'hours', 'created_at'),
+         hall_rows(halls, now)),
+        ('meal_categories', ('id', 'name', 'description'),
+         category_rows(categories)),
+        ('meals', ('id', 'name', 'description', 'calories', 'protein', 'carbs', 'fat', 'sodium',
+                   'price', 'allergens', 'dietary_tags', 'available_start', 'available_end',
+                   'is_available', 'dining_hall_id', 'category_id', 'created_at', 'updated_at'),
+         _remember_nutrition(meal_rows(meals, halls, categories, rng, now), nutrition)),
+        ('users', ('id', 'email', 'password_hash', 'first_name', 'last_name', 'age', 'weight',
+                   'height', 'gender', 'activity_level', 'goal', 'daily_calorie_goal',
+                   'daily_protein_goal', 'daily_carb_goal', 'daily_fat_goal', 'goals_auto_calculated',
+                   'created_at', 'last_login'),
+         user_rows(users, password_hash, rng, now)),
+        ('user_meals', ('id', 'user_id', 'meal_id', 'serving_multiplier', 'consumed_at',
+                        'date_consumed', 'notes', 'created_at', 'updated_at',
+                        'calories', 'protein', 'carbs', 'fat', 'sodium'),
+         user_meal_rows(user_meals, users, meals, days, rng, now, nutrition)),
+    ]
+
+    rates = {}
+    for table, columns, rows in plan:
+        start = time.perf_counter()
+        count = load_rows(engine, table, columns, rows)
+        elapsed = time.perf_counter() - start
+        rates[table] = count / elapsed if elapsed else float(count)
+        log('%-16s %10d rows in %6.1fs (%d rows/min)' % (table, count, elapsed, rates[table] * 60))
+
+    _reset_sequences(engine, [table for table, _, _ in plan])
+    return rates
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generate synthetic TempleCals data for load tests')
+    parser.add_argument('--database-url', required=True,
+                        help='target database; all tables in it are dropped and recreated')
+    parser.add_argument('--halls', type=int, default=5)
+    parser.add_argument('--categories', type=int, default=5)
+    parser.add_argument('--meals', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--user-meals', type=int, default=1000000)
+    parser.add_argument('--days', type=int, default=365, help='how far back logged meals go')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from database import db
+    import popularity
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url, 'ENABLE_MIGRATIONS': False})
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        generate(db.engine, halls=args.halls, categories=args.categories, meals=args.meals,
+                 users=args.users, user_meals=args.user_meals, days=args.days, seed=args.seed)
+        popularity.rebuild(db.session)
+        db.session.commit()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Bulk recalculation of auto-calculated nutrition goals
+
+User.calculate_recommended_macros() works on one user at a time. When the
+formula constants in models.py change, every user whose goals came from it
+(goals_auto_calculated) needs new goals. This job reads users in keyset
+chunks of plain columns, runs the same formula over each chunk as NumPy
+arrays and writes only the goals that changed back with one bulk UPDATE per
+chunk, committing as it goes.
+
+    flask recalculate-goals --dry-run   # report what would change
+    flask recalculate-goals             # write it
+    flask recalculate-goals --all       # every user with a complete profile
+"""
+
+import time
+
+import numpy as np
+from sqlalchemy import bindparam, column, select, values
+
+from models import (ACTIVITY_MULTIPLIERS, DEFAULT_ACTIVITY_MULTIPLIER, DEFAULT_GENDER_OFFSET,
+                    DEFAULT_GOAL_PLAN, FAT_CALORIE_SHARE, GENDER_OFFSETS, GOAL_FIELDS, GOAL_PLANS, User)
+
+# Users read, calculated and written per round trip
+CHUNK_SIZE = 10000
+
+PROFILE_FIELDS = ('age', 'weight', 'height', 'gender', 'activity_level', 'goal')
+
+
+def _numbers(values):
+    # None and 0 both count as missing, like the truthiness checks in User
+    return np.array([value or 0 for value in values], dtype=float)
+
+
+def _lookup(values, table, default):
+    return np.array([table.get(value, default) for value in values], dtype=float)
+
+
+def _present(values):
+    return np.array([bool(value) for value in values])
+
+
+def compute_goals(age, weight, height, gender, activity_level, goal):
+    """
+    calculate_recommended_macros() over columns of user values (sequences of
+    equal length). Returns (mask of users it gives goals for, calories,
+    protein, carbs, fat) as arrays; values outside the mask are meaningless.
+    """
+    age, weight, height = _numbers(age), _numbers(weight), _numbers(height)
+
+    # calculate_bmr(): same operations in the same order, so results match exactly
+    bmr = (10 * (weight * 0.453592)) + (6.25 * (height * 2.54)) - (5 * age)
+    bmr += _lookup(gender, GENDER_OFFSETS, DEFAULT_GENDER_OFFSET)
+    bmr = np.round(bmr)
+    valid = (age != 0) & (weight != 0) & (height != 0) & _present(gender)
+
+    # calculate_tdee()
+    tdee = np.round(bmr * _lookup(activity_level, ACTIVITY_MULTIPLIERS, DEFAULT_ACTIVITY_MULTIPLIER))
+    valid &= (bmr != 0) & _present(activity_level) & (tdee != 0)
+
+    # calculate_recommended_macros()
+    valid &= _present(goal)
+    plans = [GOAL_PLANS.get(value, DEFAULT_GOAL_PLAN) for value in goal]
+    calorie_factor = np.array([np.nan if factor is None else factor for factor, _ in plans], dtype=float)
+    protein_per_lb = np.array([per_lb for _, per_lb in plans], dtype=float)
+    calories = np.where(np.isnan(calorie_factor), tdee, np.round(tdee * calorie_factor))
+    protein = np.round(weight * protein_per_lb)
+    fat = np.round((calories * FAT_CALORIE_SHARE) / 9)
+    carbs = np.round((calories - (protein * 4) - (fat * 9)) / 4)
+    return valid, calories, protein, carbs, fat
+
+
+def _current(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+def _changes(rows):
+    """
+    Ids of the users the formula gives goals for, and [(user id, profile
+    values, old goals, new goals)] for those whose goals differ
+    """
+    columns = list(zip(*rows))
+    ids, profile, old = columns[0], columns[1:7], columns[7:]
+    valid, *new = compute_goals(*profile)
+
+    # A missing (NULL) goal never equals a number, so it always counts as changed
+    same = np.ones(len(ids), dtype=bool)
+    for old_values, new_values in zip(old, new):
+        same &= _current(old_values) == new_values
+    changed = np.flatnonzero(valid & ~same)
+
+    changes = [(ids[i], tuple(values[i] for values in profile), tuple(values[i] for values in old),
+                (int(new[0][i]), float(new[1][i]), float(new[2][i]), float(new[3][i])))
+               for i in changed]
+    return [ids[i] for i in np.flatnonzero(valid)], changes
+
+
+def _write(session, changes):
+    """One UPDATE for the chunk. Rows whose profile changed since they were read are left alone."""
+    table = User.__table__
+
+    if session.get_bind().dialect.name == 'postgresql':
+        # UPDATE ... FROM (VALUES ...): the whole chunk in a single statement
+        source = values(*[column(name, table.c[field].type) for name, field in
+                          [('user_id', 'id')] + [(field, field) for field in PROFILE_FIELDS + GOAL_FIELDS]],
+                        name='new_goals') \
+            .data([(user_id,) + profile + new for user_id, profile, _, new in changes])
+        stmt = table.update().where(
+            table.c.id == source.c.user_id,
+            *[table.c[field] == source.c[field] for field in PROFILE_FIELDS]
+        ).values({field: source.c[field] for field in GOAL_FIELDS})
+        return session.execute(stmt).rowcount
+
+    # Elsewhere: the same UPDATE as an executemany
+    names = ('user_id',) + tuple('read_' + field for field in PROFILE_FIELDS) + \
+        tuple('new_' + field for field in GOAL_FIELDS)
+    stmt = table.update().where(
+        table.c.id == bindparam('user_id'),
+        *[table.c[field] == bindparam('read_' + field) for field in PROFILE_FIELDS]
+    ).values({field: bindparam('new_' + field) for field in GOAL_FIELDS})
+    params = [dict(zip(names, (user_id,) + profile + new)) for user_id, profile, _, new in changes]
+    return session.execute(stmt, params).rowcount
+
+
+def recalculate(session, dry_run=False, include_all=False, chunk_size=CHUNK_SIZE, on_change=None):
+    """
+    Recalculate goals for every auto-calculated user (or, with include_all,
+    every user, who is then marked auto-calculated). on_change(user id, old
+    goals, new goals) is called for each user whose goals differ. Returns a
+    summary dict.
+    """
+    table = User.__table__
+    query = select(table.c.id, *[table.c[field] for field in PROFILE_FIELDS + GOAL_FIELDS]) \
+        .order_by(table.c.id).limit(chunk_size)
+    if not include_all:
+        query = query.where(table.c.goals_auto_calculated.is_(True))
+
+    summary = {'users': 0, 'calculable': 0, 'changed': 0, 'updated': 0}
+    start = time.perf_counter()
+    last_id = 0
+    while True:
+        rows = session.execute(query.where(table.c.id > last_id)).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        summary['users'] += len(rows)
+
+        calculable, changes = _changes(rows)
+        summary['calculable'] += len(calculable)
+        summary['changed'] += len(changes)
+        if on_change is not None:
+            for user_id, _, old, new in changes:
+                on_change(user_id, dict(zip(GOAL_FIELDS, old)), dict(zip(GOAL_FIELDS, new)))
+
+        if dry_run:
+            continue
+        if changes:
+            summary['updated'] += _write(session, changes)
+        if include_all and calculable:
+            session.execute(table.update().where(table.c.id.in_(calculable))
+                            .values(goals_auto_calculated=True))
+        session.commit()
+
+    if dry_run:
+        session.rollback()
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
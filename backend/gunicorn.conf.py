@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for production
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5001')
+workers = int(os.getenv('WEB_CONCURRENCY', '4'))
+threads = int(os.getenv('THREADS', '1'))
+
+# Import and build the app once in the master, then fork the workers
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Runs in each worker before it starts accepting connections"""
+    import wsgi
+    from app import warm_up
+    from database import db
+
+    # Connections opened in the master must not be shared between processes
+    with wsgi.app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
+    if wsgi.app.config['WARMUP']:
+        seconds = warm_up(wsgi.app)
+        server.log.info('Worker %s warmed up in %.0f ms (app startup %.0f ms)',
+                        worker.pid, seconds * 1000, wsgi.startup_seconds * 1000)
@@ -0,0 +1,333 @@
+"""
+Concurrent HTTP load test for a running TempleCals server
+
+Opens many keep-alive connections at once with asyncio (no extra
+dependencies), replays the given URLs for a fixed duration and reports
+throughput and latency percentiles. With --server it also starts the server
+command itself and samples the resident memory of the whole process tree, so
+WSGI and ASGI deployments can be compared at equal memory.
+
+Usage:
+    python3 load_test.py --url http://127.0.0.1:5001/api/meals --concurrency 200 \\
+        --server "uvicorn asgi:app --port 5001 --workers 2"
+    python3 load_test.py --url http://127.0.0.1:5001/api/meals --concurrency 200 \\
+        --server "gunicorn -w 2 --threads 8 -b 127.0.0.1:5001 app:app"
+    python3 load_test.py --cold-start --url http://127.0.0.1:5001/api/meals \\
+        --server "gunicorn -c gunicorn.conf.py -b 127.0.0.1:5001 wsgi:app"
+    python3 load_test.py --url http://127.0.0.1:5001/api/meals --sweep 10,50,100,200,400 \\
+        --server "gunicorn -c gunicorn.conf.py --threads 16 -b 127.0.0.1:5001 wsgi:app"
+
+--sweep runs one level after another against the same server, to see what
+happens past saturation: served_p99_ms covers the requests that got an
+answer, shed those turned away with 503 by admission control. Add
+--honor-retry-after to have clients back off as the header asks.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from benchmark import percentile
+
+
+def parse_header(value):
+    name, _, content = value.partition(':')
+    return name.strip(), content.strip()
+
+
+async def _read_response(reader):
+    """Read one HTTP/1.1 response; returns (status, headers, body)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, value = parse_header(line.decode('latin-1'))
+        headers[name.lower()] = value
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+    return status, headers, body
+
+
+class Worker:
+    """One client connection replaying requests until the deadline"""
+
+    def __init__(self, requests, deadline, results, honor_retry_after=False):
+        self.requests = requests
+        self.deadline = deadline
+        self.results = results
+        self.honor_retry_after = honor_retry_after
+        self.reader = self.writer = None
+
+    async def _connect(self, host, port):
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+
+    def _close(self):
+        if self.writer:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def run(self, offset):
+        index = offset
+        while time.perf_counter() < self.deadline:
+            host, port, payload = self.requests[index % len(self.requests)]
+            index += 1
+            start = time.perf_counter()
+            try:
+                if self.writer is None:
+                    await self._connect(host, port)
+                self.writer.write(payload)
+                await self.writer.drain()
+                status, headers, _ = await _read_response(self.reader)
+                if headers.get('connection', '').lower() == 'close':
+                    self._close()
+            except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError, IndexError):
+                self._close()
+                status = headers = None
+            self.results.append((time.perf_counter() - start, status))
+            # Back off like a well-behaved client instead of retrying at once
+            if self.honor_retry_after and status in (429, 503) and headers.get('retry-after', '').isdigit():
+                await asyncio.sleep(max(0.0, min(int(headers['retry-after']), self.deadline - time.perf_counter())))
+        self._close()
+
+
+def build_requests(urls, method, headers, body):
+    requests = []
+    for url in urls:
+        parts = urlsplit(url)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+        lines = ['%s %s HTTP/1.1' % (method, path), 'Host: %s' % parts.netloc]
+        lines += ['%s: %s' % header for header in headers]
+        payload = body.encode('utf-8') if body else b''
+        if payload:
+            lines.append('Content-Type: application/json')
+        if payload or method in ('POST', 'PUT'):
+            lines.append('Content-Length: %d' % len(payload))
+        raw = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload
+        requests.append((parts.hostname, parts.port or 80, raw))
+    return requests
+
+
+async def run_load(requests, concurrency, duration, honor_retry_after=False):
+    results = []
+    deadline = time.perf_counter() + duration
+    workers = [Worker(requests, deadline, results, honor_retry_after) for _ in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(worker.run(i) for i, worker in enumerate(workers)))
+    return results, time.perf_counter() - start
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency * 1000 for latency, status in results if status is not None)
+    # Shed requests (503) return at once, so they would flatter the percentiles above
+    served = sorted(latency * 1000 for latency, status in results if status is not None and status != 503)
+    shed = sorted(latency * 1000 for latency, status in results if status == 503)
+    errors = sum(1 for _, status in results if status is None or status >= 500)
+    statuses = {}
+    for _, status in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'statuses': statuses,
+        'requests_per_second': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'served_per_second': round(len(served) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'served_p99_ms': round(percentile(served, 99), 2),
+        'shed': len(shed),
+        'shed_p99_ms': round(percentile(shed, 99), 2),
+    }
+
+
+# Server process handling (Linux /proc only)
+
+def _process_tree(root_pid):
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def tree_rss_mb(root_pid):
+    """Resident memory of a process and all of its descendants, in MB"""
+    total_kb = 0
+    for pid in _process_tree(root_pid):
+        try:
+            with open('/proc/%d/status' % pid) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024.0
+
+
+def wait_until_ready(process, host, port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline and process.poll() is None:
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def measure_cold_start(command, url, timeout=60):
+    """Seconds from launching the server until url first returns a 2xx response"""
+    import urllib.request
+    start = time.perf_counter()
+    process = subprocess.Popen(shlex.split(command))
+    try:
+        while time.perf_counter() - start < timeout and process.poll() is None:
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    if 200 <= response.status < 300:
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.05)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def _sample_memory(pid, samples, stop):
+    while not stop.is_set():
+        samples.append(tree_rss_mb(pid))
+        try:
+            await asyncio.wait_for(stop.wait(), 0.5)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def run_with_sampling(requests, concurrency, duration, server_pid, honor_retry_after=False):
+    samples = []
+    stop = asyncio.Event()
+    sampler = asyncio.ensure_future(_sample_memory(server_pid, samples, stop)) if server_pid else None
+    results, elapsed = await run_load(requests, concurrency, duration, honor_retry_after)
+    stop.set()
+    if sampler:
+        await sampler
+    return results, elapsed, samples
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent HTTP load test')
+    parser.add_argument('--url', action='append', required=True, help='URL to request (repeatable)')
+    parser.add_argument('--method', default='GET')
+    parser.add_argument('--header', action='append', default=[], help='"Name: value" (repeatable)')
+    parser.add_argument('--body', help='JSON request body')
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--sweep', help='comma-separated concurrency levels to run in turn (overrides --concurrency)')
+    parser.add_argument('--honor-retry-after', action='store_true',
+                        help='wait out Retry-After after a 429/503 before the next request')
+    parser.add_argument('--duration', type=float, default=15.0, help='seconds')
+    parser.add_argument('--server', help='server command to start and measure')
+    parser.add_argument('--cold-start', action='store_true',
+                        help='only measure time from starting --server to the first good response')
+    parser.add_argument('--label', help='name for this run in the report')
+    parser.add_argument('--output', help='append the JSON result to this file')
+    args = parser.parse_args(argv)
+
+    if args.cold_start:
+        if not args.server:
+            parser.error('--cold-start needs --server')
+        seconds = measure_cold_start(args.server, args.url[0])
+        report = {'label': args.label or args.server, 'url': args.url[0],
+                  'cold_start_ms': round(seconds * 1000, 1) if seconds is not None else None}
+        print(json.dumps(report, indent=2, sort_keys=True))
+        if args.output:
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(report, sort_keys=True) + '\n')
+        return 0 if seconds is not None else 1
+
+    requests = build_requests(args.url, args.method.upper(),
+                              [parse_header(h) for h in args.header], args.body)
+
+    server = None
+    if args.server:
+        server = subprocess.Popen(shlex.split(args.server))
+        host, port = requests[0][:2]
+        if not wait_until_ready(server, host, port):
+            server.kill()
+            print('Server did not start listening on %s:%d' % (host, port))
+            return 1
+
+    levels = [int(level) for level in args.sweep.split(',')] if args.sweep else [args.concurrency]
+    reports = []
+    try:
+        for concurrency in levels:
+            results, elapsed, memory = asyncio.run(run_with_sampling(
+                requests, concurrency, args.duration, server.pid if server else None, args.honor_retry_after))
+            report = summarize(results, elapsed)
+            report.update({
+                'label': args.label or args.server or args.url[0],
+                'concurrency': concurrency,
+                'duration_s': round(elapsed, 1),
+            })
+            if memory:
+                report['peak_rss_mb'] = round(max(memory), 1)
+                report['rps_per_100mb'] = round(report['requests_per_second'] / max(memory) * 100, 1)
+            reports.append(report)
+            if args.sweep:
+                print('concurrency %5d: %8.1f served/s  served p99 %8.1f ms  shed %6d  (shed p99 %.1f ms)' % (
+                    concurrency, report['served_per_second'], report['served_p99_ms'], report['shed'],
+                    report['shed_p99_ms']))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(reports if args.sweep else reports[0], indent=2, sort_keys=True))
+    if args.output:
+        with open(args.output, 'a') as f:
+            for report in reports:
+                f.write(json.dumps(report, sort_keys=True) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,302 @@
+"""
+Prometheus-style request metrics for the TempleCals API
+
+Tracks per-endpoint latency histograms, status counts, in-flight requests,
+SQL statements and DB time per request (via SQLAlchemy engine events) and
+connection pool statistics. Everything is exposed at GET /metrics in the
+Prometheus text format.
+
+Counters are sharded per thread: each worker thread only ever writes to its
+own shard, so the hot path never takes a lock. The shards are summed when
+/metrics is scraped. A thread's shard is folded into a retired total when
+the thread ends.
+"""
+
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from flask import Response, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import batch
+
+# Upper bounds (in seconds) for the latency and DB time histograms
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds for the "SQL statements per request" histogram
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+_registry_lock = threading.Lock()
+_shards = []
+_local = threading.local()
+
+
+class _Shard:
+    """Counters written by a single thread"""
+    __slots__ = ('counters', 'histograms', 'in_flight')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.in_flight = 0
+
+    def merge(self, other):
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, hist in list(other.histograms.items()):
+            total = self.histograms.get(key)
+            if total is None:
+                self.histograms[key] = list(hist)
+            else:
+                for i, value in enumerate(hist):
+                    total[i] += value
+
+
+class _Owner:
+    """Kept only in a thread's locals, so it is collected when the thread ends"""
+
+
+# Counts of threads that have ended (thread-per-request servers, the ASGI
+# thread pool), so the registry and scrape cost stay bounded
+_retired = _Shard()
+
+
+def _retire(shard):
+    with _registry_lock:
+        _retired.merge(shard)
+        _shards.remove(shard)
+
+
+def _shard():
+    """Return this thread's shard, registering it on first use"""
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _Shard()
+        with _registry_lock:
+            _shards.append(shard)
+        _local.shard = shard
+        _local.owner = _Owner()
+        weakref.finalize(_local.owner, _retire, shard)
+        return shard
+
+
+def inc(name, labels=(), amount=1):
+    """Increment a counter; labels is a tuple of (key, value) pairs"""
+    counters = _shard().counters
+    key = (name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, labels, value, buckets=LATENCY_BUCKETS):
+    """Record one observation in a histogram"""
+    histograms = _shard().histograms
+    key = (name, labels, buckets)
+    hist = histograms.get(key)
+    if hist is None:
+        # One slot per bucket plus +Inf, then sum and count
+        hist = histograms[key] = [0] * (len(buckets) + 3)
+    hist[bisect_left(buckets, value)] += 1
+    hist[-2] += value
+    hist[-1] += 1
+
+
+# SQL instrumentation - listens on every Engine, so it works before the
+# Flask-SQLAlchemy engine exists and for any engine created later. This is
+# the one place statements are timed; the profiler and the slow query log
+# get each statement's timing through on_statement().
+
+# callback(conn, statement, parameters, executemany, start, elapsed) run after each statement
+_statement_callbacks = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start_time'].pop()
+    elapsed = time.perf_counter() - start
+    stats = getattr(_local, 'request_sql', None)
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += elapsed
+    inc('templecals_db_statements_total')
+    inc('templecals_db_seconds_total', amount=elapsed)
+    for callback in _statement_callbacks:
+        callback(conn, statement, parameters, executemany, start, elapsed)
+
+
+def _listen_statements():
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def on_statement(callback):
+    """Call callback(conn, statement, parameters, executemany, start, elapsed) after every SQL statement"""
+    _listen_statements()
+    if callback not in _statement_callbacks:
+        _statement_callbacks.append(callback)
+
+
+def _start_request():
+    shard = _shard()
+    shard.in_flight += 1
+    _local.request_start = time.perf_counter()
+    # [statement count, DB seconds] for the current request
+    _local.request_sql = [0, 0.0]
+
+
+def _finish_request(response):
+    start = getattr(_local, 'request_start', None)
+    stats = getattr(_local, 'request_sql', None)
+    if start is None or stats is None:
+        return response
+
+    # Use the route pattern, not the raw path, to keep label cardinality low
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('endpoint', endpoint), ('method', request.method))
+
+    observe('templecals_http_request_duration_seconds', labels,
+            time.perf_counter() - start)
+    observe('templecals_http_request_db_statements', labels, stats[0],
+            QUERY_COUNT_BUCKETS)
+    observe('templecals_http_request_db_seconds', labels, stats[1])
+    inc('templecals_http_requests_total',
+        labels + (('status', str(response.status_code)),))
+    return response
+
+
+def _end_request(exc):
+    # Requests inside /api/batch are counted as part of the batch
+    if getattr(_local, 'request_sql', None) is None or batch.is_subrequest():
+        return
+    _local.request_start = None
+    _local.request_sql = None
+    _shard().in_flight -= 1
+
+
+# Exposition
+
+_HELP = {
+    'templecals_http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'templecals_http_request_db_statements': ('histogram', 'SQL statements executed per request'),
+    'templecals_http_request_db_seconds': ('histogram', 'Time spent in the database per request'),
+    'templecals_http_requests_total': ('counter', 'Responses by endpoint and status code'),
+    'templecals_db_statements_total': ('counter', 'SQL statements executed'),
+    'templecals_db_seconds_total': ('counter', 'Total time spent executing SQL'),
+    'templecals_ratelimit_rejected_total': ('counter', 'Requests rejected by a rate limit bucket'),
+    'templecals_admission_rejected_total': ('counter', 'Requests shed with 503 by admission control'),
+    'templecals_admission_wait_seconds': ('histogram', 'Time admitted requests waited for a slot'),
+    'templecals_admission_active': ('gauge', 'Requests holding an admission slot'),
+    'templecals_admission_waiting': ('gauge', 'Requests queued for an admission slot'),
+    'templecals_admission_concurrency': ('gauge', 'Admission slots per route class'),
+}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                     for k, v in labels)
+    return '{' + pairs + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def collect():
+    """Sum the retired counts and all thread shards into (counters, histograms, in_flight)"""
+    total = _Shard()
+    in_flight = 0
+    # Under the lock, so a shard retiring meanwhile is not counted twice
+    with _registry_lock:
+        total.merge(_retired)
+        for shard in _shards:
+            in_flight += shard.in_flight
+            total.merge(shard)
+    return total.counters, total.histograms, in_flight
+
+
+def _pool_stats(db):
+    """Connection pool gauges, when the pool type supports them"""
+    try:
+        pool = db.engine.pool
+    except Exception:
+        return {}
+    stats = {}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def register_gauges(app, source):
+    """Add a callable returning [(name, labels, value)] to the app's /metrics output"""
+    app.extensions.setdefault('metrics_gauges', []).append(source)
+
+
+def render(db=None, gauges=()):
+    """Render all metrics in the Prometheus text exposition format"""
+    counters, histograms, in_flight = collect()
+    lines = []
+    seen = set()
+
+    def header(name):
+        if name in seen:
+            return
+        seen.add(name)
+        metric_type, help_text = _HELP.get(name, ('untyped', name))
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name)
+        lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+    for (name, labels, buckets), hist in sorted(histograms.items()):
+        header(name)
+        cumulative = 0
+        for bound, count in zip(buckets + ('+Inf',), hist):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, _format_labels(labels + (('le', bound),)), cumulative))
+        lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(hist[-2])))
+        lines.append('%s_count%s %d' % (name, _format_labels(labels), hist[-1]))
+
+    lines.append('# HELP templecals_http_requests_in_flight Requests currently being served')
+    lines.append('# TYPE templecals_http_requests_in_flight gauge')
+    lines.append('templecals_http_requests_in_flight %d' % in_flight)
+
+    for source in gauges:
+        for name, labels, value in source():
+            header(name)
+            lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+
+    if db is not None:
+        for name, value in _pool_stats(db).items():
+            metric = 'templecals_db_pool_%s' % name
+            lines.append('# TYPE %s gauge' % metric)
+            lines.append('%s %d' % (metric, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, db):
+    """Register request hooks, SQL listeners and the /metrics endpoint"""
+    _listen_statements()
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        """Prometheus scrape endpoint"""
+        return Response(render(db, app.extensions.get('metrics_gauges', ())), mimetype='text/plain; version=0.0.4')
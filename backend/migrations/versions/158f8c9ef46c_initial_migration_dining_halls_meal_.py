@@ -7,7 +7,6 @@ Create Date: 2025-09-23 00:06:18.085549
 """
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy.dialects import postgresql
 
 # revision identifiers, used by Alembic.
 revision = '158f8c9ef46c'
@@ -23,7 +22,7 @@ def upgrade():
     sa.Column('name', sa.String(length=100), nullable=False),
     sa.Column('location', sa.String(length=200), nullable=True),
     sa.Column('description', sa.Text(), nullable=True),
-    sa.Column('hours', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.Column('hours', sa.JSON(), nullable=True),
     sa.Column('created_at', sa.DateTime(), nullable=True),
     sa.PrimaryKeyConstraint('id'),
     sa.UniqueConstraint('name')
@@ -45,8 +44,8 @@ def upgrade():
     sa.Column('fat', sa.Float(), nullable=True),
     sa.Column('sodium', sa.Float(), nullable=True),
     sa.Column('price', sa.Float(), nullable=True),
-    sa.Column('allergens', postgresql.JSON(astext_type=sa.Text()), nullable=True),
-    sa.Column('dietary_tags', postgresql.JSON(astext_type=sa.Text()), nullable=True),
+    sa.Column('allergens', sa.JSON(), nullable=True),
+    sa.Column('dietary_tags', sa.JSON(), nullable=True),
     sa.Column('available_start', sa.Time(), nullable=True),
     sa.Column('available_end', sa.Time(), nullable=True),
     sa.Column('is_available', sa.Boolean(), nullable=True),
@@ -0,0 +1,106 @@
+"""partition user_meals by month and add user_meal_archive
+
+Revision ID: 9a3e6f1c2d84
+Revises: 5c0e8b3a9d17
+Create Date: 2026-10-19 18:05:12.640218
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a3e6f1c2d84'
+down_revision = '5c0e8b3a9d17'
+branch_labels = None
+depends_on = None
+
+# Partitions created beyond the current month (partitions.ensure_partitions() keeps this up)
+MONTHS_AHEAD = 3
+
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _user_meals_constraints(table, primary_key):
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT user_meals_pkey PRIMARY KEY ({primary_key})')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT user_meals_user_id_fkey '
+               f'FOREIGN KEY (user_id) REFERENCES users (id)')
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT user_meals_meal_id_fkey '
+               f'FOREIGN KEY (meal_id) REFERENCES meals (id)')
+    op.execute(f'CREATE INDEX ix_user_meals_user_date ON {table} (user_id, date_consumed, consumed_at)')
+    op.execute(f'CREATE INDEX ix_user_meals_user_updated ON {table} (user_id, updated_at, id)')
+
+
+def _rename_old_table():
+    # Index and constraint names must be free for the new table
+    op.execute('ALTER TABLE user_meals RENAME TO user_meals_old')
+    op.execute('ALTER TABLE user_meals_old DROP CONSTRAINT user_meals_pkey')
+    op.execute('DROP INDEX ix_user_meals_user_date')
+    op.execute('DROP INDEX ix_user_meals_user_updated')
+
+
+def upgrade():
+    op.create_table('user_meal_archive',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('entry_count', sa.Integer(), nullable=False),
+    sa.Column('entries', sa.LargeBinary(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('user_id', 'month')
+    )
+
+    # date_consumed becomes the partition key, which cannot be NULL
+    bind = op.get_bind()
+    op.execute('UPDATE user_meals SET date_consumed = DATE(COALESCE(consumed_at, created_at, CURRENT_TIMESTAMP)) '
+               'WHERE date_consumed IS NULL')
+
+    if bind.dialect.name != 'postgresql':
+        with op.batch_alter_table('user_meals', schema=None) as batch_op:
+            batch_op.alter_column('date_consumed', existing_type=sa.Date(), nullable=False)
+        return
+
+    # Rebuild user_meals as a partitioned table: one partition per month from
+    # the oldest entry up to MONTHS_AHEAD from now, and a default partition
+    # for dates outside them. The primary key has to include the partition key.
+    _rename_old_table()
+    op.execute('ALTER TABLE user_meals_old ALTER COLUMN date_consumed SET NOT NULL')
+    op.execute('CREATE TABLE user_meals (LIKE user_meals_old INCLUDING DEFAULTS) PARTITION BY RANGE (date_consumed)')
+
+    today = datetime.utcnow().date()
+    oldest = bind.execute(sa.text('SELECT MIN(date_consumed) FROM user_meals_old')).scalar() or today
+    month, last = oldest.replace(day=1), _add_months(today.replace(day=1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(f"CREATE TABLE user_meals_p{month.year:04d}_{month.month:02d} PARTITION OF user_meals "
+                   f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')")
+        month = _add_months(month, 1)
+    op.execute('CREATE TABLE user_meals_default PARTITION OF user_meals DEFAULT')
+
+    # Copy before building indexes, which is much faster on a large table
+    op.execute('INSERT INTO user_meals SELECT * FROM user_meals_old')
+    _user_meals_constraints('user_meals', 'id, date_consumed')
+    op.execute('ALTER SEQUENCE user_meals_id_seq OWNED BY user_meals.id')
+    op.execute('DROP TABLE user_meals_old')
+    op.execute('ANALYZE user_meals')
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        # Archived months are not restored; run this only after they are no longer needed
+        _rename_old_table()
+        op.execute('CREATE TABLE user_meals (LIKE user_meals_old INCLUDING DEFAULTS)')
+        op.execute('INSERT INTO user_meals SELECT * FROM user_meals_old')
+        _user_meals_constraints('user_meals', 'id')
+        op.execute('ALTER SEQUENCE user_meals_id_seq OWNED BY user_meals.id')
+        op.execute('DROP TABLE user_meals_old')
+
+    with op.batch_alter_table('user_meals', schema=None) as batch_op:
+        batch_op.alter_column('date_consumed', existing_type=sa.Date(), nullable=True)
+
+    op.drop_table('user_meal_archive')
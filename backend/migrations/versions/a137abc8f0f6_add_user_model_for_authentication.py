@@ -27,8 +27,9 @@ def upgrade():
     sa.Column('last_name', sa.String(length=50), nullable=True),
     sa.Column('created_at', sa.DateTime(), nullable=True),
     sa.PrimaryKeyConstraint('id'),
-    sa.UniqueConstraint('email'),
-    sa.UniqueConstraint('username')
+    # Named as Postgres names them, so later migrations can drop them on SQLite too
+    sa.UniqueConstraint('email', name='users_email_key'),
+    sa.UniqueConstraint('username', name='users_username_key')
     )
     # ### end Alembic commands ###
 
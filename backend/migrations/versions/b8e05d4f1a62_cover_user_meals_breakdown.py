@@ -0,0 +1,36 @@
+"""cover user_meals breakdown sums in ix_user_meals_user_date
+
+Revision ID: b8e05d4f1a62
+Revises: f3c86a0d5e21
+Create Date: 2026-10-19 23:05:12.640118
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b8e05d4f1a62'
+down_revision = 'f3c86a0d5e21'
+branch_labels = None
+depends_on = None
+
+COLUMNS = 'user_id, date_consumed, consumed_at'
+INCLUDE = 'meal_id, serving_multiplier, calories, protein, carbs, fat, deleted_at'
+
+
+def upgrade():
+    # INCLUDE columns are Postgres only; elsewhere the index stays as it is
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Build the new index before dropping the old one, so lookups always have one
+    op.execute(f'CREATE INDEX ix_user_meals_user_date_new ON user_meals ({COLUMNS}) INCLUDE ({INCLUDE})')
+    op.execute('DROP INDEX ix_user_meals_user_date')
+    op.execute('ALTER INDEX ix_user_meals_user_date_new RENAME TO ix_user_meals_user_date')
+    op.execute('ANALYZE user_meals')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('DROP INDEX ix_user_meals_user_date')
+    op.execute(f'CREATE INDEX ix_user_meals_user_date ON user_meals ({COLUMNS})')
@@ -1,8 +1,40 @@
 from database import db
 from datetime import datetime
-from sqlalchemy.dialects.postgresql import JSON
+from sqlalchemy import JSON
 import bcrypt
 
+# Goal formula constants, shared by the User methods and the bulk job in goals.py
+
+# Mifflin-St Jeor gender term; anything else uses the average of the two
+GENDER_OFFSETS = {'male': 5, 'female': -161}
+DEFAULT_GENDER_OFFSET = -78
+
+ACTIVITY_MULTIPLIERS = {
+    'sedentary': 1.2,      # Little or no exercise
+    'light': 1.375,        # Light exercise 1-3 days/week
+    'moderate': 1.55,      # Moderate exercise 3-5 days/week
+    'active': 1.725,       # Heavy exercise 6-7 days/week
+    'very_active': 1.9     # Very heavy exercise, physical job
+}
+DEFAULT_ACTIVITY_MULTIPLIER = 1.2
+
+# goal -> (calorie factor applied to TDEE, protein grams per lb); None keeps TDEE as is
+GOAL_PLANS = {
+    'cutting': (0.8, 1.2),      # 20% deficit, higher protein to preserve muscle
+    'bulking': (1.1, 1.0),      # 10% surplus
+    'maintaining': (None, 1.0),
+}
+DEFAULT_GOAL_PLAN = (None, 0.8)  # tracking
+
+# Share of calories from fat (25-30%)
+FAT_CALORIE_SHARE = 0.275
+
+# Nutrition columns copied from meals onto each user_meals row when it is logged
+NUTRITION_FIELDS = ('calories', 'protein', 'carbs', 'fat', 'sodium')
+
+# User columns set from calculate_recommended_macros()
+GOAL_FIELDS = ('daily_calorie_goal', 'daily_protein_goal', 'daily_carb_goal', 'daily_fat_goal')
+
 class DiningHall(db.Model):
     """
     Represents a dining location at Temple University
@@ -125,6 +157,9 @@ class User(db.Model):
     daily_protein_goal = db.Column(db.Float, default=150.0)  # grams
     daily_carb_goal = db.Column(db.Float, default=250.0)     # grams
     daily_fat_goal = db.Column(db.Float, default=65.0)       # grams
+    # True while the goals above come from calculate_recommended_macros(), so
+    # `flask recalculate-goals` may overwrite them when the formula changes
+    goals_auto_calculated = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -157,12 +192,7 @@ class User(db.Model):
         bmr = (10 * weight_kg) + (6.25 * height_cm) - (5 * self.age)
         
         # Add gender factor
-        if self.gender == 'male':
-            bmr += 5
-        elif self.gender == 'female':
-            bmr -= 161
-        else:
-            bmr -= 78  # Average of male and female
+        bmr += GENDER_OFFSETS.get(self.gender, DEFAULT_GENDER_OFFSET)
             
         return round(bmr)
     
@@ -175,15 +205,7 @@ class User(db.Model):
         if not bmr or not self.activity_level:
             return None
         
-        activity_multipliers = {
-            'sedentary': 1.2,      # Little or no exercise
-            'light': 1.375,        # Light exercise 1-3 days/week
-            'moderate': 1.55,      # Moderate exercise 3-5 days/week
-            'active': 1.725,       # Heavy exercise 6-7 days/week
-            'very_active': 1.9     # Very heavy exercise, physical job
-        }
-        
-        multiplier = activity_multipliers.get(self.activity_level, 1.2)
+        multiplier = ACTIVITY_MULTIPLIERS.get(self.activity_level, DEFAULT_ACTIVITY_MULTIPLIER)
         return round(bmr * multiplier)
     
     def calculate_recommended_macros(self):
@@ -196,24 +218,14 @@ class User(db.Model):
             return None
         
         # Adjust calories based on goal
-        if self.goal == 'cutting':
-            calories = round(tdee * 0.8)  # 20% deficit
-            protein_per_lb = 1.2  # Higher protein to preserve muscle
-        elif self.goal == 'bulking':
-            calories = round(tdee * 1.1)  # 10% surplus
-            protein_per_lb = 1.0
-        elif self.goal == 'maintaining':
-            calories = tdee
-            protein_per_lb = 1.0
-        else:  # tracking
-            calories = tdee
-            protein_per_lb = 0.8
+        calorie_factor, protein_per_lb = GOAL_PLANS.get(self.goal, DEFAULT_GOAL_PLAN)
+        calories = tdee if calorie_factor is None else round(tdee * calorie_factor)
         
         # Calculate protein (in grams)
         protein = round(self.weight * protein_per_lb)
         
         # Calculate fat (25-30% of calories)
-        fat_calories = calories * 0.275
+        fat_calories = calories * FAT_CALORIE_SHARE
         fat = round(fat_calories / 9)  # 9 calories per gram of fat
         
         # Remaining calories go to carbs
@@ -244,6 +256,7 @@ class User(db.Model):
             'daily_protein_goal': self.daily_protein_goal,
             'daily_carb_goal': self.daily_carb_goal,
             'daily_fat_goal': self.daily_fat_goal,
+            'goals_auto_calculated': self.goals_auto_calculated,
             'created_at': self.created_at.isoformat(),
             'last_login': self.last_login.isoformat() if self.last_login else None
         }
@@ -251,8 +264,21 @@ class User(db.Model):
 class UserMeal(db.Model):
     """
     Tracks meals logged by users
+    On Postgres the table is range-partitioned by month on date_consumed, with
+    primary key (id, date_consumed); months older than the retention window
+    move to UserMealArchive (see partitions.py)
     """
     __tablename__ = 'user_meals'
+    __table_args__ = (
+        # Serves the per-user daily/range lookups and their ordering. On Postgres it
+        # also carries what /api/user-meals/breakdown sums, so a year of entries is
+        # aggregated from the index alone
+        db.Index('ix_user_meals_user_date', 'user_id', 'date_consumed', 'consumed_at',
+                 postgresql_include=['meal_id', 'serving_multiplier', 'calories', 'protein', 'carbs', 'fat',
+                                     'deleted_at']),
+        # Serves /api/user-meals/changes, which walks a user's rows in (updated_at, id) order
+        db.Index('ix_user_meals_user_updated', 'user_id', 'updated_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -263,15 +289,27 @@ class UserMeal(db.Model):
     
     # Date and time the meal was consumed
     consumed_at = db.Column(db.DateTime, default=datetime.utcnow)
-    date_consumed = db.Column(db.Date, default=datetime.utcnow)  # For easy daily queries
+    date_consumed = db.Column(db.Date, nullable=False, default=datetime.utcnow)  # For easy daily queries; the partition key
     
     # Optional notes
     notes = db.Column(db.Text)
     
+    # The meal's nutrition per serving when it was logged. Totals use these,
+    # so a later menu change does not rewrite past days
+    calories = db.Column(db.Integer)
+    protein = db.Column(db.Float)  # grams
+    carbs = db.Column(db.Float)    # grams
+    fat = db.Column(db.Float)      # grams
+    sodium = db.Column(db.Float)   # mg
+    
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Deleting an entry sets this instead of removing the row, so delta sync
+    # can tell clients about the delete; such rows are hidden everywhere else
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    
     # Relationships
     user = db.relationship('User', backref=db.backref('meals', lazy=True))
     meal = db.relationship('Meal', backref=db.backref('user_logs', lazy=True))
@@ -281,21 +319,140 @@ class UserMeal(db.Model):
     
     def to_dict(self):
         """Convert user meal to dictionary for API responses"""
-        meal_data = self.meal.to_dict() if self.meal else {}
-        
-        return {
-            'id': self.id,
-            'user_id': self.user_id,
-            'meal_id': self.meal_id,
-            'serving_multiplier': self.serving_multiplier,
-            'consumed_at': self.consumed_at.isoformat(),
-            'date_consumed': self.date_consumed.isoformat(),
-            'notes': self.notes,
-            'created_at': self.created_at.isoformat(),
-            'meal': meal_data,
-            # Calculated nutrition based on serving multiplier
-            'total_calories': int(self.meal.calories * self.serving_multiplier) if self.meal and self.meal.calories else 0,
-            'total_protein': round(self.meal.protein * self.serving_multiplier, 1) if self.meal and self.meal.protein else 0,
-            'total_carbs': round(self.meal.carbs * self.serving_multiplier, 1) if self.meal and self.meal.carbs else 0,
-            'total_fat': round(self.meal.fat * self.serving_multiplier, 1) if self.meal and self.meal.fat else 0
-        }
+        return user_meal_dict(self, self.meal.to_dict() if self.meal else {})
+
+def user_meal_dict(entry, meal_data):
+    """
+    UserMeal API dict from anything with the user_meals columns as attributes
+    (a UserMeal, or a row from INSERT/UPDATE ... RETURNING) plus the meal's dict
+    """
+    multiplier = entry.serving_multiplier
+    return {
+        'id': entry.id,
+        'user_id': entry.user_id,
+        'meal_id': entry.meal_id,
+        'serving_multiplier': multiplier,
+        'consumed_at': entry.consumed_at.isoformat(),
+        'date_consumed': entry.date_consumed.isoformat(),
+        'notes': entry.notes,
+        'created_at': entry.created_at.isoformat(),
+        'meal': meal_data,
+        # Nutrition per serving as logged (meal_data has the meal's current values)
+        'calories': entry.calories,
+        'protein': entry.protein,
+        'carbs': entry.carbs,
+        'fat': entry.fat,
+        'sodium': entry.sodium,
+        # Calculated nutrition based on serving multiplier
+        **serving_totals(entry.calories, entry.protein, entry.carbs, entry.fat, multiplier)
+    }
+
+def serving_totals(calories, protein, carbs, fat, multiplier):
+    """The total_* fields of a logged meal's API dict"""
+    return {
+        'total_calories': int(calories * multiplier) if calories else 0,
+        'total_protein': round(protein * multiplier, 1) if protein else 0,
+        'total_carbs': round(carbs * multiplier, 1) if carbs else 0,
+        'total_fat': round(fat * multiplier, 1) if fat else 0
+    }
+
+def nutrition_totals(portions):
+    """Summed nutrition from (calories, protein, carbs, fat, serving multiplier) per logged meal"""
+    total_calories = total_protein = total_carbs = total_fat = 0
+    for calories, protein, carbs, fat, multiplier in portions:
+        total_calories += calories * multiplier if calories else 0
+        total_protein += protein * multiplier if protein else 0
+        total_carbs += carbs * multiplier if carbs else 0
+        total_fat += fat * multiplier if fat else 0
+    
+    return {
+        'calories': int(total_calories),
+        'protein': round(total_protein, 1),
+        'carbs': round(total_carbs, 1),
+        'fat': round(total_fat, 1)
+    }
+
+class MealPopularity(db.Model):
+    """
+    How many times each meal was logged, per day and hour
+    Updated alongside every log/update/delete (see popularity.py)
+    """
+    __tablename__ = 'meal_popularity'
+    __table_args__ = (
+        db.Index('ix_meal_popularity_hall_day', 'dining_hall_id', 'day'),
+        db.Index('ix_meal_popularity_day', 'day'),
+    )
+    
+    meal_id = db.Column(db.Integer, db.ForeignKey('meals.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    hour = db.Column(db.SmallInteger, primary_key=True)  # 0-23, from consumed_at
+    dining_hall_id = db.Column(db.Integer, db.ForeignKey('dining_halls.id'), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<MealPopularity meal_id={self.meal_id} day={self.day} hour={self.hour} count={self.count}>'
+
+class UserMealArchive(db.Model):
+    """
+    Logged meals from months archived out of user_meals (see partitions.py)
+    One row per user and month; entries holds that month's entries as
+    zlib-compressed JSON
+    """
+    __tablename__ = 'user_meal_archive'
+    
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    entry_count = db.Column(db.Integer, nullable=False)
+    entries = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserMealArchive user_id={self.user_id} month={self.month} entries={self.entry_count}>'
+
+class WeightEntry(db.Model):
+    """
+    One weigh-in. users.weight holds the value of the most recent one
+    """
+    __tablename__ = 'weight_entries'
+    __table_args__ = (
+        # Serves the per-user range reads behind /api/weight
+        db.Index('ix_weight_entries_user_measured', 'user_id', 'measured_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    weight = db.Column(db.Float, nullable=False)  # in lbs
+    measured_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<WeightEntry user_id={self.user_id} weight={self.weight} measured_at={self.measured_at}>'
+    
+    def to_dict(self):
+        return weight_entry_dict(self)
+
+def weight_entry_dict(entry):
+    """API dict from a WeightEntry or a row with its columns"""
+    return {
+        'id': entry.id,
+        'weight': entry.weight,
+        'measured_at': entry.measured_at.isoformat(),
+        'date': entry.measured_at.date().isoformat(),
+        'notes': entry.notes
+    }
+
+class UserDirectory(db.Model):
+    """
+    Every user's id and email, kept in the main database when user data is
+    sharded (see shards.py). Hands out user ids and finds a user's id, and
+    so their shard, from the email they log in with
+    """
+    __tablename__ = 'user_directory'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<UserDirectory {self.id} {self.email}>'
@@ -0,0 +1,402 @@
+"""
+Monthly partitions of user_meals and archival of cold history
+
+On Postgres, user_meals is range-partitioned by month on date_consumed
+(user_meals_p2026_10 holds October 2026), with a user_meals_default
+partition catching any date that has no partition yet, so a write never
+fails for want of one. Most reads touch the last few weeks and only scan
+the recent partitions; vacuum, index maintenance and backups work a month
+at a time.
+
+- ensure_partitions() creates the partitions for this month and the next
+  PARTITION_MONTHS_AHEAD, moving any rows the default partition already
+  holds for them. Workers run it during warm-up; a daily cron of
+  `flask ensure-partitions` covers deployments that do not warm up.
+- archive() moves months older than ARCHIVE_AFTER_MONTHS into
+  user_meal_archive: one row per user and month, holding that month's
+  entries as zlib-compressed JSON. The month's partition is then detached
+  and dropped, all in one transaction per month.
+
+History and export read the archive alongside user_meals, so archived
+entries still show up there; they can no longer be edited or deleted, and
+daily/range views cover live months only.
+"""
+
+import heapq
+import json
+import re
+import time
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import func, select, text
+
+from models import UserMeal, UserMealArchive, serving_totals
+from reads import USER_MEAL_COLUMNS
+
+user_meals = UserMeal.__table__
+archive_table = UserMealArchive.__table__
+
+DEFAULT_PARTITION = 'user_meals_default'
+PARTITION_NAME = re.compile(r'^user_meals_p(\d{4})_(\d{2})$')
+
+# Serializes partition maintenance between workers and cron
+LOCK_KEY = 'user_meals_partitions'
+
+# Users whose archive rows are inserted per statement
+ARCHIVE_BATCH_SIZE = 500
+
+# Entry fields kept in the archive, as in serialize_user_meal() without 'meal' and the totals
+ARCHIVE_FIELDS = [key for key, _, _ in USER_MEAL_COLUMNS]
+
+# How long a worker trusts what it last saw of the archive (see archived_until)
+ARCHIVE_STATE_SECONDS = 60
+
+# Database URL -> (time checked, or None for good, archived_until() answer)
+_archive_state = {}
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return 'user_meals_p%04d_%02d' % (month.year, month.month)
+
+
+def current_month():
+    return month_start(datetime.utcnow().date())
+
+
+def is_partitioned(session):
+    """Whether user_meals is a partitioned Postgres table (False on other databases)"""
+    if session.get_bind().dialect.name != 'postgresql':
+        return False
+    # ::text, as asyncpg returns the "char" type as bytes
+    kind = session.execute(text(
+        "SELECT relkind::text FROM pg_class WHERE oid = to_regclass('user_meals')"
+    )).scalar()
+    return kind == 'p'
+
+
+def partition_months(session):
+    """{first day of month: partition name} for user_meals' monthly partitions"""
+    names = session.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'user_meals'::regclass"
+    )).scalars()
+    months = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            months[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return months
+
+
+def _lock(session):
+    session.execute(text('SELECT pg_advisory_xact_lock(hashtext(:key))'), {'key': LOCK_KEY})
+
+
+def ensure_partitions(session, months_ahead=3):
+    """
+    Create the partitions for the current month and months_ahead more that
+    do not exist yet. Rows for those months sitting in the default partition
+    are moved into the new partition before it is attached. Returns the
+    names created; the caller commits.
+    """
+    if not is_partitioned(session):
+        return []
+    _lock(session)
+    existing = partition_months(session)
+    created = []
+    first = current_month()
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        if month in existing:
+            continue
+        name = partition_name(month)
+        bounds = {'start': month, 'end': add_months(month, 1)}
+        # Build the table standalone and ATTACH it: unlike CREATE ... PARTITION OF,
+        # this works when the default partition already has rows in its range,
+        # and it does not block writes to the other partitions
+        session.execute(text(f'CREATE TABLE {name} (LIKE user_meals INCLUDING DEFAULTS)'))
+        session.execute(text(
+            f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+            f'WHERE date_consumed >= :start AND date_consumed < :end RETURNING *) '
+            f'INSERT INTO {name} SELECT * FROM moved'
+        ), bounds)
+        session.execute(text(
+            f"ALTER TABLE user_meals ATTACH PARTITION {name} "
+            f"FOR VALUES FROM ('{bounds['start'].isoformat()}') TO ('{bounds['end'].isoformat()}')"
+        ))
+        created.append(name)
+    return created
+
+
+def pack(rows):
+    """Compress [entry dict] for the archive"""
+    payload = {'fields': ARCHIVE_FIELDS, 'rows': [[row[field] for field in ARCHIVE_FIELDS] for row in rows]}
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode(), 9)
+
+
+def unpack(blob):
+    """[entry dict] from pack(), oldest first; fields added since it was packed are None"""
+    payload = json.loads(zlib.decompress(blob))
+    rows = [dict(zip(payload['fields'], values)) for values in payload['rows']]
+    missing = [field for field in ARCHIVE_FIELDS if field not in payload['fields']]
+    for row in rows:
+        for field in missing:
+            row[field] = None
+    return rows
+
+
+def _archive_key(entry):
+    return (entry['date_consumed'], entry['consumed_at'] or '', entry['id'])
+
+
+def _entry_dicts(rows):
+    convert = [converter for _, _, converter in USER_MEAL_COLUMNS]
+    return [{field: value if value is None or converter is None else converter(value)
+             for field, converter, value in zip(ARCHIVE_FIELDS, convert, row)} for row in rows]
+
+
+def _store(session, month, entries_by_user, existing):
+    """Write one archive row per user; users in existing already had one, which is merged"""
+    inserts = []
+    for user_id, entries in entries_by_user.items():
+        if user_id in existing:
+            blob = session.execute(select(archive_table.c.entries).where(
+                archive_table.c.user_id == user_id, archive_table.c.month == month)).scalar()
+            merged = {entry['id']: entry for entry in unpack(blob)}
+            merged.update((entry['id'], entry) for entry in entries)
+            entries = sorted(merged.values(), key=_archive_key)
+            session.execute(archive_table.update().where(
+                archive_table.c.user_id == user_id, archive_table.c.month == month
+            ).values(entries=pack(entries), entry_count=len(entries), archived_at=datetime.utcnow()))
+        else:
+            inserts.append({'user_id': user_id, 'month': month, 'entry_count': len(entries),
+                            'entries': pack(entries), 'archived_at': datetime.utcnow()})
+        if len(inserts) >= ARCHIVE_BATCH_SIZE:
+            session.execute(archive_table.insert(), inserts)
+            inserts = []
+    if inserts:
+        session.execute(archive_table.insert(), inserts)
+
+
+def archive_month(session, month, partition=None):
+    """
+    Move one month of user_meals into the archive: its live entries are
+    packed per user, then its partition (if any) is detached and dropped and
+    whatever the default partition held for the month is deleted. Deleted
+    entries are not kept. Returns (entries archived, users). The caller commits.
+    """
+    end = add_months(month, 1)
+    existing = set(session.execute(select(archive_table.c.user_id).where(archive_table.c.month == month)).scalars())
+    query = select(*[column for _, column, _ in USER_MEAL_COLUMNS]).where(
+        user_meals.c.date_consumed >= month, user_meals.c.date_consumed < end,
+        user_meals.c.deleted_at.is_(None)
+    ).order_by(user_meals.c.user_id, user_meals.c.date_consumed, user_meals.c.consumed_at, user_meals.c.id)
+
+    count = users = 0
+    batch = {}
+    for rows in session.execute(query.execution_options(yield_per=10000)).partitions():
+        for entry in _entry_dicts(rows):
+            batch.setdefault(entry['user_id'], []).append(entry)
+            count += 1
+        # Keep the last user open: their rows may continue in the next partition of the result
+        if len(batch) > ARCHIVE_BATCH_SIZE:
+            last_user = entry['user_id']
+            pending = batch.pop(last_user)
+            users += len(batch)
+            _store(session, month, batch, existing)
+            batch = {last_user: pending}
+    users += len(batch)
+    _store(session, month, batch, existing)
+
+    if partition is not None:
+        session.execute(text(f'ALTER TABLE user_meals DETACH PARTITION {partition}'))
+        session.execute(text(f'DROP TABLE {partition}'))
+    session.execute(user_meals.delete().where(user_meals.c.date_consumed >= month, user_meals.c.date_consumed < end))
+    return count, users
+
+
+def archive(session, after_months=12, dry_run=False):
+    """
+    Archive every month before the last after_months (never the current
+    month), one transaction per month. Returns [(month, entries, users)];
+    with dry_run only the months and their live entry counts are reported.
+    """
+    if not is_partitioned(session):
+        return None
+    cutoff = add_months(current_month(), -max(after_months, 0))
+    months = {month: name for month, name in partition_months(session).items() if month < cutoff}
+    # Backdated entries for months without a partition sit in the default partition
+    default_months = session.execute(text(
+        f"SELECT DISTINCT date_trunc('month', date_consumed)::date FROM {DEFAULT_PARTITION} "
+        f"WHERE date_consumed < :cutoff"
+    ), {'cutoff': cutoff}).scalars()
+    for month in default_months:
+        months.setdefault(month, None)
+
+    results = []
+    for month in sorted(months):
+        if dry_run:
+            count = session.execute(select(func.count()).select_from(user_meals).where(
+                user_meals.c.date_consumed >= month, user_meals.c.date_consumed < add_months(month, 1),
+                user_meals.c.deleted_at.is_(None))).scalar()
+            results.append((month, count, None))
+            continue
+        _lock(session)
+        # Re-read under the lock in case another run archived it meanwhile
+        partition = partition_months(session).get(month)
+        if partition is None and months[month] is not None:
+            session.rollback()
+            continue
+        count, users = archive_month(session, month, partition)
+        session.commit()
+        results.append((month, count, users))
+    if dry_run:
+        session.rollback()
+    return results
+
+
+def archived_until(session):
+    """
+    First day after the newest archived month, or None while nothing is
+    archived, so history reads only look in the archive when it can hold
+    something. Only a partitioned user_meals is ever archived, so anywhere
+    else (SQLite, unpartitioned Postgres) the answer is kept for good; on a
+    partitioned one it is re-read every ARCHIVE_STATE_SECONDS, and a month
+    `flask archive-meals` just moved (a year old, by default) can be missing
+    from history for that long.
+    """
+    bind = session.get_bind(clause=select(archive_table.c.month))
+    key = bind.url.render_as_string()
+    state = _archive_state.get(key)
+    now = time.monotonic()
+    if state is not None and (state[0] is None or now - state[0] < ARCHIVE_STATE_SECONDS):
+        return state[1]
+    if bind.dialect.name != 'postgresql' or not is_partitioned(session):
+        _archive_state[key] = (None, None)
+        return None
+    newest = session.execute(select(func.max(archive_table.c.month))).scalar()
+    until = add_months(newest, 1) if newest is not None else None
+    _archive_state[key] = (now, until)
+    return until
+
+
+def needs_archive(entries, limit, until, day=None):
+    """
+    Whether a history read of up to limit entries (newest first, optionally
+    for one day) has to look in the archive as well as user_meals; until is
+    archived_until()'s answer
+    """
+    if until is None:
+        return False
+    if day is not None:
+        return day < until
+    if len(entries) < limit:
+        return True
+    if not entries:
+        return False
+    # Archived entries are all older than until
+    return min(entry['date_consumed'] for entry in entries) < until.isoformat()
+
+
+def history_query(user_id, day=None, limit=None):
+    """
+    select() of the archive rows a history read needs, newest month first.
+    With a limit, months are cut off once the newer ones hold limit entries.
+    """
+    query = select(archive_table.c.month, archive_table.c.entry_count, archive_table.c.entries) \
+        .where(archive_table.c.user_id == user_id)
+    if day is not None:
+        return query.where(archive_table.c.month == month_start(day))
+    if limit is None:
+        return query.order_by(archive_table.c.month.desc())
+    newer = func.coalesce(func.sum(archive_table.c.entry_count).over(
+        order_by=archive_table.c.month.desc(), rows=(None, -1)), 0).label('newer')
+    months = query.add_columns(newer).subquery()
+    return select(months.c.month, months.c.entry_count, months.c.entries) \
+        .where(months.c.newer < limit).order_by(months.c.month.desc())
+
+
+def history_entries(rows, day=None, limit=None):
+    """Entries from history_query() rows, newest first, without their meals"""
+    entries = []
+    for row in rows:
+        month_entries = unpack(row.entries)
+        if day is not None:
+            month_entries = [entry for entry in month_entries if entry['date_consumed'] == day.isoformat()]
+        month_entries.sort(key=lambda entry: entry['consumed_at'] or '', reverse=True)
+        entries.extend(month_entries)
+    return entries[:limit] if limit is not None else entries
+
+
+def meal_ids(entries):
+    return {entry['meal_id'] for entry in entries}
+
+
+def with_meals(entries, meal_lookup):
+    """
+    Complete archived entries into serialize_user_meal() dicts; meal_lookup(meal_id)
+    returns the meal's dict (its current values, as for live entries) or None
+    """
+    for entry in entries:
+        entry['meal'] = meal_lookup(entry['meal_id']) or {}
+        entry.update(serving_totals(entry['calories'], entry['protein'], entry['carbs'], entry['fat'],
+                                    entry['serving_multiplier']))
+    return entries
+
+
+def merge_history(live, archived, limit):
+    """Newest limit entries of both, live winning if an entry shows up in both mid-archival"""
+    ids = {entry['id'] for entry in live}
+    entries = live + [entry for entry in archived if entry['id'] not in ids]
+    entries.sort(key=lambda entry: entry['consumed_at'] or '', reverse=True)
+    return entries[:limit]
+
+
+def read_history(session, user_id, live, limit, meal_lookup, day=None):
+    """History entries (newest first) merged from user_meals rows already read and the archive"""
+    if not needs_archive(live, limit, archived_until(session), day):
+        return live
+    archived = history_entries(session.execute(history_query(user_id, day, limit)), day, limit)
+    if not archived:
+        return live
+    return merge_history(live, with_meals(archived, meal_lookup), limit)
+
+
+def iter_archive(session, user_id, meal_lookup):
+    """Every archived entry of the user, oldest first, one month in memory at a time"""
+    months = session.execute(select(archive_table.c.month).where(archive_table.c.user_id == user_id)
+                             .order_by(archive_table.c.month)).scalars().all()
+    for month in months:
+        blob = session.execute(select(archive_table.c.entries).where(
+            archive_table.c.user_id == user_id, archive_table.c.month == month)).scalar()
+        if blob is not None:
+            yield from with_meals(unpack(blob), meal_lookup)
+
+
+def merge_export(archived, live):
+    """
+    Interleave two oldest-first entry streams by (date_consumed, consumed_at),
+    skipping live entries already seen in the archive
+    """
+    def keyed(entries, source):
+        for entry in entries:
+            yield (entry['date_consumed'], entry['consumed_at'] or '', source, entry['id']), entry
+
+    archived_ids = set()
+    # An entry in both streams sorts the same in each; the archived copy (source 0) comes first
+    for (_, _, source, entry_id), entry in heapq.merge(keyed(archived, 0), keyed(live, 1), key=lambda item: item[0]):
+        if source == 0:
+            archived_ids.add(entry_id)
+        elif entry_id in archived_ids:
+            continue
+        yield entry
@@ -0,0 +1,218 @@
+"""
+Meal popularity ("most logged at Johnson & Hardwick today")
+
+meal_popularity holds a log count per (meal, day, hour) with the meal's
+dining hall alongside. It is updated in the same transaction as every log,
+update and delete, so popularity never needs a COUNT over user_meals.
+
+On top of it, each worker keeps the per-meal counts for each (hall, window)
+it has been asked about. Top-K queries are answered from that memory; the
+counts are reloaded from meal_popularity after POPULARITY_CACHE_SECONDS
+(picking up other workers' writes) and this worker's own writes are applied
+to them immediately.
+"""
+
+import heapq
+import threading
+import time
+from datetime import datetime, time as dt_time, timedelta
+
+from sqlalchemy import Date, func, literal, select, union_all
+
+from database import db
+from models import MealPopularity, UserMeal, Meal
+import shards
+
+# Window name -> number of days, counting today
+WINDOWS = {'today': 1, 'week': 7, 'month': 30}
+DEFAULT_WINDOW = 'today'
+# Window used for the popularity score that /api/meals can sort by
+SCORE_WINDOW = 'month'
+
+
+def _upsert_insert(session):
+    """The dialect's INSERT with ON CONFLICT support, or None"""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def _add_counts(stmt):
+    """Existing rows get the inserted count added to theirs"""
+    return stmt.on_conflict_do_update(index_elements=['meal_id', 'day', 'hour'],
+                                      set_={'count': MealPopularity.__table__.c.count + stmt.excluded.count})
+
+
+def _key(meal_id, consumed_at):
+    return (meal_id, consumed_at.date(), consumed_at.hour)
+
+
+def record_many(session, changes):
+    """
+    Apply [(meal_id, hall_id, consumed_at, delta)] to the aggregate in one
+    statement. Call before committing, then pass the same changes to
+    PopularityCache.apply() once the commit succeeds.
+    """
+    # Net out changes to the same row (e.g. an entry moved within its hour);
+    # one upsert cannot touch a row twice
+    deltas, halls = {}, {}
+    for meal_id, hall_id, consumed_at, delta in changes:
+        key = _key(meal_id, consumed_at)
+        deltas[key] = deltas.get(key, 0) + delta
+        halls[key] = hall_id
+    rows = [{'meal_id': key[0], 'day': key[1], 'hour': key[2], 'dining_hall_id': halls[key], 'count': delta}
+            for key, delta in deltas.items() if delta]
+    if not rows:
+        return
+
+    table = MealPopularity.__table__
+    insert = _upsert_insert(session)
+    if insert is not None:
+        session.execute(_add_counts(insert(table).values(rows)))
+        return
+
+    # Other databases: update, and insert when there was no row yet
+    for row in rows:
+        result = session.execute(table.update().where(
+            table.c.meal_id == row['meal_id'], table.c.day == row['day'], table.c.hour == row['hour']
+        ).values(count=table.c.count + row['count']))
+        if result.rowcount == 0:
+            session.execute(table.insert().values(**row))
+
+
+def record(session, meal_id, hall_id, consumed_at, delta):
+    """Add delta (+1 for a log, -1 for a delete) to the aggregate row for this meal and hour"""
+    record_many(session, [(meal_id, hall_id, consumed_at, delta)])
+
+
+def record_move(session, entry_filter, consumed_at):
+    """
+    Move a logged meal's count to consumed_at's day and hour. The entry (matched
+    by entry_filter, a list of conditions on user_meals) is read inside the
+    same statement, so call this before the UPDATE changes it. Returns the
+    changes for PopularityCache.apply_many().
+    """
+    user_meals, meals = UserMeal.__table__, Meal.__table__
+    source = user_meals.join(meals, meals.c.id == user_meals.c.meal_id)
+    old = select(user_meals.c.meal_id, user_meals.c.date_consumed.label('day'),
+                 func.extract('hour', user_meals.c.consumed_at).label('hour'),
+                 meals.c.dining_hall_id, literal(-1).label('delta')).select_from(source).where(*entry_filter)
+    new = select(user_meals.c.meal_id, literal(consumed_at.date(), Date).label('day'),
+                 literal(consumed_at.hour).label('hour'),
+                 meals.c.dining_hall_id, literal(1).label('delta')).select_from(source).where(*entry_filter)
+    moves = union_all(old, new).subquery()
+    net = select(moves.c.meal_id, moves.c.day, moves.c.hour, moves.c.dining_hall_id, func.sum(moves.c.delta)) \
+        .group_by(moves.c.meal_id, moves.c.day, moves.c.hour, moves.c.dining_hall_id) \
+        .having(func.sum(moves.c.delta) != 0)
+
+    insert = _upsert_insert(session)
+    if insert is None:
+        rows = session.execute(net).all()
+        changes = [(meal_id, hall_id, datetime.combine(day, dt_time(int(hour))), delta)
+                   for meal_id, day, hour, hall_id, delta in rows]
+        record_many(session, changes)
+        return changes
+
+    table = MealPopularity.__table__
+    stmt = _add_counts(insert(table).from_select(['meal_id', 'day', 'hour', 'dining_hall_id', 'count'], net))
+    rows = session.execute(stmt.returning(table.c.meal_id, table.c.day, table.c.hour, table.c.dining_hall_id)).all()
+    # Only keys come back: the one at the new time gained a log, any other lost one
+    new_key = (consumed_at.date(), consumed_at.hour)
+    return [(meal_id, hall_id, datetime.combine(day, dt_time(hour)), 1 if (day, hour) == new_key else -1)
+            for meal_id, day, hour, hall_id in rows]
+
+
+def rebuild(session):
+    """Recompute meal_popularity from user_meals (after bulk loads or to repair drift)"""
+    table = MealPopularity.__table__
+    hour = func.extract('hour', UserMeal.consumed_at)
+    session.execute(table.delete())
+    session.execute(table.insert().from_select(
+        ['meal_id', 'day', 'hour', 'dining_hall_id', 'count'],
+        select(UserMeal.meal_id, UserMeal.date_consumed, hour, Meal.dining_hall_id, func.count())
+        .join(Meal, Meal.id == UserMeal.meal_id)
+        .where(UserMeal.deleted_at.is_(None))
+        .group_by(UserMeal.meal_id, UserMeal.date_consumed, hour, Meal.dining_hall_id)
+    ))
+
+
+class PopularityCache:
+    """Per-worker counts per (hall id or None, window), refreshed after ttl seconds"""
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        # (hall_id, window) -> (loaded at, first day, {meal_id: count})
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _load(self, hall_id, window, today):
+        first_day = today - timedelta(days=WINDOWS[window] - 1)
+        query = select(MealPopularity.meal_id, func.sum(MealPopularity.count)).where(
+            MealPopularity.day >= first_day
+        ).group_by(MealPopularity.meal_id)
+        if hall_id is not None:
+            query = query.where(MealPopularity.dining_hall_id == hall_id)
+        # With sharded user data each shard counts its own users' logs
+        counts = {}
+        for meal_id, count in shards.scatter(db.session, query):
+            counts[meal_id] = counts.get(meal_id, 0) + int(count)
+        return (time.monotonic(), first_day, counts)
+
+    def counts(self, hall_id=None, window=DEFAULT_WINDOW):
+        """{meal_id: count} for the window; loads or reloads from the aggregate when stale"""
+        today = datetime.utcnow().date()
+        key = (hall_id, window)
+        with self._lock:
+            entry = self._entries.get(key)
+        first_day = today - timedelta(days=WINDOWS[window] - 1)
+        if entry is None or entry[1] != first_day or time.monotonic() - entry[0] > self.ttl:
+            entry = self._load(hall_id, window, today)
+            with self._lock:
+                self._entries[key] = entry
+        return entry[2]
+
+    def top(self, hall_id=None, window=DEFAULT_WINDOW, k=10):
+        """[(meal_id, count)] for the k most logged meals, most popular first"""
+        counts = self.counts(hall_id, window)
+        with self._lock:
+            items = list(counts.items())
+        return heapq.nlargest(k, ((meal_id, count) for meal_id, count in items if count > 0),
+                              key=lambda item: item[1])
+
+    def scores(self):
+        """Popularity score per meal (logs over the score window, all halls)"""
+        return self.counts(None, SCORE_WINDOW)
+
+    def apply(self, meal_id, hall_id, consumed_at, delta):
+        """Fold one committed change into every cached window it falls into"""
+        self.apply_many([(meal_id, hall_id, consumed_at, delta)])
+
+    def apply_many(self, changes):
+        with self._lock:
+            for meal_id, hall_id, consumed_at, delta in changes:
+                day = consumed_at.date()
+                for (cached_hall, _), (_, first_day, counts) in self._entries.items():
+                    if cached_hall not in (None, hall_id) or day < first_day:
+                        continue
+                    counts[meal_id] = counts.get(meal_id, 0) + delta
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def init_popularity(app):
+    app.extensions['popularity'] = PopularityCache(app.config['POPULARITY_CACHE_SECONDS'])
+
+    @app.cli.command('rebuild-popularity')
+    def rebuild_popularity_command():
+        """Recompute meal_popularity from user_meals"""
+        for shard in shards.each_shard(db.session):
+            rebuild(db.session)
+            db.session.commit()
+            print(f'{shards.label(shard)}meal_popularity rebuilt')
@@ -0,0 +1,255 @@
+"""
+On-demand request profiling
+
+When one endpoint gets slow in production, a profile of a real request
+shows where the time goes. With PROFILE_TOKEN set, a request carrying
+`X-Profile-Token: <token>` is run under cProfile; with PROFILE_SAMPLE_RATE
+above 0, that fraction of all requests is too. Each profile records the
+request, its status and duration, the SQL statements it ran (offset,
+duration and text, as timed by metrics.py, without parameters) and
+the functions with the most cumulative time. It is written to PROFILE_DIR as
+<id>.json plus <id>.prof (raw pstats, for snakeviz or `python -m pstats`),
+and only the newest PROFILE_KEEP profiles are kept. The response carries
+X-Profile-Id.
+
+    GET /api/admin/profiles                   recent profiles, newest first
+    GET /api/admin/profiles/<id>              one profile with its SQL timeline
+    GET /api/admin/profiles/<id>/pstats       the raw pstats file
+
+The admin routes take the same X-Profile-Token header (the app has no admin
+users), so reading sampled profiles over HTTP needs PROFILE_TOKEN set too;
+without it they are only on disk. With neither setting configured nothing
+is registered, so requests pay nothing. A worker profiles
+one request at a time (cProfile is process-wide from Python 3.12); a request
+sampled while another is being profiled just runs. Streamed responses are
+profiled up to the view's return, not while the body is generated.
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app, g, jsonify, request, send_file
+
+from admission import route_class
+import batch
+import metrics
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+# Functions listed in a profile, by cumulative time
+TOP_FUNCTIONS = 40
+
+# Longest SQL text kept per statement
+MAX_STATEMENT_LENGTH = 1000
+
+PROFILE_ID = re.compile(r'^\d+-\d+$')
+
+# Reading profiles does not make new ones
+ADMIN_ENDPOINTS = ('list_profiles', 'get_profile', 'download_profile')
+
+_profiling = threading.Lock()
+_local = threading.local()
+
+
+def _statement(conn, statement, parameters, executemany, start, elapsed):
+    timeline = getattr(_local, 'sql', None)
+    if timeline is None:
+        return
+    timeline.append({
+        'offset_ms': round((start - _local.request_start) * 1000, 3),
+        'duration_ms': round(elapsed * 1000, 3),
+        'statement': statement[:MAX_STATEMENT_LENGTH],
+    })
+
+
+def token_matches():
+    """Whether the request carries PROFILE_TOKEN, which also guards the other /api/admin routes"""
+    token = current_app.config['PROFILE_TOKEN']
+    given = request.headers.get(TOKEN_HEADER)
+    return bool(token) and given is not None and hmac.compare_digest(given.encode(), token.encode())
+
+
+def _start():
+    if request.endpoint in ADMIN_ENDPOINTS:
+        return None
+    trigger = None
+    if token_matches():
+        trigger = 'header'
+    elif random.random() < current_app.config['PROFILE_SAMPLE_RATE']:
+        trigger = 'sample'
+    if trigger is None or not _profiling.acquire(blocking=False):
+        return None
+
+    profile = cProfile.Profile()
+    g.profile = (profile, trigger, datetime.utcnow())
+    _local.sql = []
+    _local.request_start = time.perf_counter()
+    profile.enable()
+    return None
+
+
+def _stop():
+    """Stop the current request's profiler; returns (profile, trigger, started, duration, sql) or None"""
+    running = g.pop('profile', None)
+    if running is None:
+        return None
+    profile, trigger, started = running
+    profile.disable()
+    duration = time.perf_counter() - _local.request_start
+    sql, _local.sql = _local.sql, None
+    _profiling.release()
+    return profile, trigger, started, duration, sql
+
+
+def _functions(profile):
+    stats = pstats.Stats(profile).stats
+    ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+    return [{
+        'function': '%s:%d(%s)' % key,
+        'calls': calls,
+        'total_ms': round(total * 1000, 3),
+        'cumulative_ms': round(cumulative * 1000, 3),
+    } for key, (_, calls, total, cumulative, _) in ranked]
+
+
+def _write(directory, keep, profile_id, profile, summary):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, profile_id)
+    profile.dump_stats(path + '.prof')
+    # Written under a temporary name so a listing never sees half a file
+    with open(path + '.json.tmp', 'w') as f:
+        json.dump(summary, f)
+    os.replace(path + '.json.tmp', path + '.json')
+
+    # Ids sort by time, so the ring buffer drops the oldest
+    names = sorted(name[:-5] for name in os.listdir(directory) if name.endswith('.json'))
+    for old in names[:-keep] if len(names) > keep else ():
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, old + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def _finish(response):
+    stopped = _stop()
+    if stopped is None:
+        return response
+    profile, trigger, started, duration, sql = stopped
+    profile_id = '%d-%d' % (time.time_ns(), os.getpid())
+    summary = {
+        'id': profile_id,
+        'created_at': started.isoformat(),
+        'trigger': trigger,
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.url_rule.rule if request.url_rule else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'sql_count': len(sql),
+        'sql_ms': round(sum(statement['duration_ms'] for statement in sql), 3),
+        'sql': sql,
+        'functions': _functions(profile),
+    }
+    try:
+        _write(current_app.config['PROFILE_DIR'], current_app.config['PROFILE_KEEP'], profile_id, profile, summary)
+    except OSError as e:
+        current_app.logger.warning('Could not write profile %s: %s', profile_id, e)
+        return response
+    response.headers['X-Profile-Id'] = profile_id
+    return response
+
+
+def _abandon(exc):
+    # Requests inside /api/batch are profiled as part of the batch
+    if batch.is_subrequest():
+        return
+    # after_request does not run when the request fails outside the view
+    _stop()
+
+
+def _load(profile_id):
+    with open(os.path.join(current_app.config['PROFILE_DIR'], profile_id + '.json')) as f:
+        return json.load(f)
+
+
+def _check_request(profile_id=None):
+    """Error response for an unauthorized request or a bad profile id, or None"""
+    if not token_matches():
+        return jsonify({'error': 'A valid %s header is required' % TOKEN_HEADER}), 403
+    if profile_id is not None and not PROFILE_ID.match(profile_id):
+        return jsonify({'error': 'Profile not found'}), 404
+    return None
+
+
+@route_class(None)
+def list_profiles():
+    """Recent profiles without their SQL and function lists, newest first"""
+    error = _check_request()
+    if error:
+        return error
+    directory = current_app.config['PROFILE_DIR']
+    try:
+        names = sorted((name[:-5] for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    except FileNotFoundError:
+        names = []
+    profiles = []
+    for profile_id in names:
+        try:
+            summary = _load(profile_id)
+        except (OSError, ValueError):
+            # Pruned by another worker since the listing
+            continue
+        summary.pop('sql', None)
+        summary.pop('functions', None)
+        profiles.append(summary)
+    return jsonify({'profiles': profiles})
+
+
+@route_class(None)
+def get_profile(profile_id):
+    error = _check_request(profile_id)
+    if error:
+        return error
+    try:
+        return jsonify(_load(profile_id))
+    except (OSError, ValueError):
+        return jsonify({'error': 'Profile not found'}), 404
+
+
+@route_class(None)
+def download_profile(profile_id):
+    error = _check_request(profile_id)
+    if error:
+        return error
+    path = os.path.join(current_app.config['PROFILE_DIR'], profile_id + '.prof')
+    if not os.path.exists(path):
+        return jsonify({'error': 'Profile not found'}), 404
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=profile_id + '.prof')
+
+
+def init_profiler(app):
+    """Register the profiling hooks and admin routes, if profiling is configured"""
+    if not app.config['PROFILE_TOKEN'] and app.config['PROFILE_SAMPLE_RATE'] <= 0:
+        return
+    if not app.config['PROFILE_TOKEN']:
+        app.logger.warning('PROFILE_SAMPLE_RATE is set without PROFILE_TOKEN: sampled profiles are only '
+                           'written to %s, /api/admin/profiles will refuse every request', app.config['PROFILE_DIR'])
+    metrics.on_statement(_statement)
+
+    app.before_request(_start)
+    app.after_request(_finish)
+    app.teardown_request(_abandon)
+
+    app.add_url_rule('/api/admin/profiles', 'list_profiles', list_profiles)
+    app.add_url_rule('/api/admin/profiles/<profile_id>', 'get_profile', get_profile)
+    app.add_url_rule('/api/admin/profiles/<profile_id>/pstats', 'download_profile', download_profile)
@@ -0,0 +1,193 @@
+"""
+Token-bucket rate limiting for the auth endpoints
+
+login and register each run bcrypt, so an unthrottled burst of attempts can
+use every CPU we have. Each limited endpoint gets buckets keyed by client IP
+and (where the body has one) by email. A request takes one token from each
+bucket; an empty bucket means an immediate 429 with Retry-After, before any
+bcrypt or database work happens.
+
+Limits are written like "10/minute": a bucket of 10 tokens that refills at
+10 tokens per minute. Buckets live in memory by default (per worker process);
+set RATELIMIT_STORAGE_URL=redis://... to share them between workers and
+hosts, or pass any object with take()/reset() as RATELIMIT_BACKEND.
+
+Behind reverse proxies every request comes from a proxy's address, so all
+clients would share one IP bucket. With RATELIMIT_TRUSTED_PROXIES set to the
+number of proxies in front of the app, trust_proxies() takes the client
+address from X-Forwarded-For instead. Leave it at 0 when clients can reach
+the app directly: they could then pick their own address.
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, jsonify, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+import metrics
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+def parse_limit(value):
+    """'10/minute' -> (capacity, refill rate in tokens per second)"""
+    count, _, period = value.partition('/')
+    capacity = int(count)
+    return capacity, capacity / float(PERIODS[period.strip()])
+
+
+class MemoryBackend:
+    """Buckets held in this process; limits apply per worker"""
+
+    def __init__(self, max_keys=100000):
+        # key -> (tokens, last update, time the bucket is full again)
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.max_keys = max_keys
+
+    def take(self, key, capacity, rate, cost=1):
+        """Take tokens from a bucket; returns 0 if allowed, else seconds until it would be"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return wait
+
+    def _prune(self, now):
+        # Full buckets carry no state, so they can be dropped
+        self._buckets = {key: bucket for key, bucket in self._buckets.items() if bucket[2] > now}
+        if len(self._buckets) > self.max_keys:
+            # Still too many distinct keys (e.g. a spoofed-IP flood): start over rather than grow
+            self._buckets.clear()
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RedisBackend:
+    """Buckets shared by every worker and host through Redis (needs the redis package)"""
+
+    # Refill and take atomically on the Redis side, using Redis' clock
+    SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+local last = tonumber(redis.call('HGET', KEYS[1], 'last'))
+if tokens == nil then
+    tokens = capacity
+    last = now
+end
+tokens = math.min(capacity, tokens + (now - last) * rate)
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'last', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+    def __init__(self, url, prefix='templecals:ratelimit:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self.SCRIPT)
+        self.prefix = prefix
+
+    def take(self, key, capacity, rate, cost=1):
+        return float(self._take(keys=[self.prefix + key], args=[capacity, rate, cost]))
+
+    def reset(self):
+        for key in self._client.scan_iter(self.prefix + '*'):
+            self._client.delete(key)
+
+
+class RateLimiter:
+    """Checks the configured buckets for a named endpoint"""
+
+    def __init__(self, backend, limits):
+        self.backend = backend
+        # {'login': {'ip': (capacity, rate), 'email': (capacity, rate)}, ...}
+        self.limits = {
+            endpoint: {scope: parse_limit(limit) for scope, limit in scopes.items()}
+            for endpoint, scopes in limits.items()
+        }
+
+    def check(self, endpoint):
+        """Returns 0 when the request may proceed, else seconds to wait"""
+        scopes = self.limits.get(endpoint, {})
+        for scope, (capacity, rate) in scopes.items():
+            key = self._key(scope)
+            if key is None:
+                continue
+            wait = self.backend.take('%s:%s:%s' % (endpoint, scope, key), capacity, rate)
+            if wait:
+                metrics.inc('templecals_ratelimit_rejected_total',
+                            (('endpoint', endpoint), ('scope', scope)))
+                return wait
+        return 0
+
+    @staticmethod
+    def _key(scope):
+        if scope == 'ip':
+            return request.remote_addr or 'unknown'
+        if scope == 'email':
+            data = request.get_json(silent=True)
+            email = data.get('email') if isinstance(data, dict) else None
+            return email.strip().lower() if isinstance(email, str) and email.strip() else None
+        return None
+
+
+def create_backend(url):
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    if url.startswith('memory://'):
+        return MemoryBackend()
+    raise ValueError('Unsupported RATELIMIT_STORAGE_URL: %s' % url)
+
+
+def trust_proxies(app):
+    """Read the client address from X-Forwarded-For, as set by RATELIMIT_TRUSTED_PROXIES proxies"""
+    proxies = app.config['RATELIMIT_TRUSTED_PROXIES']
+    if proxies > 0:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies)
+
+
+def init_rate_limits(app):
+    backend = app.config.get('RATELIMIT_BACKEND') or create_backend(app.config['RATELIMIT_STORAGE_URL'])
+    app.extensions['ratelimit'] = RateLimiter(backend, app.config['RATELIMIT_LIMITS'])
+
+
+def rate_limited(endpoint):
+    """Reject requests over the endpoint's limits with 429 before the view runs"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            limiter = current_app.extensions.get('ratelimit')
+            if limiter is not None and current_app.config['RATELIMIT_ENABLED']:
+                wait = limiter.check(endpoint)
+                if wait:
+                    retry_after = max(1, int(math.ceil(wait)))
+                    response = jsonify({'error': 'Too many requests', 'retry_after': retry_after})
+                    response.status_code = 429
+                    response.headers['Retry-After'] = str(retry_after)
+                    return response
+            return view(*args, **kwargs)
+        return wrapped
+    return decorator
@@ -0,0 +1,199 @@
+"""
+Column-only read path for the read-heavy endpoints
+
+GET /api/meals, /api/user-meals/history and /api/user-meals/daily/<date>
+return hundreds of rows per request. Loading them as ORM objects means
+building an entity per row (plus its meal, hall and category), registering
+each in the identity map and then calling to_dict() attribute by attribute.
+Here the same data comes back from one Core select() of just the columns
+to_dict() uses, as plain rows, and each row is turned into the API dict by a
+serializer generated once at import time. The output is identical to
+Meal.to_dict() / UserMeal.to_dict().
+"""
+
+from sqlalchemy import func, select
+
+from models import DiningHall, Meal, MealCategory, UserMeal, nutrition_totals, serving_totals
+
+meals = Meal.__table__
+halls = DiningHall.__table__
+categories = MealCategory.__table__
+user_meals = UserMeal.__table__
+
+
+def _hh_mm(value):
+    return value.strftime('%H:%M')
+
+
+def _isoformat(value):
+    return value.isoformat()
+
+
+def compile_serializer(fields, offset=0):
+    """
+    Build a function turning a row into a dict. fields is [(key, converter
+    or None)] for the row's columns from position offset on; converters are
+    applied to non-NULL values. The function body is generated so each call
+    is a single dict display with no per-field loop or lookups.
+    """
+    namespace = {}
+    items = []
+    for i, (key, converter) in enumerate(fields):
+        value = 'row[%d]' % (offset + i)
+        if converter is not None:
+            namespace['convert_%d' % i] = converter
+            value = '(None if %s is None else convert_%d(%s))' % (value, i, value)
+        items.append('%r: %s' % (key, value))
+    source = 'def serialize(row):\n    return {%s}\n' % ', '.join(items)
+    exec(source, namespace)
+    return namespace['serialize']
+
+
+# Meal.to_dict(), in column order
+MEAL_COLUMNS = (
+    ('id', meals.c.id, None),
+    ('name', meals.c.name, None),
+    ('description', meals.c.description, None),
+    ('calories', meals.c.calories, None),
+    ('protein', meals.c.protein, None),
+    ('carbs', meals.c.carbs, None),
+    ('fat', meals.c.fat, None),
+    ('sodium', meals.c.sodium, None),
+    ('price', meals.c.price, None),
+    ('allergens', meals.c.allergens, None),
+    ('dietary_tags', meals.c.dietary_tags, None),
+    ('available_start', meals.c.available_start, _hh_mm),
+    ('available_end', meals.c.available_end, _hh_mm),
+    ('is_available', meals.c.is_available, None),
+    ('dining_hall', halls.c.name, None),
+    ('category', categories.c.name, None),
+    ('created_at', meals.c.created_at, _isoformat),
+    ('updated_at', meals.c.updated_at, _isoformat),
+)
+
+# The user_meals part of UserMeal.to_dict(); 'meal' and the totals are added after
+USER_MEAL_COLUMNS = (
+    ('id', user_meals.c.id, None),
+    ('user_id', user_meals.c.user_id, None),
+    ('meal_id', user_meals.c.meal_id, None),
+    ('serving_multiplier', user_meals.c.serving_multiplier, None),
+    ('consumed_at', user_meals.c.consumed_at, _isoformat),
+    ('date_consumed', user_meals.c.date_consumed, _isoformat),
+    ('notes', user_meals.c.notes, None),
+    ('created_at', user_meals.c.created_at, _isoformat),
+    ('calories', user_meals.c.calories, None),
+    ('protein', user_meals.c.protein, None),
+    ('carbs', user_meals.c.carbs, None),
+    ('fat', user_meals.c.fat, None),
+    ('sodium', user_meals.c.sodium, None),
+)
+
+# Outer joins, like the nullable hall/category relationships to_dict() reads
+MEALS_FROM = meals.outerjoin(halls, halls.c.id == meals.c.dining_hall_id) \
+    .outerjoin(categories, categories.c.id == meals.c.category_id)
+
+serialize_meal = compile_serializer([(key, converter) for key, _, converter in MEAL_COLUMNS])
+_serialize_entry = compile_serializer([(key, converter) for key, _, converter in USER_MEAL_COLUMNS])
+_serialize_entry_meal = compile_serializer([(key, converter) for key, _, converter in MEAL_COLUMNS],
+                                           offset=len(USER_MEAL_COLUMNS))
+
+
+def meals_query():
+    """select() of the Meal.to_dict() columns; add where() clauses as usual"""
+    return select(*[column for _, column, _ in MEAL_COLUMNS]).select_from(MEALS_FROM)
+
+
+def user_meals_query():
+    """select() of the UserMeal.to_dict() columns, meal included; add where() and order_by()"""
+    return select(*[column for _, column, _ in USER_MEAL_COLUMNS + MEAL_COLUMNS]) \
+        .select_from(user_meals.join(MEALS_FROM, meals.c.id == user_meals.c.meal_id))
+
+
+def serialize_user_meal(row):
+    """UserMeal.to_dict() for a row from user_meals_query()"""
+    data = _serialize_entry(row)
+    data['meal'] = _serialize_entry_meal(row)
+    data.update(serving_totals(data['calories'], data['protein'], data['carbs'], data['fat'],
+                               data['serving_multiplier']))
+    return data
+
+
+def entry_totals(entries):
+    """calculate_totals() for entries from serialize_user_meal()"""
+    return nutrition_totals((entry['calories'], entry['protein'], entry['carbs'], entry['fat'],
+                             entry['serving_multiplier']) for entry in entries)
+
+
+# Group key and the table naming it, per /api/user-meals/breakdown?by=
+BREAKDOWN_GROUPS = {
+    'hall': (meals.c.dining_hall_id, halls),
+    'category': (meals.c.category_id, categories),
+    'meal': (user_meals.c.meal_id, meals),
+}
+
+# Nutrition summed per group, from the snapshot on each entry
+BREAKDOWN_NUTRIENTS = ('calories', 'protein', 'carbs', 'fat')
+
+
+def breakdown_query(user_id, start, end, by, limit):
+    """
+    select() of a user's intake between start and end (inclusive) grouped
+    by hall, category or meal: the limit groups with the most calories,
+    each row also carrying the totals over every group
+    """
+    key, names = BREAKDOWN_GROUPS[by]
+    portions = [func.sum(user_meals.c[nutrient] * user_meals.c.serving_multiplier).label(nutrient)
+                for nutrient in BREAKDOWN_NUTRIENTS]
+    # Window totals are taken over all groups, before the LIMIT cuts them
+    totals = [func.sum(portion).over().label('total_' + portion.name) for portion in portions]
+    source = user_meals
+    if key.table is meals:
+        source = user_meals.join(meals, meals.c.id == user_meals.c.meal_id)
+    top = select(key.label('id'), func.count().label('entries'), *portions,
+                 func.count().over().label('groups'), func.sum(func.count()).over().label('total_entries'), *totals) \
+        .select_from(source) \
+        .where(user_meals.c.user_id == user_id, user_meals.c.date_consumed >= start,
+               user_meals.c.date_consumed <= end, user_meals.c.deleted_at.is_(None)) \
+        .group_by(key) \
+        .order_by(func.coalesce(portions[0], 0).desc(), key) \
+        .limit(limit).subquery()
+    # Names are joined to the few groups kept, not to every entry
+    return select(top, names.c.name).select_from(top.outerjoin(names, names.c.id == top.c.id)) \
+        .order_by(func.coalesce(top.c.calories, 0).desc(), top.c.id)
+
+
+def _nutrition(calories, protein, carbs, fat):
+    # Rounded like nutrition_totals()
+    return {
+        'calories': int(calories or 0),
+        'protein': round(protein or 0, 1),
+        'carbs': round(carbs or 0, 1),
+        'fat': round(fat or 0, 1)
+    }
+
+
+def breakdown(rows):
+    """
+    {'groups', 'other', 'totals'} from breakdown_query() rows; 'other' sums
+    the groups past the limit, share is each group's fraction of calories
+    """
+    rows = [row._mapping for row in rows]
+    total = dict.fromkeys(('entries',) + BREAKDOWN_NUTRIENTS, 0)
+    if rows:
+        total = {key: rows[0]['total_' + key] or 0 for key in total}
+    rest = dict(total)
+
+    groups = []
+    for row in rows:
+        groups.append({'id': row['id'], 'name': row['name'], 'count': row['entries'],
+                       **_nutrition(*(row[nutrient] for nutrient in BREAKDOWN_NUTRIENTS)),
+                       'share': round((row['calories'] or 0) / total['calories'], 4) if total['calories'] else 0})
+        for key in rest:
+            rest[key] -= row[key] or 0
+
+    # Float sums can leave a hair below zero once every group is kept
+    other = _nutrition(*(max(rest[nutrient], 0) for nutrient in BREAKDOWN_NUTRIENTS))
+    other.update(count=int(rest['entries']), groups=rows[0]['groups'] - len(rows) if rows else 0)
+    return {'groups': groups, 'other': other,
+            'totals': dict(_nutrition(*(total[nutrient] for nutrient in BREAKDOWN_NUTRIENTS)),
+                           count=int(total['entries']))}
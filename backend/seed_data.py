@@ -3,7 +3,7 @@ Script to populate the database with Temple University dining hall data
 Run this file to add sample data to your database
 """
 
-from app import app
+from app import create_app
 from database import db
 from models import DiningHall, MealCategory, Meal
 from datetime import time
@@ -11,6 +11,7 @@ from datetime import time
 def seed_database():
     """Add sample Temple University dining data"""
     
+    app = create_app()
     with app.app_context():
         print("Clearing existing data...")
         Meal.query.delete()
@@ -0,0 +1,452 @@
+"""
+Hash-sharded user data
+
+With SHARD_DATABASE_URLS set, each user's rows - users, user_meals,
+weight_entries, user_meal_archive - live in one of several databases, picked
+from the user id with jump consistent hashing (adding an Nth shard moves
+only 1/N of users). meal_popularity is derived from user_meals, so each
+shard keeps its own and readers add them up (scatter()).
+
+The main database (SQLALCHEMY_DATABASE_URI) keeps:
+- the catalog (dining halls, categories, meals). Seed and import scripts
+  write it there and `flask replicate-catalog` copies it to every shard, so
+  user_meals joins meals without leaving its shard
+- user_directory, which hands out user ids and maps a login email to one
+
+Routing happens in the session (database.RoutingSession). The first
+statement of a request with a JWT routes it to the user's shard - from the
+token's uid claim, or the directory for tokens issued before it - and every
+statement after that goes there, so a request talks to one database. Work
+covering every user (CLI jobs, popularity counts) loops over each_shard()
+or uses scatter(); reaching a sharded table without a route is an error
+rather than a silent read of the wrong database.
+
+Each shard needs the full schema: run `flask db upgrade` against every URL.
+`flask reshard` moves users to the shard their id hashes to after
+SHARD_DATABASE_URLS changes. Without SHARD_DATABASE_URLS none of this runs
+and everything stays in the main database.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app, has_request_context
+from flask_jwt_extended import get_jwt
+from sqlalchemy import create_engine, delete, insert, inspect, select, text, update
+from sqlalchemy.sql.util import find_tables
+
+from database import db
+from models import UserDirectory
+
+# Tables holding one user's data, parents first, with the column naming the user
+USER_TABLES = (('users', 'id'), ('user_meals', 'user_id'), ('weight_entries', 'user_id'),
+               ('user_meal_archive', 'user_id'))
+# Per-shard rollups of user_meals, rebuilt on a shard after users move
+ROLLUP_TABLES = ('meal_popularity',)
+SHARDED_TABLES = frozenset([name for name, _ in USER_TABLES] + list(ROLLUP_TABLES))
+
+# Copied from the main database to every shard, parents first
+CATALOG_TABLES = ('dining_halls', 'meal_categories', 'meals')
+
+# Most shards a deployment can grow to. On PostgreSQL the user_meals and
+# weight_entries id sequences of shard i step by this and only hand out ids
+# congruent to i, so ids stay unique across shards and rows keep them when
+# they move.
+MAX_SHARDS = 64
+STRIDED_TABLES = ('user_meals', 'weight_entries')
+
+# Users moved per transaction by reshard(), and rows copied per INSERT
+MOVE_BATCH_SIZE = 200
+COPY_CHUNK_SIZE = 5000
+
+# session.info key holding the shard the session is routed to
+ROUTE_KEY = 'shard'
+
+
+def bind_key(index):
+    return f'shard{index}'
+
+
+def _mix(key):
+    """splitmix64 finalizer: spreads sequential ids before jump hashing"""
+    key = (key + 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    key = ((key ^ (key >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    key = ((key ^ (key >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    return key ^ (key >> 31)
+
+
+def jump_hash(key, buckets):
+    """Lamping & Veach jump consistent hash of a 64-bit key into range(buckets)"""
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_of(user_id, count):
+    """Index of the shard holding user_id's data; ids not yet known (None) go to shard 0"""
+    return 0 if user_id is None else jump_hash(_mix(user_id), count)
+
+
+def _tables(mapper, clause):
+    if mapper is not None:
+        return [inspect(mapper).local_table]
+    if clause is None:
+        return []
+    return find_tables(clause, include_aliases=True, include_joins=True, include_crud=True)
+
+
+class ShardRouter:
+    """Picks the engine for each statement of a RoutingSession"""
+
+    def __init__(self, db, count):
+        self.db = db
+        self.count = count
+
+    @property
+    def primary(self):
+        return self.db.engines[None]
+
+    def engine(self, index):
+        return self.db.engines[bind_key(index)]
+
+    def engines(self):
+        return [self.engine(index) for index in range(self.count)]
+
+    def get_bind(self, session, mapper, clause):
+        index = session.info.get(ROUTE_KEY)
+        if index is None:
+            index = self._request_shard(session)
+        if index is not None:
+            return self.engine(index)
+        for table in _tables(mapper, clause):
+            if table.name in SHARDED_TABLES:
+                raise RuntimeError(f'{table.name} is sharded; route the session first '
+                                   f'(shards.routed, each_shard or scatter)')
+        return self.primary
+
+    def _request_shard(self, session):
+        """Route a request carrying a JWT to its user's shard"""
+        if not has_request_context():
+            return None
+        try:
+            claims = get_jwt()
+        except RuntimeError:
+            return None
+        if not claims:
+            return None
+        user_id = claims.get('uid')
+        if user_id is None:
+            user_id = self.user_id(claims['sub'])
+        index = session.info[ROUTE_KEY] = shard_of(user_id, self.count)
+        return index
+
+    def user_id(self, email):
+        """The directory's id for email, or None"""
+        table = UserDirectory.__table__
+        with self.primary.connect() as connection:
+            return connection.execute(select(table.c.id).where(table.c.email == email)).scalar()
+
+
+def current_router():
+    return current_app.extensions.get('shards')
+
+
+def sharded():
+    return current_router() is not None
+
+
+@contextmanager
+def routed(session, index):
+    """Route the session to shard index for the duration of the block"""
+    previous = session.info.get(ROUTE_KEY)
+    session.info[ROUTE_KEY] = index
+    try:
+        yield
+    finally:
+        if previous is None:
+            session.info.pop(ROUTE_KEY, None)
+        else:
+            session.info[ROUTE_KEY] = previous
+
+
+def each_shard(session):
+    """
+    Yield each shard's index with the session routed to it, or None once
+    when not sharded. Commit inside the loop: each shard has its own transaction.
+    """
+    router = current_router()
+    if router is None:
+        yield None
+        return
+    for index in range(router.count):
+        with routed(session, index):
+            yield index
+
+
+def scatter(session, statement):
+    """statement's result rows from every shard, concatenated"""
+    rows = []
+    for _ in each_shard(session):
+        rows.extend(session.execute(statement).all())
+    return rows
+
+
+def label(index):
+    """Prefix for CLI output about one shard"""
+    return '' if index is None else f'[shard {index}] '
+
+
+def route_email(session, email):
+    """Route the session to the shard of the user with this email (login, sign-up checks)"""
+    router = current_router()
+    if router is not None:
+        session.info[ROUTE_KEY] = shard_of(router.user_id(email), router.count)
+
+
+def register_user(session, email):
+    """
+    Take a user id for a new account from the directory and route the
+    session to its shard. Returns None when not sharded (the users table
+    assigns the id). Pair with release_user() if the account is not created.
+    """
+    router = current_router()
+    if router is None:
+        return None
+    with router.primary.begin() as connection:
+        result = connection.execute(insert(UserDirectory.__table__).values(email=email, created_at=datetime.utcnow()))
+    user_id = result.inserted_primary_key[0]
+    session.info[ROUTE_KEY] = shard_of(user_id, router.count)
+    return user_id
+
+
+def release_user(user_id):
+    """Give back a directory entry whose account was never created"""
+    router = current_router()
+    if router is None or user_id is None:
+        return
+    with router.primary.begin() as connection:
+        connection.execute(delete(UserDirectory.__table__).where(UserDirectory.id == user_id))
+
+
+def _insert_rows(connection, table, rows, key, on_conflict):
+    """
+    Insert rows, skipping (on_conflict='ignore') or overwriting ('update')
+    rows whose key column already exists
+    """
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = upsert(table)
+        if on_conflict == 'ignore':
+            stmt = stmt.on_conflict_do_nothing()
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=[key], set_={
+                column.name: stmt.excluded[column.name] for column in table.columns if column.name != key})
+        connection.execute(stmt, rows)
+        return
+
+    # Other databases: look up which keys exist first
+    existing = set(connection.execute(select(table.c[key]).where(table.c[key].in_([row[key] for row in rows]))).scalars())
+    if on_conflict == 'update':
+        for row in rows:
+            if row[key] in existing:
+                connection.execute(update(table).where(table.c[key] == row[key]).values(row))
+    new_rows = [row for row in rows if row[key] not in existing]
+    if new_rows:
+        connection.execute(insert(table), new_rows)
+
+
+def replicate_catalog(router):
+    """Copy dining halls, categories and meals from the main database to every shard"""
+    tables = [db.metadata.tables[name] for name in CATALOG_TABLES]
+    with router.primary.connect() as source:
+        rows = {table.name: [dict(row._mapping) for row in source.execute(select(table))] for table in tables}
+    for engine in router.engines():
+        # A shard may share the main database
+        if engine.url == router.primary.url:
+            continue
+        with engine.begin() as connection:
+            for table in tables:
+                _insert_rows(connection, table, rows[table.name], 'id', 'update')
+    return {name: len(table_rows) for name, table_rows in rows.items()}
+
+
+def sync_directory(router, engines):
+    """
+    Add users found in engines but missing from the directory (registered
+    before sharding was turned on) and keep its id sequence past them.
+    Returns the number added.
+    """
+    table, users = UserDirectory.__table__, db.metadata.tables['users']
+    added = 0
+    with router.primary.begin() as directory:
+        for engine in engines:
+            with engine.connect() as source:
+                result = source.execution_options(yield_per=COPY_CHUNK_SIZE).execute(
+                    select(users.c.id, users.c.email, users.c.created_at))
+                for rows in result.partitions():
+                    known = set(directory.execute(select(table.c.id).where(
+                        table.c.id.in_([row.id for row in rows]))).scalars())
+                    missing = [dict(row._mapping) for row in rows if row.id not in known]
+                    _insert_rows(directory, table, missing, 'id', 'ignore')
+                    added += len(missing)
+        if directory.dialect.name == 'postgresql':
+            directory.execute(text("SELECT setval(pg_get_serial_sequence('user_directory', 'id'), "
+                                   "COALESCE((SELECT MAX(id) FROM user_directory), 0) + 1, false)"))
+    return added
+
+
+def stride_sequences(router):
+    """
+    Make shard i's id sequences (PostgreSQL) step by MAX_SHARDS from the
+    next id congruent to i above every shard's highest id. Sequences already
+    stepping by MAX_SHARDS are left alone, so this is safe to rerun with the
+    web workers up and only sets up shards added since.
+    """
+    engines = router.engines()
+    if any(engine.dialect.name != 'postgresql' for engine in engines):
+        return False
+    for name in STRIDED_TABLES:
+        sequences = []
+        for engine in engines:
+            with engine.connect() as connection:
+                sequence = connection.execute(text(f"SELECT pg_get_serial_sequence('{name}', 'id')")).scalar()
+                step = connection.execute(text('SELECT seqincrement FROM pg_sequence '
+                                               'WHERE seqrelid = CAST(:sequence AS regclass)'),
+                                          {'sequence': sequence}).scalar()
+                top = connection.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM {name}')).scalar()
+            sequences.append((sequence, step == MAX_SHARDS, top))
+        top = max(top for _, _, top in sequences)
+        for index, (engine, (sequence, strided, _)) in enumerate(zip(engines, sequences)):
+            if strided:
+                continue
+            start = top + 1 + (index - top - 1) % MAX_SHARDS
+            with engine.begin() as connection:
+                connection.execute(text(f'ALTER SEQUENCE {sequence} INCREMENT BY {MAX_SHARDS} RESTART WITH {start}'))
+    return True
+
+
+def _delete_users(connection, user_ids):
+    for name, column in reversed(USER_TABLES):
+        table = db.metadata.tables[name]
+        connection.execute(delete(table).where(table.c[column].in_(user_ids)))
+
+
+def _copy_rows(reader, writer, table, column, user_ids):
+    """
+    Copy user_ids' rows of table. Each shard numbers STRIDED_TABLES on its
+    own unless its sequences are strided (PostgreSQL), so a row whose id the
+    target already uses is inserted last, under an id the target picks, with
+    updated_at moved so /api/user-meals/changes sends it again. Returns
+    (rows copied, rows renumbered).
+    """
+    result = reader.execution_options(yield_per=COPY_CHUNK_SIZE).execute(
+        select(table).where(table.c[column].in_(user_ids)))
+    copied, clashing = 0, []
+    for rows in result.partitions():
+        rows = [dict(row._mapping) for row in rows]
+        if table.name in STRIDED_TABLES:
+            taken = set(writer.execute(select(table.c.id).where(
+                table.c.id.in_([row['id'] for row in rows]))).scalars())
+            clashing.extend(row for row in rows if row['id'] in taken)
+            rows = [row for row in rows if row['id'] not in taken]
+        if rows:
+            writer.execute(insert(table), rows)
+            copied += len(rows)
+    # After every kept id is in, so a picked id cannot take one of them
+    now = datetime.utcnow()
+    for row in clashing:
+        del row['id']
+        if 'updated_at' in row:
+            row['updated_at'] = now
+    if clashing:
+        writer.execute(insert(table), clashing)
+    return copied + len(clashing), len(clashing)
+
+
+def move_users(source, target, user_ids):
+    """
+    Copy user_ids' rows from source to target, then delete them from source.
+    Rerunning after an interruption is safe: the target's copy is replaced.
+    Returns {table: rows moved}, plus {'renumbered <table>': rows} for rows
+    that got a new id.
+    """
+    moved = {}
+    with target.begin() as writer:
+        # Left over from an interrupted run
+        _delete_users(writer, user_ids)
+        with source.connect() as reader:
+            for name, column in USER_TABLES:
+                moved[name], renumbered = _copy_rows(reader, writer, db.metadata.tables[name], column, user_ids)
+                if renumbered:
+                    moved[f'renumbered {name}'] = renumbered
+    with source.begin() as connection:
+        _delete_users(connection, user_ids)
+    return moved
+
+
+def reshard(router, sources=(), dry_run=False, batch_size=MOVE_BATCH_SIZE, log=print):
+    """
+    Move every user to the shard their id hashes to under the current
+    SHARD_DATABASE_URLS, also draining the databases in sources (retired
+    shards). Run with the web workers stopped: a user being moved is briefly
+    on neither or both shards. Returns the indexes of shards that gained or
+    lost users, whose meal_popularity needs rebuilding.
+    """
+    engines = router.engines()
+    sources = [(f'shard {index}', index, engine) for index, engine in enumerate(engines)] + \
+        [(engine.url.render_as_string(hide_password=True), None, engine)
+         for engine in (create_engine(url) for url in sources)]
+
+    if not dry_run:
+        added = sync_directory(router, [engine for _, _, engine in sources])
+        log(f'user_directory: added {added} users')
+        counts = replicate_catalog(router)
+        log('Catalog replicated: ' + ', '.join(f'{count} {name}' for name, count in counts.items()))
+        if stride_sequences(router):
+            log(f'Id sequences step by {MAX_SHARDS}')
+
+    changed = set()
+    for name, index, engine in sources:
+        users = db.metadata.tables['users']
+        with engine.connect() as connection:
+            user_ids = list(connection.execute(select(users.c.id).order_by(users.c.id)).scalars())
+        plan = {}
+        for user_id in user_ids:
+            target = shard_of(user_id, router.count)
+            if target != index:
+                plan.setdefault(target, []).append(user_id)
+        for target, moving in sorted(plan.items()):
+            if dry_run:
+                log(f'{name} -> shard {target}: {len(moving)} users would move')
+                continue
+            totals = {}
+            for start in range(0, len(moving), batch_size):
+                for table, count in move_users(engine, engines[target], moving[start:start + batch_size]).items():
+                    totals[table] = totals.get(table, 0) + count
+            log(f'{name} -> shard {target}: moved ' + ', '.join(f'{count} {table}' for table, count in totals.items()))
+            changed.update(i for i in (index, target) if i is not None)
+        if not plan:
+            log(f'{name}: nothing to move')
+    return sorted(changed)
+
+
+def init_shards(app):
+    """Register one bind per shard; call before db.init_app()"""
+    urls = app.config['SHARD_DATABASE_URLS']
+    if not urls:
+        return
+    if len(urls) > MAX_SHARDS:
+        raise ValueError(f'At most {MAX_SHARDS} shards are supported')
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update({bind_key(index): url for index, url in enumerate(urls)})
+    app.config['SQLALCHEMY_BINDS'] = binds
+    app.extensions['shards'] = ShardRouter(db, len(urls))
@@ -0,0 +1,244 @@
+"""
+Slow query log
+
+metrics.py times every SQL statement (engine events). One that takes at least
+SLOW_QUERY_MS is logged and counted under its fingerprint: the statement
+with literals and bind parameters replaced by ?, and IN lists and VALUES
+rows collapsed, so the same query from any user lands in one entry. An entry
+keeps the count, total and worst time, the routes that ran it, and the
+latest occurrence with its parameters redacted (strings and bytes are never
+kept).
+
+The first time a fingerprint turns up slow, a background thread asks the
+database for its plan on a connection of its own: EXPLAIN (ANALYZE, BUFFERS)
+on Postgres for SELECTs (plain EXPLAIN for writes, so they never run twice),
+EXPLAIN QUERY PLAN on SQLite. That is what shows a sequential scan where an
+index on user_meals should be.
+
+    GET /api/admin/slow-queries?limit=20&sort=total_ms|max_ms|count
+
+returns the top entries of this worker (X-Profile-Token, as for the
+profiles). Entries live in memory per worker; the least costly one is
+dropped past MAX_FINGERPRINTS. SLOW_QUERY_MS=0 registers nothing.
+"""
+
+import hashlib
+import queue
+import re
+import threading
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import current_app, has_app_context, has_request_context, jsonify, request
+from sqlalchemy.pool import StaticPool
+
+from admission import route_class
+import metrics
+from profiler import TOKEN_HEADER, token_matches
+
+# Distinct slow statements kept per worker
+MAX_FINGERPRINTS = 500
+
+# Plans waiting for the EXPLAIN thread; more are dropped, and retried when
+# their statement is slow again
+MAX_PENDING_EXPLAINS = 50
+
+# Longest an EXPLAIN ANALYZE may run, in milliseconds
+EXPLAIN_TIMEOUT_MS = 10000
+
+DEFAULT_REPORT_LIMIT = 20
+MAX_REPORT_LIMIT = 100
+REPORT_SORTS = ('total_ms', 'max_ms', 'count')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w.])-?\d+(?:\.\d+)?\b')
+_PARAMETER = re.compile(r'%\(\w+\)s|%s|(?<!:):\w+|\$\d+')
+_IN_LIST = re.compile(r'\bIN \(\?(?:, \?)*\)', re.IGNORECASE)
+_VALUES = re.compile(r'(\(\?(?:, \?)*\))(?:, \1)+')
+_SPACE = re.compile(r'\s+')
+
+# Values shown as they are in a redacted sample
+_SHOWN = (bool, int, float, Decimal, date, datetime, type(None))
+
+
+def normalize(statement):
+    """The statement with literals and parameters as ? and lists collapsed"""
+    sql = _STRING.sub('?', statement)
+    sql = _PARAMETER.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _SPACE.sub(' ', sql).strip()
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _VALUES.sub(r'\1, ...', sql)
+
+
+def fingerprint(normalized):
+    return hashlib.sha1(normalized.encode()).hexdigest()[:16]
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, _SHOWN):
+        return value.isoformat() if isinstance(value, (date, datetime)) else value
+    return '<%s>' % type(value).__name__
+
+
+def _explain_sql(dialect, statement):
+    """(EXPLAIN statement, whether it runs the query) for a dialect, or None"""
+    if dialect == 'postgresql':
+        if statement.lstrip().upper().startswith(('SELECT', 'WITH')):
+            return 'EXPLAIN (ANALYZE, BUFFERS) ' + statement, True
+        return 'EXPLAIN ' + statement, False
+    if dialect == 'sqlite':
+        return 'EXPLAIN QUERY PLAN ' + statement, False
+    return None
+
+
+class SlowQueryLog:
+    """The slow statements one worker has seen, by fingerprint"""
+
+    def __init__(self, threshold_ms, explain=True, logger=None):
+        self.threshold = threshold_ms / 1000.0
+        self.explain = explain
+        self.logger = logger
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._pending = queue.Queue(MAX_PENDING_EXPLAINS)
+        self._worker = None
+
+    def record(self, engine, statement, parameters, executemany, elapsed, route):
+        normalized = normalize(statement)
+        key = fingerprint(normalized)
+        duration_ms = round(elapsed * 1000, 3)
+        sample = {
+            'route': route,
+            'duration_ms': duration_ms,
+            'params': None if executemany else redact(parameters),
+            'at': datetime.utcnow().isoformat(),
+        }
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                if len(self.entries) >= MAX_FINGERPRINTS:
+                    del self.entries[min(self.entries, key=lambda k: self.entries[k]['total_ms'])]
+                entry = self.entries[key] = {
+                    'fingerprint': key, 'sql': normalized, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    'routes': {}, 'first_seen': sample['at'], 'last': None, 'explain': None,
+                }
+            entry['count'] += 1
+            entry['total_ms'] = round(entry['total_ms'] + duration_ms, 3)
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            entry['routes'][route] = entry['routes'].get(route, 0) + 1
+            entry['last'] = sample
+            wants_plan = self.explain and entry['explain'] is None and not executemany
+            if wants_plan:
+                entry['explain'] = {'status': 'pending'}
+        if self.logger is not None:
+            self.logger.warning('Slow query (%.1f ms, %s) %s: %s', duration_ms, route, key, normalized[:300])
+        if wants_plan:
+            self._queue_explain(engine, key, statement, parameters)
+
+    def _queue_explain(self, engine, key, statement, parameters):
+        # An in-memory SQLite database has one connection, already in use
+        if isinstance(engine.pool, StaticPool) or _explain_sql(engine.dialect.name, statement) is None:
+            self._set_plan(key, {'status': 'unsupported'})
+            return
+        try:
+            self._pending.put_nowait((engine, key, statement, parameters))
+        except queue.Full:
+            self._set_plan(key, None)
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._explain_loop, name='slowlog-explain', daemon=True)
+                self._worker.start()
+
+    def _set_plan(self, key, plan):
+        with self._lock:
+            if key in self.entries:
+                self.entries[key]['explain'] = plan
+
+    def _explain_loop(self):
+        # Runs outside any app context, so its own statements are never logged
+        while True:
+            engine, key, statement, parameters = self._pending.get()
+            self._set_plan(key, self._explain(engine, statement, parameters))
+
+    def _explain(self, engine, statement, parameters):
+        sql, analyzed = _explain_sql(engine.dialect.name, statement)
+        start = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                if engine.dialect.name == 'postgresql':
+                    connection.exec_driver_sql('SET LOCAL statement_timeout = %d' % EXPLAIN_TIMEOUT_MS)
+                rows = connection.exec_driver_sql(sql, parameters).fetchall()
+                # EXPLAIN ANALYZE ran the query; leave nothing behind
+                connection.rollback()
+        except Exception as e:
+            return {'status': 'failed', 'details': str(e)}
+        if engine.dialect.name == 'sqlite':
+            # (id, parent, notused, detail) rows
+            plan = '\n'.join(row[-1] for row in rows)
+        else:
+            plan = '\n'.join(row[0] for row in rows)
+        return {'status': 'done', 'analyzed': analyzed, 'plan': plan,
+                'captured_at': datetime.utcnow().isoformat(),
+                'explain_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    def report(self, limit, sort):
+        """The top `limit` entries by `sort`, each with its mean time"""
+        with self._lock:
+            entries = sorted(self.entries.values(), key=lambda entry: entry[sort], reverse=True)[:limit]
+            entries = [dict(entry, routes=dict(entry['routes'])) for entry in entries]
+        for entry in entries:
+            entry['mean_ms'] = round(entry['total_ms'] / entry['count'], 3)
+        return entries
+
+
+def _statement(conn, statement, parameters, executemany, start, elapsed):
+    if not has_app_context():
+        return
+    log = current_app.extensions.get('slowlog')
+    if log is None or elapsed < log.threshold:
+        return
+    if has_request_context():
+        route = '%s %s' % (request.method, request.url_rule.rule if request.url_rule else 'unmatched')
+    else:
+        route = 'cli'
+    log.record(conn.engine, statement, parameters, executemany, elapsed, route)
+
+
+@route_class(None)
+def slow_queries():
+    """Top slow statements of this worker"""
+    if not token_matches():
+        return jsonify({'error': 'A valid %s header is required' % TOKEN_HEADER}), 403
+    try:
+        limit = int(request.args.get('limit', DEFAULT_REPORT_LIMIT))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    if limit < 1 or limit > MAX_REPORT_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {MAX_REPORT_LIMIT}'}), 400
+    sort = request.args.get('sort', 'total_ms')
+    if sort not in REPORT_SORTS:
+        return jsonify({'error': 'sort must be one of %s' % ', '.join(REPORT_SORTS)}), 400
+
+    log = current_app.extensions['slowlog']
+    return jsonify({
+        'threshold_ms': current_app.config['SLOW_QUERY_MS'],
+        'sort': sort,
+        'fingerprints': len(log.entries),
+        'queries': log.report(limit, sort),
+    })
+
+
+def init_slowlog(app):
+    """Time statements against SLOW_QUERY_MS and register the report route"""
+    if app.config['SLOW_QUERY_MS'] <= 0:
+        return
+    app.extensions['slowlog'] = SlowQueryLog(app.config['SLOW_QUERY_MS'], app.config['SLOW_QUERY_EXPLAIN'], app.logger)
+    metrics.on_statement(_statement)
+    app.add_url_rule('/api/admin/slow-queries', 'slow_queries', slow_queries)
@@ -0,0 +1,122 @@
+"""
+Typeahead suggestions for /api/meals/suggest
+
+Answering each keystroke with an ILIKE scan that returns full meal dicts is
+far more work than a dropdown needs. Each worker instead keeps a prefix
+index over the available meals in the meal catalog (catalog.py), rebuilt
+whenever the catalog reloads:
+
+- every meal's whole name, normalized to lowercase words joined by single
+  spaces ("Mac & Cheese" -> "mac cheese"), in one sorted array
+- every word of every name in another
+
+A query is normalized the same way. Meals whose name starts with it come
+first; then meals where each query word starts some word of the name
+("ch sand" finds "Grilled Chicken Sandwich"). Each lookup is a pair of
+binary searches giving the slice of matching keys; several query words
+intersect their slices. Within each group the most logged meals
+(popularity score window) come first, then shorter names.
+"""
+
+import bisect
+import heapq
+import re
+import threading
+
+WORD = re.compile(r'[a-z0-9]+')
+
+# Most suggestions one request may ask for
+MAX_LIMIT = 20
+DEFAULT_LIMIT = 8
+
+# Match kinds, best first
+NAME_PREFIX, WORD_PREFIX = 0, 1
+
+
+def words(text):
+    return WORD.findall(text.lower())
+
+
+# Sorts after every character a normalized key can contain
+PAST_WORD = '{'
+
+
+def _prefixed(keys, ids, prefix):
+    """Ids whose key in the sorted keys starts with prefix"""
+    return ids[bisect.bisect_left(keys, prefix):bisect.bisect_left(keys, prefix + PAST_WORD)]
+
+
+class _Index:
+    """Sorted name and word arrays for one catalog version"""
+
+    def __init__(self, meals):
+        self.suggestions = {}
+        names, name_words = [], []
+        for meal_id, (_, meal) in meals.items():
+            if not meal.get('is_available') or not meal.get('name'):
+                continue
+            meal_words = words(meal['name'])
+            if not meal_words:
+                continue
+            self.suggestions[meal_id] = {'id': meal_id, 'name': meal['name'],
+                                         'dining_hall': meal.get('dining_hall'), 'calories': meal.get('calories')}
+            names.append((' '.join(meal_words), meal_id))
+            name_words.extend((word, meal_id) for word in set(meal_words))
+        names.sort()
+        name_words.sort()
+        # Tie-break among equally popular matches: shorter names, then alphabetical
+        self.rank = {meal_id: rank for rank, meal_id in enumerate(sorted(
+            self.suggestions, key=lambda meal_id: (len(self.suggestions[meal_id]['name']),
+                                                   self.suggestions[meal_id]['name'], meal_id)))}
+        self.name_keys = [key for key, _ in names]
+        self.name_ids = [meal_id for _, meal_id in names]
+        self.word_keys = [key for key, _ in name_words]
+        self.word_ids = [meal_id for _, meal_id in name_words]
+
+    def matches(self, query_words):
+        """{meal_id: match kind} for a normalized, non-empty query"""
+        # Meals with a word starting with each query word: one slice per word, intersected
+        slices = sorted((_prefixed(self.word_keys, self.word_ids, word) for word in set(query_words)), key=len)
+        candidates = set(slices[0]).intersection(*slices[1:]) if len(slices) > 1 else slices[0]
+        found = dict.fromkeys(candidates, WORD_PREFIX)
+        found.update(dict.fromkeys(_prefixed(self.name_keys, self.name_ids, ' '.join(query_words)), NAME_PREFIX))
+        return found
+
+
+class SuggestIndex:
+    """Per-worker prefix index over the meal catalog"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        # (catalog version, _Index)
+        self._built = None
+        self._lock = threading.Lock()
+
+    def _index(self):
+        version, meals = self.catalog.snapshot()
+        built = self._built
+        if built is None or built[0] != version:
+            with self._lock:
+                built = self._built
+                if built is None or built[0] != version:
+                    built = self._built = (version, _Index(meals))
+        return built[1]
+
+    def suggest(self, query, limit=DEFAULT_LIMIT, scores=None):
+        """
+        Up to limit {id, name, dining_hall, calories} dicts for meals
+        matching query, best first; scores is {meal_id: popularity}
+        """
+        query_words = words(query)
+        if not query_words or limit <= 0:
+            return []
+        index = self._index()
+        scores = scores or {}
+        rank = index.rank
+        best = heapq.nsmallest(limit, [(kind, -scores.get(meal_id, 0), rank[meal_id], meal_id)
+                                       for meal_id, kind in index.matches(query_words).items()])
+        return [index.suggestions[item[3]] for item in best]
+
+
+def init_suggest(app):
+    app.extensions['meal_suggest'] = SuggestIndex(app.extensions['meal_catalog'])
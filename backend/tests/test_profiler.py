@@ -0,0 +1,38 @@
+from conftest import register, seed_catalog
+
+TOKEN = 'profile-token'
+
+
+def test_profiled_batch_writes_a_profile(make_app, tmp_path):
+    app = make_app(PROFILE_TOKEN=TOKEN, PROFILE_DIR=str(tmp_path / 'profiles'))
+    seed_catalog(app)
+    client = app.test_client()
+    access_token = register(client, 'batch@example.com')
+
+    response = client.post('/api/batch', headers={'Authorization': 'Bearer ' + access_token, 'X-Profile-Token': TOKEN},
+                           json={'requests': [{'path': '/api/auth/me'}, {'path': '/api/meals'}]})
+    assert response.status_code == 200
+    assert [result['status'] for result in response.get_json()['responses']] == [200, 200]
+    profile_id = response.headers.get('X-Profile-Id')
+    assert profile_id
+
+    profile = client.get(f'/api/admin/profiles/{profile_id}', headers={'X-Profile-Token': TOKEN}).get_json()
+    assert profile['path'] == '/api/batch'
+    assert profile['sql_count'] >= 2
+    listed = client.get('/api/admin/profiles', headers={'X-Profile-Token': TOKEN}).get_json()['profiles']
+    assert profile_id in [summary['id'] for summary in listed]
+
+
+def test_sampled_batch_writes_a_profile(make_app, tmp_path):
+    directory = tmp_path / 'profiles'
+    app = make_app(PROFILE_SAMPLE_RATE=1.0, PROFILE_DIR=str(directory))
+    seed_catalog(app)
+    client = app.test_client()
+
+    response = client.post('/api/batch', json={'requests': [{'path': '/api/meals'}, {'path': '/api/categories'}]})
+    assert response.status_code == 200
+    profile_id = response.headers.get('X-Profile-Id')
+    assert profile_id
+    assert (directory / (profile_id + '.json')).exists()
+    # Without PROFILE_TOKEN the profiles are only on disk
+    assert client.get('/api/admin/profiles').status_code == 403
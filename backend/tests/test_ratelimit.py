@@ -0,0 +1,26 @@
+from ratelimit import trust_proxies
+
+LIMITS = {'login': {'ip': '2/minute'}}
+
+
+def login(client, address):
+    return client.post('/api/auth/login', headers={'X-Forwarded-For': address},
+                       json={'email': 'nobody@example.com', 'password': 'Password123'})
+
+
+def test_forwarded_clients_get_their_own_buckets(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_LIMITS=LIMITS, RATELIMIT_TRUSTED_PROXIES=1)
+    trust_proxies(app)
+    client = app.test_client()
+
+    assert [login(client, '203.0.113.1').status_code for _ in range(3)] == [401, 401, 429]
+    assert login(client, '203.0.113.2').status_code == 401
+
+
+def test_forwarded_for_is_ignored_without_trusted_proxies(make_app):
+    app = make_app(RATELIMIT_ENABLED=True, RATELIMIT_LIMITS=LIMITS)
+    trust_proxies(app)
+    client = app.test_client()
+
+    assert [login(client, '203.0.113.1').status_code for _ in range(2)] == [401, 401]
+    assert login(client, '203.0.113.2').status_code == 429
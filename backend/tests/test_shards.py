@@ -0,0 +1,224 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import shards
+from conftest import PASSWORD, insert_users, register, seed_catalog
+from database import db
+from models import WeightEntry
+
+USERS = 600
+
+
+def rows(url, sql):
+    engine = create_engine(url)
+    try:
+        with engine.connect() as connection:
+            return connection.execute(text(sql)).all()
+    finally:
+        engine.dispose()
+
+
+def user_ids(url):
+    return {row[0] for row in rows(url, 'SELECT id FROM users')}
+
+
+def placement(urls):
+    """{user id: index of the file holding it}; fails on a user held twice"""
+    placed = {}
+    for index, url in enumerate(urls):
+        for user_id in user_ids(url):
+            assert user_id not in placed, f'user {user_id} is on shards {placed[user_id]} and {index}'
+            placed[user_id] = index
+    return placed
+
+
+def seed_users(app, count):
+    """USERS users, each with a weigh-in, on the shard their id hashes to under `count` shards"""
+    router = app.extensions['shards']
+    ids = range(1, USERS + 1)
+    with app.app_context():
+        for index in range(count):
+            mine = [user_id for user_id in ids if shards.shard_of(user_id, count) == index]
+            with router.engine(index).begin() as connection:
+                insert_users(connection, mine)
+                connection.execute(WeightEntry.__table__.insert(), [
+                    {'id': user_id, 'user_id': user_id, 'weight': 150.0, 'measured_at': datetime(2026, 1, 1)}
+                    for user_id in mine])
+
+
+def reshard(app, *args):
+    result = app.test_cli_runner().invoke(args=['reshard', *args])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def test_jwt_request_routes_to_the_users_shard(make_app, shard_urls):
+    urls = shard_urls(3)
+    app = make_app(SHARD_DATABASE_URLS=urls)
+    meal_ids = seed_catalog(app)
+    assert app.test_cli_runner().invoke(args=['replicate-catalog']).exit_code == 0
+    client = app.test_client()
+
+    for number in range(6):
+        headers = {'Authorization': 'Bearer ' + register(client, f'user{number}@example.com')}
+        me = client.get('/api/auth/me', headers=headers)
+        assert me.status_code == 200
+        user_id = me.get_json()['user']['id']
+        assert client.post('/api/user-meals/log', headers=headers, json={'meal_id': meal_ids[0]}).status_code == 201
+
+        shard = shards.shard_of(user_id, len(urls))
+        assert placement(urls)[user_id] == shard
+        assert rows(urls[shard], f'SELECT COUNT(*) FROM user_meals WHERE user_id = {user_id}')[0][0] == 1
+    # The main database only holds the directory
+    assert user_ids(app.config['SQLALCHEMY_DATABASE_URI']) == set()
+    assert len(rows(app.config['SQLALCHEMY_DATABASE_URI'], 'SELECT id FROM user_directory')) == 6
+
+
+def test_replicate_catalog_copies_and_updates_every_shard(make_app, shard_urls):
+    urls = shard_urls(3)
+    app = make_app(SHARD_DATABASE_URLS=urls)
+    meal_ids = seed_catalog(app)
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(args=['replicate-catalog'])
+    assert result.exit_code == 0
+    assert 'Replicated to 3 shards' in result.output
+    for url in urls:
+        assert sorted(row[0] for row in rows(url, 'SELECT id FROM meals')) == meal_ids
+        assert [row[0] for row in rows(url, 'SELECT name FROM dining_halls')] == ['Test Hall']
+
+    # A rerun overwrites changed rows instead of duplicating them
+    with app.app_context():
+        db.session.execute(text("UPDATE meals SET name = 'Renamed' WHERE id = :id"), {'id': meal_ids[0]})
+        db.session.commit()
+    assert runner.invoke(args=['replicate-catalog']).exit_code == 0
+    for url in urls:
+        assert len(rows(url, 'SELECT id FROM meals')) == len(meal_ids)
+        assert rows(url, f'SELECT name FROM meals WHERE id = {meal_ids[0]}')[0][0] == 'Renamed'
+
+
+def test_reshard_after_adding_a_shard_moves_about_one_in_n(make_app, shard_urls):
+    seed_users(make_app(SHARD_DATABASE_URLS=shard_urls(3)), 3)
+    before = placement(shard_urls(3))
+
+    urls = shard_urls(4)
+    app = make_app(SHARD_DATABASE_URLS=urls)
+    assert 'would move' in reshard(app, '--dry-run')
+    assert placement(urls) == before
+
+    reshard(app, '--batch-size', '50')
+    after = placement(urls)
+    assert len(after) == USERS
+    assert all(shard == shards.shard_of(user_id, 4) for user_id, shard in after.items())
+    moved = {user_id for user_id in after if after[user_id] != before[user_id]}
+    # Jump hashing only moves users onto the new shard, about 1/N of them
+    assert all(after[user_id] == 3 for user_id in moved)
+    assert abs(len(moved) / USERS - 1 / 4) < 0.06
+    for index, url in enumerate(urls):
+        owners = {row[0] for row in rows(url, 'SELECT user_id FROM weight_entries')}
+        assert owners == {user_id for user_id, shard in after.items() if shard == index}
+    # Users registered before the directory existed are in it now
+    assert len(rows(app.config['SQLALCHEMY_DATABASE_URI'], 'SELECT id FROM user_directory')) == USERS
+
+
+def history_ids(client, headers):
+    response = client.get('/api/user-meals/history', headers=headers)
+    assert response.status_code == 200
+    return sorted(entry['id'] for entry in response.get_json()['meals'])
+
+
+def test_reshard_moves_entries_with_clashing_ids(make_app, shard_urls):
+    # Each shard numbers user_meals and weight_entries on its own, so users
+    # moving onto the new shard from different shards bring the same ids
+    app = make_app(SHARD_DATABASE_URLS=shard_urls(3))
+    meal_ids = seed_catalog(app)
+    assert app.test_cli_runner().invoke(args=['replicate-catalog']).exit_code == 0
+    client = app.test_client()
+    users = {}
+    for number in range(12):
+        headers = {'Authorization': 'Bearer ' + register(client, f'user{number}@example.com')}
+        for meal_id in meal_ids[:2]:
+            assert client.post('/api/user-meals/log', headers=headers, json={'meal_id': meal_id}).status_code == 201
+        assert client.post('/api/weight', headers=headers, json={'weight': 150 + number}).status_code == 201
+        users[client.get('/api/auth/me', headers=headers).get_json()['user']['id']] = headers
+    moving = [user_id for user_id in users if shards.shard_of(user_id, 4) == 3]
+    assert len({shards.shard_of(user_id, 3) for user_id in moving}) > 1
+    before = {user_id: history_ids(client, headers) for user_id, headers in users.items()}
+
+    urls = shard_urls(4)
+    app = make_app(SHARD_DATABASE_URLS=urls)
+    assert 'renumbered user_meals' in reshard(app, '--batch-size', '1')
+    assert placement(urls) == {user_id: shards.shard_of(user_id, 4) for user_id in users}
+    assert 'moved' not in reshard(app)
+
+    client = app.test_client()
+    for user_id, headers in users.items():
+        ids = history_ids(client, headers)
+        assert len(ids) == 2
+        # Only entries whose id was taken on the new shard are renumbered
+        if user_id not in moving:
+            assert ids == before[user_id]
+        assert len(client.get('/api/weight', headers=headers).get_json()['entries']) == 1
+    assert rows(urls[3], 'SELECT COUNT(*) FROM user_meals')[0][0] == 2 * len(moving)
+    assert rows(urls[3], 'SELECT COUNT(*) FROM weight_entries')[0][0] == len(moving)
+
+
+def test_reshard_drains_a_retired_database(make_app, shard_urls):
+    seed_users(make_app(SHARD_DATABASE_URLS=shard_urls(3)), 3)
+    retired = shard_urls(3)[2]
+    assert user_ids(retired)
+
+    urls = shard_urls(2)
+    reshard(make_app(SHARD_DATABASE_URLS=urls), '--source', retired)
+    assert user_ids(retired) == set()
+    assert rows(retired, 'SELECT COUNT(*) FROM weight_entries')[0][0] == 0
+    after = placement(urls)
+    assert len(after) == USERS
+    assert all(shard == shards.shard_of(user_id, 2) for user_id, shard in after.items())
+
+
+def test_interrupted_move_users_reruns_without_duplicates(make_app, shard_urls, monkeypatch):
+    urls = shard_urls(2)
+    app = make_app(SHARD_DATABASE_URLS=urls)
+    router = app.extensions['shards']
+    moving = list(range(1, 51))
+    with app.app_context():
+        source, target = router.engine(0), router.engine(1)
+        with source.begin() as connection:
+            insert_users(connection, moving)
+            connection.execute(WeightEntry.__table__.insert(), [
+                {'id': user_id, 'user_id': user_id, 'weight': 150.0, 'measured_at': datetime(2026, 1, 1)}
+                for user_id in moving])
+
+        # Fail after the copy, when the users are deleted from the source
+        delete_users = shards._delete_users
+
+        def interrupted(connection, user_ids):
+            if connection.engine is source:
+                raise RuntimeError('interrupted')
+            delete_users(connection, user_ids)
+
+        monkeypatch.setattr(shards, '_delete_users', interrupted)
+        with pytest.raises(RuntimeError):
+            shards.move_users(source, target, moving)
+        assert user_ids(urls[0]) == user_ids(urls[1]) == set(moving)
+
+        monkeypatch.setattr(shards, '_delete_users', delete_users)
+        moved = shards.move_users(source, target, moving)
+    assert moved['users'] == moved['weight_entries'] == len(moving)
+    assert user_ids(urls[0]) == set()
+    assert rows(urls[1], 'SELECT COUNT(*), COUNT(DISTINCT id) FROM users')[0] == (len(moving), len(moving))
+    assert rows(urls[1], 'SELECT COUNT(*) FROM weight_entries')[0][0] == len(moving)
+
+
+def test_register_rejects_an_email_differing_only_in_case(make_app, shard_urls):
+    app = make_app(SHARD_DATABASE_URLS=shard_urls(3))
+    client = app.test_client()
+    register(client, 'taken@example.com')
+    response = client.post('/api/auth/register', json={
+        'email': 'Taken@Example.com', 'password': PASSWORD, 'first_name': 'Test', 'last_name': 'User'})
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'Email already registered'
+    assert len(rows(app.config['SQLALCHEMY_DATABASE_URI'], 'SELECT id FROM user_directory')) == 1
@@ -0,0 +1,48 @@
+import pytest
+
+from benchmark import QUERY_BUDGETS, QueryCounter
+from conftest import register, seed_catalog
+from database import db
+
+MODES = {
+    'embedded': {},
+    'single-connection': {'SQLITE_READERS': 0},
+    'sharded': {'SHARD_DATABASE_URLS': 2},
+}
+
+
+@pytest.fixture(params=list(MODES))
+def app(request, make_app, shard_urls):
+    config = dict(MODES[request.param])
+    if 'SHARD_DATABASE_URLS' in config:
+        config['SHARD_DATABASE_URLS'] = shard_urls(config['SHARD_DATABASE_URLS'])
+    app = make_app(**config)
+    seed_catalog(app)
+    if config.get('SHARD_DATABASE_URLS'):
+        assert app.test_cli_runner().invoke(args=['replicate-catalog']).exit_code == 0
+    return app
+
+
+def test_write_paths_stay_within_query_budget(app):
+    client = app.test_client()
+    headers = {'Authorization': 'Bearer ' + register(client, 'writer@example.com')}
+    with app.app_context():
+        meal_id = db.session.execute(db.text('SELECT MIN(id) FROM meals')).scalar()
+        counter = QueryCounter(db.engines.values())
+    # Loads the meal catalog and popularity counts, which later writes reuse
+    assert client.post('/api/user-meals/log', headers=headers, json={'meal_id': meal_id}).status_code == 201
+
+    requests = {
+        'log': lambda: client.post('/api/user-meals/log', headers=headers, json={'meal_id': meal_id}),
+        'update': lambda: client.put(f'/api/user-meals/{entry_id}', headers=headers,
+                                     json={'serving_multiplier': 2, 'consumed_at': '2026-01-02T12:30:00'}),
+        'delete': lambda: client.delete(f'/api/user-meals/{entry_id}', headers=headers),
+    }
+    for route, send in requests.items():
+        before = counter.count
+        response = send()
+        assert response.status_code < 300, response.get_json()
+        if route == 'log':
+            entry_id = response.get_json()['user_meal']['id']
+        assert counter.count - before <= QUERY_BUDGETS[route], \
+            f'{route} ran {counter.count - before} statements, budget {QUERY_BUDGETS[route]}'
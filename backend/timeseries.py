@@ -0,0 +1,51 @@
+"""
+Downsampling for chart series (weight history)
+
+A multi-year weight chart can hold thousands of entries, while the chart is
+a few hundred pixels wide. lttb() picks the points worth drawing with
+Largest-Triangle-Three-Buckets: the first and last points are kept and the
+rest are split into equal buckets, keeping from each the point that forms
+the largest triangle with the point kept before it and the average of the
+next bucket. Peaks and dips survive, flat stretches collapse, and every
+point returned is a real entry.
+"""
+
+
+def lttb(points, threshold):
+    """
+    Indexes of the points to keep, at most threshold of them (all of them
+    when there are no more than threshold, or threshold is under 3).
+    points is a list of (x, y) sorted by x.
+    """
+    count = len(points)
+    if threshold >= count or threshold < 3:
+        return list(range(count))
+
+    kept = [0]
+    bucket_size = (count - 2) / (threshold - 2)
+    previous = 0
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # Average of the next bucket (just the last point for the final bucket)
+        next_start, next_end = end, min(int((bucket + 2) * bucket_size) + 1, count)
+        if next_start >= next_end:
+            next_start, next_end = count - 1, count
+        span = next_end - next_start
+        avg_x = sum(x for x, _ in points[next_start:next_end]) / span
+        avg_y = sum(y for _, y in points[next_start:next_end]) / span
+
+        prev_x, prev_y = points[previous]
+        best, best_area = start, -1.0
+        for index in range(start, end):
+            x, y = points[index]
+            # Twice the triangle's area; only the comparison matters
+            area = abs((prev_x - avg_x) * (y - prev_y) - (prev_x - x) * (avg_y - prev_y))
+            if area > best_area:
+                best, best_area = index, area
+        kept.append(best)
+        previous = best
+
+    kept.append(count - 1)
+    return kept
@@ -0,0 +1,32 @@
+"""
+Production WSGI entrypoint
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is built once in the gunicorn master (preload_app) and shared with
+the workers copy-on-write; each worker then opens its own DB connections and,
+when WARMUP=1, warms up before it accepts traffic (see gunicorn.conf.py).
+"""
+
+import os
+import time
+
+_start = time.perf_counter()
+
+from app import create_app
+from ratelimit import trust_proxies
+
+app = create_app({
+    # Migrations are run from the CLI, never by the web workers
+    'ENABLE_MIGRATIONS': False,
+    'SQLALCHEMY_ENGINE_OPTIONS': {
+        'pool_pre_ping': True,
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '5')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '10')),
+    },
+})
+# Behind nginx (or a load balancer) per-IP rate limits need the real client address
+trust_proxies(app)
+
+# Time spent importing and building the app, reported by gunicorn.conf.py
+startup_seconds = time.perf_counter() - _start
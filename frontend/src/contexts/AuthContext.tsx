@@ -15,6 +15,7 @@ export interface User {
   daily_protein_goal: number;
   daily_carb_goal: number;
   daily_fat_goal: number;
+  goals_auto_calculated: boolean;
   created_at: string;
   last_login: string | null;
 }
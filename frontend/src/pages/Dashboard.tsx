@@ -1,7 +1,8 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { 
   Container, Typography, Paper, Box, Grid as MuiGrid, Divider, Card, CardContent,
-  LinearProgress, Stack, useTheme, Chip, Tabs, Tab
+  LinearProgress, Stack, useTheme, Chip, Tabs, Tab,
+  Dialog, DialogTitle, DialogContent, DialogActions, TextField, FormControlLabel, Checkbox
 } from '@mui/material';
 import { alpha } from '@mui/material/styles';
 import { Bar, Line } from 'react-chartjs-2';
@@ -18,10 +19,12 @@ import {
   Legend,
   Filler,
 } from 'chart.js';
-import { getDailyMeals, UserMeal, DailyMealsResponse, deleteUserMeal } from '../services/api';
+import {
+  getDailyMeals, getMealChanges, openMealEventStream, UserMeal, DailyMealsResponse, deleteUserMeal,
+  getWeightHistory, logWeight, WeightEntry, batchGet
+} from '../services/api';
 import { 
   mockNutritionHistory, 
-  mockWeightHistory, 
   mockStreakData,
   getWeightTrend,
   DailyNutrition 
@@ -59,7 +62,7 @@ const Grid = MuiGrid as any;
 
 const Dashboard = () => {
   const theme = useTheme();
-  const { user } = useAuth();
+  const { user, updateUser } = useAuth();
   const [activeTab, setActiveTab] = useState(0);
   const [meals, setMeals] = useState<UserMeal[]>([]);
   const [groupedMeals, setGroupedMeals] = useState<Array<UserMeal & { count: number }>>([]);
@@ -70,7 +73,12 @@ const Dashboard = () => {
   // Analytics state
   const [timePeriod, setTimePeriod] = useState<'7days' | '30days'>('7days');
   const [nutritionHistory, setNutritionHistory] = useState<DailyNutrition[]>([]);
-  const [weightTrend, setWeightTrend] = useState(getWeightTrend(mockWeightHistory));
+  const [weightHistory, setWeightHistory] = useState<WeightEntry[]>([]);
+  const [weightDialogOpen, setWeightDialogOpen] = useState(false);
+  const [newWeight, setNewWeight] = useState('');
+  const [recalculateGoals, setRecalculateGoals] = useState(false);
+  const weightTrend = getWeightTrend(weightHistory);
+  const latestWeight = weightHistory.length > 0 ? weightHistory[weightHistory.length - 1].weight : user?.weight;
   
   const goals = dailyData?.goals || {
     calories: user?.daily_calorie_goal || 2000,
@@ -105,14 +113,37 @@ const Dashboard = () => {
     return Object.values(mealGroups);
   };
   
+  const applyDailyData = (data: DailyMealsResponse) => {
+    setDailyData(data);
+    setMeals(data.meals);
+    setGroupedMeals(groupIdenticalMeals(data.meals));
+  };
+
   const fetchDailyData = async () => {
     try {
       setIsLoading(true);
       setError(null);
-      const data = await getDailyMeals(today);
-      setDailyData(data);
-      setMeals(data.meals);
-      setGroupedMeals(groupIdenticalMeals(data.meals));
+      applyDailyData(await getDailyMeals(today));
+    } catch (err) {
+      setError(err instanceof Error ? err.message : 'Failed to load meals');
+    } finally {
+      setIsLoading(false);
+    }
+  };
+
+  // First load: today's meals and the weight chart in one round trip
+  const fetchDashboard = async () => {
+    try {
+      setIsLoading(true);
+      setError(null);
+      const [daily, weight] = await batchGet([`/user-meals/daily/${today}`, '/weight']);
+      if (daily.status !== 200) {
+        throw new Error(daily.body?.error || 'Failed to load meals');
+      }
+      applyDailyData(daily.body);
+      if (weight.status === 200) {
+        setWeightHistory(weight.body.entries);
+      }
     } catch (err) {
       setError(err instanceof Error ? err.message : 'Failed to load meals');
     } finally {
@@ -120,20 +151,97 @@ const Dashboard = () => {
     }
   };
   
+  // Apply what changed since the last load instead of refetching the whole day
+  const syncDailyData = async () => {
+    if (!dailyData) {
+      return fetchDailyData();
+    }
+    const changes = await getMealChanges(dailyData.change_token);
+    if (changes.reset || changes.has_more) {
+      return fetchDailyData();
+    }
+    const deletedIds = new Set(changes.deleted.map(entry => entry.id));
+    const changedIds = new Set(changes.changed.map(entry => entry.id));
+    const updatedMeals = meals
+      .filter(entry => !deletedIds.has(entry.id) && !changedIds.has(entry.id))
+      .concat(changes.changed.filter(entry => entry.date_consumed === today))
+      .sort((a, b) => a.consumed_at.localeCompare(b.consumed_at));
+    const totals = updatedMeals.reduce(
+      (sum, entry) => ({
+        calories: sum.calories + (entry.calories || 0) * entry.serving_multiplier,
+        protein: sum.protein + (entry.protein || 0) * entry.serving_multiplier,
+        carbs: sum.carbs + (entry.carbs || 0) * entry.serving_multiplier,
+        fat: sum.fat + (entry.fat || 0) * entry.serving_multiplier,
+      }),
+      { calories: 0, protein: 0, carbs: 0, fat: 0 }
+    );
+    setDailyData({
+      ...dailyData,
+      meals: updatedMeals,
+      count: updatedMeals.length,
+      totals: {
+        calories: Math.floor(totals.calories),
+        protein: Math.round(totals.protein * 10) / 10,
+        carbs: Math.round(totals.carbs * 10) / 10,
+        fat: Math.round(totals.fat * 10) / 10,
+      },
+      change_token: changes.next,
+    });
+    setMeals(updatedMeals);
+    setGroupedMeals(groupIdenticalMeals(updatedMeals));
+  };
+  
   const handleDeleteMeal = async (mealId: number) => {
     try {
       await deleteUserMeal(mealId);
-      // Refresh data after deletion
-      await fetchDailyData();
+      await syncDailyData();
     } catch (err) {
       alert('Failed to delete meal');
     }
   };
 
   useEffect(() => {
-    fetchDailyData();
+    fetchDashboard();
   }, [today]);
 
+  // Meals logged elsewhere (e.g. from a phone) show up without polling
+  const syncRef = useRef(syncDailyData);
+  syncRef.current = syncDailyData;
+  useEffect(() => {
+    const source = openMealEventStream(event => {
+      if (event.dates.includes(today)) {
+        syncRef.current();
+      }
+    });
+    return () => source?.close();
+  }, [today]);
+
+  // The backend downsamples long histories, so this stays a few hundred points
+  const fetchWeightHistory = async () => {
+    try {
+      const data = await getWeightHistory();
+      setWeightHistory(data.entries);
+    } catch (err) {
+      console.error('Error fetching weight history:', err);
+    }
+  };
+
+  const handleLogWeight = async () => {
+    const weight = parseFloat(newWeight);
+    if (!(weight > 0)) {
+      return;
+    }
+    try {
+      const data = await logWeight({ weight, recalculate_goals: recalculateGoals });
+      updateUser(data.user);
+      setWeightDialogOpen(false);
+      setNewWeight('');
+      await fetchWeightHistory();
+    } catch (err) {
+      alert('Failed to log weight');
+    }
+  };
+
   // Load analytics data based on time period
   useEffect(() => {
     const days = timePeriod === '7days' ? 7 : 30;
@@ -264,19 +372,19 @@ const Dashboard = () => {
 
   // Weight Trend Chart
   const weightTrendData = {
-    labels: mockWeightHistory.map(entry => {
+    labels: weightHistory.map(entry => {
       const date = new Date(entry.date);
       return `${date.getMonth() + 1}/${date.getDate()}`;
     }),
     datasets: [
       {
         label: 'Weight (lbs)',
-        data: mockWeightHistory.map(entry => entry.weight),
+        data: weightHistory.map(entry => entry.weight),
         borderColor: theme.palette.info.main,
         backgroundColor: `${theme.palette.info.main}20`,
         fill: true,
         tension: 0.4,
-        pointRadius: 5,
+        pointRadius: weightHistory.length > 60 ? 0 : 5,
         pointHoverRadius: 7,
       },
     ],
@@ -902,7 +1010,7 @@ const Dashboard = () => {
                   </Box>
                   <Box sx={{ display: 'flex', alignItems: 'baseline', mb: 1 }}>
                     <Typography variant="h2" fontWeight="bold" color="text.primary">
-                      {mockWeightHistory[mockWeightHistory.length - 1].weight}
+                      {latestWeight ?? '—'}
                     </Typography>
                     <Typography variant="h6" color="text.secondary" sx={{ ml: 1 }}>
                       lbs
@@ -921,9 +1029,11 @@ const Dashboard = () => {
                       {weightTrend.change > 0 ? '+' : ''}{weightTrend.change} lbs ({weightTrend.percentage > 0 ? '+' : ''}{weightTrend.percentage}%)
                     </Typography>
                   </Box>
-                  <Typography variant="caption" color="text.secondary">
-                    Since {new Date(mockWeightHistory[0].date).toLocaleDateString()}
-                  </Typography>
+                  {weightHistory.length > 0 && (
+                    <Typography variant="caption" color="text.secondary">
+                      Since {new Date(weightHistory[0].date).toLocaleDateString()}
+                    </Typography>
+                  )}
                 </CardContent>
               </Card>
             </Grid>
@@ -1057,6 +1167,7 @@ const Dashboard = () => {
                         variant="outlined"
                         startIcon={<ScaleIcon />}
                         size="small"
+                        onClick={() => setWeightDialogOpen(true)}
                       >
                         Log Weight
                       </Button>
@@ -1065,6 +1176,35 @@ const Dashboard = () => {
                   <Box sx={{ height: 300 }}>
                     <Line data={weightTrendData} options={trendChartOptions} />
                   </Box>
+                  <Dialog open={weightDialogOpen} onClose={() => setWeightDialogOpen(false)}>
+                    <DialogTitle>Log Weight</DialogTitle>
+                    <DialogContent>
+                      <TextField
+                        autoFocus
+                        fullWidth
+                        margin="dense"
+                        label="Weight (lbs)"
+                        type="number"
+                        value={newWeight}
+                        onChange={(e) => setNewWeight(e.target.value)}
+                      />
+                      <FormControlLabel
+                        control={
+                          <Checkbox
+                            checked={recalculateGoals}
+                            onChange={(e) => setRecalculateGoals(e.target.checked)}
+                          />
+                        }
+                        label="Update my daily goals for the new weight"
+                      />
+                    </DialogContent>
+                    <DialogActions>
+                      <Button onClick={() => setWeightDialogOpen(false)}>Cancel</Button>
+                      <Button variant="contained" onClick={handleLogWeight} disabled={!newWeight}>
+                        Save
+                      </Button>
+                    </DialogActions>
+                  </Dialog>
                 </CardContent>
               </Card>
             </Grid>
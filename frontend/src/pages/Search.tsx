@@ -2,10 +2,10 @@ import { useState, useEffect } from 'react';
 import { 
   Container, Typography, TextField, Paper, Box, 
   Table, TableBody, TableCell, TableContainer, 
-  TableHead, TableRow, InputAdornment, Chip, CircularProgress
+  TableHead, TableRow, InputAdornment, Chip, CircularProgress, Autocomplete
 } from '@mui/material';
 import SearchIcon from '@mui/icons-material/Search';
-import { getMeals, getDiningHalls, Meal } from '../services/api';
+import { getMeals, getDiningHalls, suggestMeals, Meal, MealSuggestion } from '../services/api';
 
 const Search = () => {
   const [searchQuery, setSearchQuery] = useState('');
@@ -14,6 +14,7 @@ const Search = () => {
   const [diningHalls, setDiningHalls] = useState<any[]>([]);
   const [selectedDiningHall, setSelectedDiningHall] = useState<string | null>(null);
   const [isLoading, setIsLoading] = useState(true);
+  const [suggestions, setSuggestions] = useState<MealSuggestion[]>([]);
 
   useEffect(() => {
     const loadData = async () => {
@@ -34,6 +35,25 @@ const Search = () => {
     loadData();
   }, []);
 
+  // Typeahead: ask the server's prefix index on every keystroke, keeping only the latest answer
+  useEffect(() => {
+    if (!searchQuery.trim()) {
+      setSuggestions([]);
+      return;
+    }
+    let current = true;
+    suggestMeals(searchQuery)
+      .then((data) => {
+        if (current) setSuggestions(data.suggestions);
+      })
+      .catch(() => {
+        if (current) setSuggestions([]);
+      });
+    return () => {
+      current = false;
+    };
+  }, [searchQuery]);
+
   const handleSearch = (query: string) => {
     setSearchQuery(query);
     filterMeals(query, selectedDiningHall);
@@ -73,20 +93,44 @@ const Search = () => {
       </Typography>
       
       <Paper sx={{ p: 3, mb: 4 }}>
-        <TextField
-          fullWidth
-          label="Search for food items"
-          variant="outlined"
-          value={searchQuery}
-          onChange={(e) => handleSearch(e.target.value)}
-          placeholder="Search by food name or location"
-          InputProps={{
-            startAdornment: (
-              <InputAdornment position="start">
-                <SearchIcon />
-              </InputAdornment>
-            ),
+        <Autocomplete
+          freeSolo
+          options={suggestions}
+          // The server already matched and ranked them
+          filterOptions={(options) => options}
+          getOptionLabel={(option) => typeof option === 'string' ? option : option.name}
+          inputValue={searchQuery}
+          onInputChange={(_, value) => handleSearch(value)}
+          renderOption={(props, option) => {
+            const { key, ...optionProps } = props;
+            return (
+              <li key={key} {...optionProps}>
+                <Box>
+                  <Typography variant="body1">{option.name}</Typography>
+                  <Typography variant="body2" color="text.secondary">
+                    {option.dining_hall} · {option.calories} cal
+                  </Typography>
+                </Box>
+              </li>
+            );
           }}
+          renderInput={(params) => (
+            <TextField
+              {...params}
+              fullWidth
+              label="Search for food items"
+              variant="outlined"
+              placeholder="Search by food name or location"
+              InputProps={{
+                ...params.InputProps,
+                startAdornment: (
+                  <InputAdornment position="start">
+                    <SearchIcon />
+                  </InputAdornment>
+                ),
+              }}
+            />
+          )}
         />
         
         <Box sx={{ mt: 2, display: 'flex', flexWrap: 'wrap', gap: 1 }}>
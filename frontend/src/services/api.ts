@@ -1,6 +1,8 @@
 // API Service for TempleCals Backend
 // Handles all API requests with authentication
 
+import type { User } from '../contexts/AuthContext';
+
 const API_BASE_URL = 'http://127.0.0.1:5001/api';
 
 // Helper function to get auth token
@@ -99,6 +101,7 @@ export interface MealSearchParams {
   dining_hall_id?: number;
   category_id?: number;
   search?: string;
+  sort?: 'popular';
 }
 
 export const getMeals = async (params?: MealSearchParams): Promise<Meal[]> => {
@@ -113,6 +116,9 @@ export const getMeals = async (params?: MealSearchParams): Promise<Meal[]> => {
   if (params?.search) {
     queryParams.append('search', params.search);
   }
+  if (params?.sort) {
+    queryParams.append('sort', params.sort);
+  }
   
   const url = `${API_BASE_URL}/meals${queryParams.toString() ? '?' + queryParams.toString() : ''}`;
   
@@ -122,6 +128,51 @@ export const getMeals = async (params?: MealSearchParams): Promise<Meal[]> => {
   return handleResponse(response);
 };
 
+export interface PopularMeal extends Meal {
+  log_count: number;
+}
+
+export interface PopularMealsResponse {
+  hall_id: number | null;
+  window: 'today' | 'week' | 'month';
+  meals: PopularMeal[];
+}
+
+export const getPopularMeals = async (
+  hall?: number,
+  window: 'today' | 'week' | 'month' = 'today',
+  limit = 10
+): Promise<PopularMealsResponse> => {
+  const queryParams = new URLSearchParams({ window, limit: limit.toString() });
+  if (hall) {
+    queryParams.append('hall', hall.toString());
+  }
+  const response = await fetch(`${API_BASE_URL}/meals/popular?${queryParams.toString()}`, {
+    headers: createHeaders(),
+  });
+  return handleResponse(response);
+};
+
+export interface MealSuggestion {
+  id: number;
+  name: string;
+  dining_hall: string | null;
+  calories: number;
+}
+
+export interface MealSuggestResponse {
+  query: string;
+  suggestions: MealSuggestion[];
+}
+
+export const suggestMeals = async (q: string, limit = 8): Promise<MealSuggestResponse> => {
+  const queryParams = new URLSearchParams({ q, limit: limit.toString() });
+  const response = await fetch(`${API_BASE_URL}/meals/suggest?${queryParams.toString()}`, {
+    headers: createHeaders(),
+  });
+  return handleResponse(response);
+};
+
 export const getMeal = async (mealId: number): Promise<Meal> => {
   const response = await fetch(`${API_BASE_URL}/meals/${mealId}`, {
     headers: createHeaders(),
@@ -141,6 +192,12 @@ export interface UserMeal {
   notes: string | null;
   created_at: string;
   meal: Meal;
+  // Nutrition per serving as it was when logged; meal has the current menu values
+  calories: number | null;
+  protein: number | null;
+  carbs: number | null;
+  fat: number | null;
+  sodium: number | null;
   total_calories: number;
   total_protein: number;
   total_carbs: number;
@@ -203,6 +260,8 @@ export interface DailyMealsResponse {
     carbs: number;
     fat: number;
   };
+  // Pass to getMealChanges to hear about anything written after this response
+  change_token: string;
 }
 
 export const getDailyMeals = async (date: string): Promise<DailyMealsResponse> => {
@@ -213,6 +272,116 @@ export const getDailyMeals = async (date: string): Promise<DailyMealsResponse> =
   return handleResponse(response);
 };
 
+export interface MealRangeResponse {
+  start: string;
+  end: string;
+  days: DailyMealsResponse[];
+  count: number;
+}
+
+// Fetch a week/month of daily groups in one request instead of one per day
+export const getMealRange = async (start: string, end: string): Promise<MealRangeResponse> => {
+  const queryParams = new URLSearchParams({ start, end });
+  const response = await fetch(`${API_BASE_URL}/user-meals/range?${queryParams.toString()}`, {
+    method: 'GET',
+    headers: createHeaders(true),
+  });
+  return handleResponse(response);
+};
+
+export interface BreakdownNutrition {
+  count: number;
+  calories: number;
+  protein: number;
+  carbs: number;
+  fat: number;
+}
+
+export interface BreakdownGroup extends BreakdownNutrition {
+  id: number;
+  name: string;
+  share: number;
+}
+
+export interface MealBreakdownResponse {
+  start: string;
+  end: string;
+  by: 'hall' | 'category' | 'meal';
+  groups: BreakdownGroup[];
+  other: BreakdownNutrition & { groups: number };
+  totals: BreakdownNutrition;
+}
+
+// Where the calories in a range came from: top dining halls, categories or meals
+export const getMealBreakdown = async (
+  start: string,
+  end: string,
+  by: 'hall' | 'category' | 'meal' = 'hall',
+  limit?: number
+): Promise<MealBreakdownResponse> => {
+  const queryParams = new URLSearchParams({ start, end, by });
+  if (limit) {
+    queryParams.append('limit', limit.toString());
+  }
+  const response = await fetch(`${API_BASE_URL}/user-meals/breakdown?${queryParams.toString()}`, {
+    method: 'GET',
+    headers: createHeaders(true),
+  });
+  return handleResponse(response);
+};
+
+// Download the full history; the response is streamed, so read it as a Blob
+export const exportMealHistory = async (format: 'csv' | 'ndjson' = 'csv'): Promise<Blob> => {
+  const response = await fetch(`${API_BASE_URL}/user-meals/export?format=${format}`, {
+    method: 'GET',
+    headers: createHeaders(true),
+  });
+  if (!response.ok) {
+    await handleResponse(response);
+  }
+  return response.blob();
+};
+
+export interface MealChangesResponse {
+  changed: UserMeal[];
+  deleted: Array<{ id: number; date_consumed: string; deleted_at: string }>;
+  next: string;
+  has_more: boolean;
+  // True when the client should drop what it has cached and use this response instead
+  reset: boolean;
+}
+
+// Entries created, updated or deleted since a change token; apply them by id
+export const getMealChanges = async (since?: string): Promise<MealChangesResponse> => {
+  const query = since ? `?since=${encodeURIComponent(since)}` : '';
+  const response = await fetch(`${API_BASE_URL}/user-meals/changes${query}`, {
+    method: 'GET',
+    headers: createHeaders(true),
+  });
+  return handleResponse(response);
+};
+
+export interface MealStreamEvent {
+  type: 'logged' | 'updated' | 'deleted';
+  dates: string[];
+  user_meal?: UserMeal;
+  id?: number;
+}
+
+// Live log/update/delete events for the current user (Server-Sent Events).
+// EventSource cannot send headers, so the token goes in the query string.
+export const openMealEventStream = (onEvent: (event: MealStreamEvent) => void): EventSource | null => {
+  const token = getAuthToken();
+  if (!token) {
+    return null;
+  }
+  const source = new EventSource(`${API_BASE_URL}/user-meals/stream?token=${encodeURIComponent(token)}`);
+  ['logged', 'updated', 'deleted'].forEach(type => {
+    source.addEventListener(type, message => onEvent(JSON.parse((message as MessageEvent).data)));
+  });
+  return source;
+};
+
 export const deleteUserMeal = async (userMealId: number): Promise<{ message: string }> => {
   const response = await fetch(`${API_BASE_URL}/user-meals/${userMealId}`, {
     method: 'DELETE',
@@ -238,3 +407,85 @@ export const updateUserMeal = async (
   });
   return handleResponse(response);
 };
+
+// ==================== WEIGHT ====================
+
+export interface WeightEntry {
+  id: number;
+  weight: number; // in lbs
+  measured_at: string;
+  date: string;
+  notes?: string;
+}
+
+export interface WeightHistoryResponse {
+  start: string | null;
+  end: string | null;
+  entries: WeightEntry[];
+  count: number;
+  downsampled: boolean;
+}
+
+// Weigh-ins in a date range; the backend downsamples long ranges to at most `points`
+export const getWeightHistory = async (
+  start?: string,
+  end?: string,
+  points: number = 200
+): Promise<WeightHistoryResponse> => {
+  const params = new URLSearchParams({ points: String(points) });
+  if (start) params.append('start', start);
+  if (end) params.append('end', end);
+  const response = await fetch(`${API_BASE_URL}/weight?${params}`, {
+    headers: createHeaders(true),
+  });
+  return handleResponse(response);
+};
+
+export interface LogWeightRequest {
+  weight: number;
+  measured_at?: string;
+  notes?: string;
+  recalculate_goals?: boolean;
+}
+
+export const logWeight = async (data: LogWeightRequest): Promise<{
+  message: string;
+  entry: WeightEntry;
+  user: User;
+  recommended_macros: Record<string, number> | null;
+}> => {
+  const response = await fetch(`${API_BASE_URL}/weight`, {
+    method: 'POST',
+    headers: createHeaders(true),
+    body: JSON.stringify(data),
+  });
+  return handleResponse(response);
+};
+
+export const deleteWeightEntry = async (entryId: number): Promise<{ message: string; user: User }> => {
+  const response = await fetch(`${API_BASE_URL}/weight/${entryId}`, {
+    method: 'DELETE',
+    headers: createHeaders(true),
+  });
+  return handleResponse(response);
+};
+
+// ==================== BATCH ====================
+
+export interface BatchResult<T = any> {
+  path: string;
+  status: number;
+  body: T;
+}
+
+// Several GETs in one round trip; paths are relative to the API base (e.g. '/auth/me').
+// Each result carries its own status, so one failure does not fail the rest
+export const batchGet = async (paths: string[]): Promise<BatchResult[]> => {
+  const response = await fetch(`${API_BASE_URL}/batch`, {
+    method: 'POST',
+    headers: createHeaders(true),
+    body: JSON.stringify({ requests: paths.map(path => ({ method: 'GET', path: `/api${path}` })) }),
+  });
+  const data = await handleResponse(response);
+  return data.responses;
+};
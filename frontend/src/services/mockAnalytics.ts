@@ -1,4 +1,6 @@
-// Mock data for analytics features: trends, streaks, weight tracking
+// Mock data for analytics features: trends and streaks (weight history comes from /api/weight)
+
+import type { WeightEntry } from './api';
 
 export interface DailyNutrition {
   date: string;
@@ -10,12 +12,6 @@ export interface DailyNutrition {
   metProteinGoal: boolean;
 }
 
-export interface WeightEntry {
-  date: string;
-  weight: number; // in lbs
-  notes?: string;
-}
-
 export interface StreakData {
   currentStreak: number;
   longestStreak: number;
@@ -59,18 +55,6 @@ export const generateMockNutritionHistory = (days: number = 30): DailyNutrition[
   return data;
 };
 
-// Mock weight tracking data
-export const mockWeightHistory: WeightEntry[] = [
-  { date: '2024-09-01', weight: 185.2 },
-  { date: '2024-09-08', weight: 184.6 },
-  { date: '2024-09-15', weight: 183.9 },
-  { date: '2024-09-22', weight: 183.2 },
-  { date: '2024-09-29', weight: 182.8 },
-  { date: '2024-10-06', weight: 182.1 },
-  { date: '2024-10-13', weight: 181.5, notes: 'Feeling great!' },
-  { date: '2024-10-19', weight: 181.0 },
-];
-
 // Calculate streak based on nutrition history
 export const calculateStreak = (history: DailyNutrition[]): StreakData => {
   let currentStreak = 0;
@@ -111,18 +95,6 @@ export const calculateStreak = (history: DailyNutrition[]): StreakData => {
   };
 };
 
-// Mock function to add weight entry
-export const addWeightEntry = (weight: number, notes?: string): WeightEntry => {
-  const newEntry: WeightEntry = {
-    date: new Date().toISOString().split('T')[0],
-    weight,
-    notes
-  };
-  
-  mockWeightHistory.push(newEntry);
-  return newEntry;
-};
-
 // Get weight trend (gain/loss over period)
 export const getWeightTrend = (history: WeightEntry[]): {
   change: number;